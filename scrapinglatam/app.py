@@ -2,10 +2,10 @@ import os
 import json
 import time
 import subprocess
-import signal
 import streamlit as st
 import sys
 import pandas as pd
+from datetime import date
 # Asegúrate de que streamlit_tags esté instalado: pip install streamlit-tags
 from streamlit_tags import st_tags
 
@@ -18,9 +18,21 @@ sys.path.append(BASE_DIR)
 CONFIG_PATH = os.path.join(BASE_DIR, "scrapinglatam", "crawler_config.json")
 OUTPUT_CSV = os.path.join(BASE_DIR, "scrapinglatam", "latam_leads.csv")
 AUDIT_PATH = os.path.join(BASE_DIR, "scrapinglatam", "audits", "latam_audit.ndjson")
-SCRIPT = os.path.join(BASE_DIR, "scrapinglatam", "latam_lead_crawler_serpapi.py")
+WORKER_SCRIPT = os.path.join(BASE_DIR, "scrapinglatam", "crawler_worker.py")
 STYLES_PATH = os.path.join(BASE_DIR, "scrapinglatam", "styles.css")
 DEFAULT_CATEGORIES_PATH = os.path.join(BASE_DIR, "scrapinglatam", "default_categories.json")
+SERP_DONE_PATH = os.path.join(BASE_DIR, "scrapinglatam", "serpapi_done.json")
+LEDGER_PATH = os.path.join(BASE_DIR, "scrapinglatam", "audits", "serpapi_ledger.ndjson")
+BALANCE_REFRESH_MINUTES = 5 # el saldo real se consulta como mucho cada X minutos
+LIVE_REFRESH_SECONDS = 1.0 # refresco de los paneles en vivo (fragmentos) mientras hay un trabajo activo
+
+from scrapinglatam.query_planner import query_permutations, load_history, plan_queries
+from scrapinglatam.credit_ledger import BalanceCache
+from scrapinglatam.crawler_worker import JobQueue, JOBS_DB_PATH, WORKER_LOG_PATH, ACTIVE_STATUSES
+from scrapinglatam.latam_lead_crawler_serpapi import CrawlerConfig
+from scrapinglatam.lead_export import LeadFilter, FORMATS, cached_export, country_name
+from scrapinglatam.lead_store import LeadStore
+from scrapinglatam.audit_rollups import AuditRollups, tail_lines
 
 
 DEFAULT_COUNTRIES = [
@@ -80,15 +92,18 @@ def load_config():
 config = load_config()
 
 # --- Función para guardar la configuración ---
-def write_config(countries_codes, categories, max_queries, results_per_query):
+def write_config(countries_codes, categories, max_queries, results_per_query, credit_budget=0):
     """Guarda la configuración actual en la ruta definida."""
-    cfg = {
+    # Se conservan las claves que la UI no gestiona (p.ej. DENYLIST_HOSTS)
+    cfg = load_config()
+    cfg.update({
         "COUNTRIES_QUERY": countries_codes,
         "CATEGORIES": categories,
         "MAX_QUERIES": int(max_queries),
         "RESULTS_PER_QUERY": int(results_per_query),
+        "CREDIT_BUDGET": int(credit_budget),
         "OUTPUT_CSV": OUTPUT_CSV, # Usar la constante global
-    }
+    })
     with open(CONFIG_PATH, "w", encoding="utf-8") as fh:
         json.dump(cfg, fh, ensure_ascii=False, indent=2)
 
@@ -107,22 +122,20 @@ st.sidebar.header("⚙️ Configuración del Rastreo") # Título actualizado
 # ------------------------------------------------------------------
 # 🔹 Estado de créditos de SerpAPI
 # ------------------------------------------------------------------
-import requests
+@st.cache_resource(show_spinner=False)
+def get_balance_cache(api_key: str):
+    """Un refresco en segundo plano por API key, compartido entre reruns y sesiones."""
+    return BalanceCache(api_key, LEDGER_PATH, refresh_seconds=BALANCE_REFRESH_MINUTES * 60)
 
 def get_serpapi_balance(api_key: str):
-    try:
-        url = f"https://serpapi.com/account?api_key={api_key}"
-        resp = requests.get(url, timeout=10)
-        data = resp.json()
-        # luego extraes:
-        used = int(data.get("this_month_usage", data.get("searches_per_month", 0)))
-        remaining = int(data.get("plan_searches_left", data.get("total_searches_left", 0)))
-        # el límite del plan se deduce:
-        limit = used + remaining
-        return used, remaining, limit
-    except Exception as e:
-        st.error(f"Error en get_serpapi_balance: {e}")
+    """Saldo cacheado + búsquedas del libro local; no hace red en el rerun."""
+    balance_cache = get_balance_cache(api_key)
+    snap = balance_cache.snapshot()
+    if snap is None:
+        if balance_cache.error:
+            st.error(f"Error en get_serpapi_balance: {balance_cache.error}")
         return None, None, None
+    return snap["used"], snap["remaining"], snap["limit"]
 
 # Campo de entrada de la API Key (con key único)
 serpapi_key = st.sidebar.text_input(
@@ -155,8 +168,15 @@ if serpapi_key:
             <p style="text-align:center; font-size:12px; margin-top:4px;">{used} / {limit} búsquedas usadas</p>
         """, unsafe_allow_html=True)
 
-    else:
+        snap = get_balance_cache(serpapi_key).snapshot()
+        if snap:
+            mins = int((time.time() - snap["fetched_at"]) // 60)
+            st.sidebar.caption(f"Saldo leído hace {mins} min · {snap['local']} búsquedas locales desde entonces")
+
+    elif get_balance_cache(serpapi_key).error:
         st.sidebar.warning("⚠️ No se pudo obtener el balance de créditos.")
+    else:
+        st.sidebar.caption("⏳ Consultando saldo de créditos...")
 else:
     st.sidebar.info("Introduce tu SERPAPI_KEY para ver el estado de créditos.")
 #serpapi_key = st.sidebar.text_input("SERPAPI_KEY", type="password", help="Tu API key de SerpAPI")
@@ -279,284 +299,326 @@ with colB:
         key="results_per_query_input" # Usar una key
     )
 
+credit_budget = st.sidebar.number_input(
+    "Presupuesto de créditos (0 = sin tope)",
+    min_value=0, max_value=100000,
+    value=int(config.get("CREDIT_BUDGET", 0) or 0), step=1,
+    help="El plan prioriza las combinaciones País x Tema con mejor rendimiento histórico hasta agotar el presupuesto.",
+    key="credit_budget_input"
+)
+
 # 📌 LÓGICA DE GUARDADO DE CONFIG: Guardar si detectamos un cambio en los parámetros configurables
 current_config = {
     "COUNTRIES_QUERY": countries_codes,
     "CATEGORIES": st.session_state.get("categories", []),
     "MAX_QUERIES": int(max_queries),
     "RESULTS_PER_QUERY": int(results_per_query),
+    "CREDIT_BUDGET": int(credit_budget),
 }
 
 if config.get("COUNTRIES_QUERY") != current_config["COUNTRIES_QUERY"] or \
    config.get("CATEGORIES") != current_config["CATEGORIES"] or \
    config.get("MAX_QUERIES") != current_config["MAX_QUERIES"] or \
-   config.get("RESULTS_PER_QUERY") != current_config["RESULTS_PER_QUERY"]:
+   config.get("RESULTS_PER_QUERY") != current_config["RESULTS_PER_QUERY"] or \
+   config.get("CREDIT_BUDGET", 0) != current_config["CREDIT_BUDGET"]:
     
     # Escribir la nueva configuración si es diferente a la guardada
-    write_config(countries_codes, st.session_state["categories"], max_queries, results_per_query)
+    write_config(countries_codes, st.session_state["categories"], max_queries, results_per_query, credit_budget)
 
 
-def launch_crawler():
-    """Lanza el script de rastreo como un subproceso."""
-    env = os.environ.copy()
-    if serpapi_key:
-        env["SERPAPI_KEY"] = serpapi_key
-    return subprocess.Popen(
-        [sys.executable, "-u", SCRIPT],
-        stdout=subprocess.PIPE,
+# --- Plan de consultas previsto (coste y rendimiento esperado) ---
+def _mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else 0
+
+@st.cache_data(show_spinner=False)
+def load_yield_history(audit_mtime, csv_mtime, serp_mtime):
+    """Historial de rendimiento; se recalcula solo si cambian los archivos."""
+    return load_history(AUDIT_PATH, OUTPUT_CSV, SERP_DONE_PATH)
+
+yield_history = load_yield_history(_mtime(AUDIT_PATH), _mtime(OUTPUT_CSV), _mtime(SERP_DONE_PATH))
+# Páginas SERP por query calculadas como el crawler (mismo coste y misma lista con presupuesto)
+plan_config = CrawlerConfig.from_dict({**config, "RESULTS_PER_QUERY": int(results_per_query)})
+query_plan = plan_queries(
+    query_permutations(countries_codes, st.session_state.get("categories", [])),
+    yield_history, int(max_queries), int(credit_budget),
+    pages_per_query=plan_config.pages_per_query()
+)
+
+
+@st.cache_resource
+def get_job_queue():
+    """Cola de trabajos compartida con el worker (SQLite)."""
+    return JobQueue(JOBS_DB_PATH)
+
+
+def ensure_worker(job_queue):
+    """Arranca el worker persistente si no hay ninguno vivo (sobrevive a los reruns)."""
+    if job_queue.worker_alive():
+        return
+    os.makedirs(os.path.dirname(WORKER_LOG_PATH), exist_ok=True)
+    log = open(WORKER_LOG_PATH, "a", encoding="utf-8")
+    kwargs = {"start_new_session": True} if os.name != "nt" else {
+        "creationflags": getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0)
+    }
+    subprocess.Popen(
+        [sys.executable, "-u", WORKER_SCRIPT],
+        stdout=log,
         stderr=subprocess.STDOUT,
-        text=True,
-        env=env,
-        bufsize=1
+        cwd=BASE_DIR,
+        **kwargs
     )
+    log.close()
+
+
+job_queue = get_job_queue()
 
 # ------------------------------------------------------------------
 # 🔹 BLOQUE SUPERIOR EN MAIN: Controles (1/3) | Estado (2/3)
 # ------------------------------------------------------------------
 col1, col2 = st.columns([1, 2])
 
-# Inicialización de session_state para logs y proceso
-if "proc" not in st.session_state:
-    st.session_state["proc"] = None
-if "logbuf" not in st.session_state:
-    st.session_state["logbuf"] = ""
-if "query_count" not in st.session_state:
-    st.session_state["query_count"] = 0
-if "is_running" not in st.session_state:
-    st.session_state["is_running"] = False
+# Inicialización de session_state: el trabajo seguido por esta sesión
+if "job_id" not in st.session_state:
+    # Al recargar la página se retoma el último trabajo aún activo, si lo hay
+    active = [j for j in job_queue.list_jobs(limit=5) if j["status"] in ACTIVE_STATUSES]
+    st.session_state["job_id"] = active[0]["id"] if active else None
+
+job = job_queue.get_job(st.session_state["job_id"]) if st.session_state["job_id"] else None
 
 
 with col1:
     st.subheader("▶️ Control de Ejecución") # Título actualizado
+    # Previsión del plan antes de lanzar
+    colP1, colP2 = st.columns(2)
+    with colP1:
+        st.metric("Créditos previstos", query_plan["credits"])
+    with colP2:
+        st.metric("Leads esperados", f"{query_plan['expected_leads']:.0f}")
+    with st.expander(f"🧭 Plan ({len(query_plan['queries'])}/{query_plan['candidates']} consultas)", expanded=False):
+        if query_plan["queries"]:
+            st.dataframe(pd.DataFrame([
+                {
+                    "consulta": q["query"],
+                    "créditos": q["cost"],
+                    "leads esp.": round(q["expected_leads"], 2),
+                    "dominios esp.": round(q["expected_domains"], 1),
+                    "hist. leads": q["history_leads"],
+                    "hist. créditos": q["history_credits"],
+                } for q in query_plan["queries"]
+            ]), use_container_width=True, hide_index=True)
+        else:
+            st.caption("No hay consultas dentro del presupuesto.")
+
     if st.button("🔍 Iniciar Búsqueda", use_container_width=True):
-        if not serpapi_key:
-            st.warning("Define **SERPAPI_KEY** para iniciar.")
-        elif st.session_state.get("proc") and st.session_state["proc"].poll() is None:
-            st.info("Ya hay un proceso en ejecución.")
+        if not serpapi_key and not load_config().get("SERPAPI_KEYS"):
+            st.warning("Define **SERPAPI_KEY** (o SERPAPI_KEYS en crawler_config.json) para iniciar.")
+        elif job and job["status"] in ACTIVE_STATUSES:
+            st.info("Ya hay un trabajo en ejecución.")
         else:
             # 📌 CORRECCIÓN: Asegurar que el directorio 'audits' exista
             os.makedirs(os.path.dirname(AUDIT_PATH), exist_ok=True)
-            
-            st.session_state["proc"] = launch_crawler()
-            st.session_state["logbuf"] = ""
-            st.session_state["query_count"] = 0
-            st.session_state["is_running"] = True
-            st.success("Crawler iniciado. Recopilando logs...")
-            st.rerun() # Forzar rerun para iniciar inmediatamente el bucle de logs
+
+            # El trabajo lleva la configuración guardada; el worker la ejecuta en segundo plano
+            st.session_state["job_id"] = job_queue.enqueue(load_config(), serpapi_key)
+            ensure_worker(job_queue)
+            st.success("Trabajo encolado. Recopilando logs...")
+            st.rerun() # Forzar rerun para iniciar inmediatamente el seguimiento
 
     if st.button("⏹️ Detener Búsqueda", use_container_width=True): # Texto actualizado
-        if st.session_state.get("proc") and st.session_state["proc"].poll() is None:
+        if job and job["status"] in ACTIVE_STATUSES:
             try:
-                # Intento de parada gradual (SIGINT)
-                st.session_state["proc"].send_signal(signal.SIGINT)
-                
-                # Esperar 1 segundo para un cierre limpio.
-                time.sleep(1) 
-                
-                if st.session_state["proc"].poll() is None:
-                    # Si no se ha detenido, forzar terminación
-                    st.session_state["proc"].terminate()
-                
-                st.session_state["is_running"] = False
-                st.session_state["proc"] = None
-                st.success("Proceso detenido.")
+                # Parada gradual: el worker termina la consulta en curso y cierra el trabajo
+                job_queue.request_cancel(job["id"])
+                st.success("Cancelación solicitada.")
                 st.rerun()
             except Exception as e:
                 st.error(f"No se pudo detener: {e}")
         else:
-            st.info("No hay proceso de rastreo activo para detener.")
+            st.info("No hay trabajo de rastreo activo para detener.")
 
 
-with col2:
-    st.subheader("📈 Estado Actual del Rastreo") # Título actualizado
+def job_active(j):
+    return bool(j) and j["status"] in ACTIVE_STATUSES
+
+
+# Mientras hay un trabajo activo, solo los paneles en vivo (fragmentos) se refrescan con
+# temporizador; el resto del script (saldo, config, plan, vista de leads, auditoría) no se
+# vuelve a ejecutar hasta que el usuario interactúa o el trabajo termina.
+live_every = LIVE_REFRESH_SECONDS if job_active(job) else None
+
+
+@st.fragment(run_every=live_every)
+def live_job_panel(started_active):
+    """Progreso, estado y contadores del trabajo seguido; se refresca solo."""
+    job = job_queue.get_job(st.session_state["job_id"]) if st.session_state["job_id"] else None
+    if started_active and not job_active(job):
+        # El trabajo acaba de terminar: un rerun completo actualiza leads y auditoría
+        # y deja los fragmentos sin temporizador
+        st.rerun()
+
+    current_queries = job["queries_done"] if job else 0
+
+    # El total es el número de consultas del plan del trabajo (puede ser menor que MAX_QUERIES)
+    planned_queries = (job and job["queries_total"]) or len(query_plan["queries"]) or max_queries
 
-    proc = st.session_state["proc"]
-    is_running = st.session_state["is_running"]
-    current_queries = st.session_state["query_count"]
-    
     # 1. Calcule el porcentaje de progreso (Asegura que no se divide por cero y no excede 1.0)
-    if max_queries > 0:
-        progress_ratio = min(1.0, current_queries / max_queries)
+    if planned_queries > 0:
+        progress_ratio = min(1.0, current_queries / planned_queries)
     else:
         progress_ratio = 0.0
 
     # 2. Muestre la barra de progreso (siempre visible)
     progress_bar = st.progress(
         progress_ratio, 
-        text=f"Progreso de Consultas: **{current_queries}/{max_queries}** ({int(progress_ratio * 100)}%)"
+        text=f"Progreso de Consultas: **{current_queries}/{planned_queries}** ({int(progress_ratio * 100)}%)"
     )
 
-    # --- Lógica de captura de logs (debe permanecer aquí para leer el subproceso) ---
-    if proc and proc.poll() is None: # Proceso en ejecución
-        
-        # Leemos logs de forma no bloqueante
-        lines_read = 0
-        log_chunk = ""
-        
-        try:
-            # Leer hasta 5 líneas por rerun o hasta que se vacíe el buffer
-            while lines_read < 5: 
-                line = proc.stdout.readline()
-                if not line: # La tubería está vacía por ahora
-                    break 
-                log_chunk += line
-                if "[QUERY]" in line:
-                    # Actualizar el contador de consultas
-                    st.session_state["query_count"] += 1
-                lines_read += 1
-        except Exception:
-            # Captura un posible error si el proceso muere durante la lectura
-            pass
+    # --- Seguimiento del trabajo (el estado vive en la cola, no en esta sesión) ---
+    if job_active(job):
+        # --- ESTADO VISIBLE (arriba) ---
+        if job["status"] == "queued":
+            if not job_queue.worker_alive():
+                ensure_worker(job_queue)
+            st.info(f"⏳ **Trabajo #{job['id']} en cola**. Esperando al worker...")
+        elif job["status"] == "cancel_requested":
+            st.info(f"⏹️ **Cancelando trabajo #{job['id']}**. Terminando la consulta en curso...")
+        else:
+            st.info(f"⚙️ **Crawler en ejecución** (trabajo #{job['id']}). Recopilando logs...")
+
+        # Contadores en vivo (de la cola de trabajos: no tocan el CSV ni la auditoría)
+        colL1, colL2, colL3, colL4 = st.columns(4)
+        with colL1:
+            st.metric("Consultas", f"{current_queries}/{planned_queries}")
+        with colL2:
+            st.metric("Leads", job["leads"])
+        with colL3:
+            st.metric("Créditos", job["credits_spent"])
+        with colL4:
+            elapsed = int(max(0, time.time() - (job["started_at"] or job["created_at"])))
+            st.metric("Tiempo", f"{elapsed // 60}:{elapsed % 60:02d}")
+
+    elif job and job["status"] == "done":
+        # 3. Actualizar barra a 100% al finalizar
+        progress_bar.progress(1.0, text=f"Progreso de Consultas: **{current_queries}/{planned_queries} (100%)**")
 
-        st.session_state["logbuf"] += log_chunk
-        
         # --- ESTADO VISIBLE (arriba) ---
-        st.info(f"⚙️ **Crawler en ejecución**. Recopilando logs y actualizando progreso...")
+        st.success(f"✅ Búsqueda **finalizada** (trabajo #{job['id']}): {job['leads']} leads, {job['credits_spent']} créditos.")
 
-        # Forzar rerun solo si hay logs o el proceso sigue vivo para actualizar UI/logs
-        if lines_read > 0 or proc.poll() is None:
-            time.sleep(0.5) # Pausa breve para no sobrecargar el rerunning
-            st.rerun() 
+    elif job and job["status"] == "cancelled":
+        st.warning(f"⏹️ Trabajo #{job['id']} cancelado: {job['leads']} leads, {job['credits_spent']} créditos.")
 
-    elif proc and proc.poll() is not None: # Proceso terminó
-        st.session_state["is_running"] = False
-        
-        # 3. Actualizar barra a 100% al finalizar
-        progress_bar.progress(1.0, text=f"Progreso de Consultas: **{current_queries}/{max_queries} (100%)**")
+    elif job and job["status"] == "failed":
+        st.error(f"❌ Trabajo #{job['id']} fallido: {job['error']}")
 
+    else: # No hay trabajo activo
         # --- ESTADO VISIBLE (arriba) ---
-        st.success("✅ Búsqueda **finalizada**. Proceso terminado con código de salida: " + str(proc.poll()))
-        
-        st.session_state["proc"] = None
-
-    else: # No hay proceso activo
-        # El progreso ya se muestra correctamente debido a que st.progress se inicializa con
-        # el estado persistente (current_queries)
-        if is_running:
-             # --- ESTADO VISIBLE (arriba) ---
-             st.info("⚙️ **Crawler en ejecución** (estado previo).")
-        else:
-            # --- ESTADO VISIBLE (arriba) ---
-            st.write("📌 **Crawler detenido / Inactivo.** Pulse 'Iniciar Búsqueda' para comenzar.")
+        st.write("📌 **Crawler detenido / Inactivo.** Pulse 'Iniciar Búsqueda' para comenzar.")
 
 
-# ------------------------------------------------------------------
-# 🔹 BOTÓN DE DESCARGA EN EL SIDEBAR (al final)
-# ------------------------------------------------------------------
-with st.sidebar:
-    st.markdown("---")
-    st.subheader("💾 Gestión de Archivos") # Título actualizado
-    if os.path.exists(OUTPUT_CSV):
-        with open(OUTPUT_CSV, "rb") as f:
-            st.download_button(
-                "⬇️ Descargar CSV",
-                f,
-                file_name=os.path.basename(OUTPUT_CSV),
-                mime="text/csv",
-                use_container_width=True
-            )
-    else:
-        st.download_button(
-            "⬇️ Descargar CSV",
-            data=b"",
-            file_name=os.path.basename(OUTPUT_CSV),
-            disabled=True,
-            use_container_width=True,
-            help="El archivo CSV aún no existe o está vacío."
-        )
+with col2:
+    st.subheader("📈 Estado Actual del Rastreo") # Título actualizado
+
+    live_job_panel(job_active(job))
+
+    recent_jobs = job_queue.list_jobs(limit=10)
+    if recent_jobs:
+        with st.expander("🗂️ Trabajos recientes", expanded=False):
+            st.dataframe(pd.DataFrame([
+                {
+                    "trabajo": j["id"],
+                    "estado": j["status"],
+                    "creado": time.strftime("%Y-%m-%d %H:%M", time.localtime(j["created_at"])),
+                    "consultas": f"{j['queries_done']}/{j['queries_total']}",
+                    "leads": j["leads"],
+                    "créditos": j["credits_spent"],
+                } for j in recent_jobs
+            ]), use_container_width=True, hide_index=True)
+
 
 # ------------------------------------------------------------------
 # 🔹 VISTA PREVIA DEL CSV MAESTRO (pantalla completa)
 # ------------------------------------------------------------------
+@st.cache_resource
+def get_audit_rollups():
+    """Agregados de la auditoría (SQLite), al día con los bytes nuevos en cada rerun."""
+    return AuditRollups(AUDIT_PATH)
+
+
+@st.cache_resource
+def get_lead_store():
+    """Espejo SQLite del CSV (se sincroniza de forma incremental en cada rerun)."""
+    return LeadStore(OUTPUT_CSV)
+
+
 st.subheader("📋 Leads Encontrados (Vista Previa)") # Título actualizado
+lead_filter = LeadFilter() # filtros activos de la vista previa (también se aplican a la descarga)
 if os.path.exists(OUTPUT_CSV):
     try:
-        # Leer CSV
-        df = pd.read_csv(OUTPUT_CSV, encoding="utf-8-sig") 
-        df = df.loc[:, ~df.columns.str.startswith("Unnamed")]
-
-        # Normalizar país a nombre completo
-        if "country" in df.columns:
-            code_to_name = {
-                "ar": "Argentina", "cl": "Chile", "co": "Colombia",
-                "pe": "Perú", "uy": "Uruguay", "bo": "Bolivia",
-                "py": "Paraguay", "ve": "Venezuela", "ec": "Ecuador"
-            }
-            def to_full_country_name(val):
-                if pd.isna(val): return val
-                s = str(val).strip()
-                if s in COUNTRY_MAP.keys(): return s
-                s_lower = s.lower()
-                if s_lower.startswith("site:."):
-                    tld = s_lower.split("site:.", 1)[1].strip().lstrip(".")
-                    return code_to_name.get(tld, s)
-                if len(s) == 2: return code_to_name.get(s_lower, s)
-                return s
-            df["country"] = df["country"].apply(to_full_country_name)
-            
-        # Reordenar columnas
-        required_cols = ["country", "category", "domain", "email_best", "email_sent", "last_seen"]
-        df = df[[c for c in required_cols if c in df.columns]]
-
-        rename_map = {
-            "country": "País",
-            "category": "Categoría",
-            "domain": "Dominio",
-            "email_best": "Email",
-            "email_sent": "Email enviado",
-            "last_seen": "Fecha"
-        }
-        df = df.rename(columns={k: v for k, v in rename_map.items() if k in df.columns})
-
-        # Normalizar columna Email enviado → booleana
-        if "Email enviado" in df.columns:
-            df["Email enviado"] = df["Email enviado"].astype(str).str.lower().isin(["sí", "si", "true", "1"])
+        # Solo se leen las filas añadidas al CSV desde el último rerun
+        lead_store = get_lead_store()
+        lead_store.sync()
+        facets = lead_store.facets()
 
-        # --- Filtros ---
+        # --- Filtros (se resuelven en SQLite, no en memoria) ---
         col1_f, col2_f, col3_f = st.columns(3)
-        country_options = ["Todos"] + (sorted(df["País"].dropna().unique()) if "País" in df.columns else [])
-        category_options = ["Todos"] + (sorted(df["Categoría"].dropna().unique()) if "Categoría" in df.columns else [])
-
         with col1_f:
-            country_sel = st.selectbox("Filtrar por país", country_options)
+            country_sel = st.selectbox("Filtrar por país", ["Todos"] + facets["countries"])
         with col2_f:
-            category_sel = st.selectbox("Filtrar por categoría", category_options)
+            category_sel = st.selectbox("Filtrar por categoría", ["Todos"] + facets["categories"])
         with col3_f:
             email_status = st.selectbox("Email enviado", ["Todos", "No", "Sí"])
 
         fecha_inicio, fecha_fin = None, None
-        if "Fecha" in df.columns:
-            df["Fecha"] = pd.to_datetime(df["Fecha"], errors="coerce")
-            valid_dates = df["Fecha"].dropna()
-            if not valid_dates.empty:
-                min_date, max_date = valid_dates.min().date(), valid_dates.max().date()
-                colF1, colF2 = st.columns(2)
-                with colF1:
-                    fecha_inicio = st.date_input("Fecha desde", value=min_date, min_value=min_date, max_value=max_date)
-                with colF2:
-                    fecha_fin = st.date_input("Fecha hasta", value=max_date, min_value=min_date, max_value=max_date)
-
-        # Aplicar filtros
-        filtered = df.copy()
-        if "País" in filtered.columns and country_sel != "Todos":
-            filtered = filtered[filtered["País"] == country_sel]
-        if "Categoría" in filtered.columns and category_sel != "Todos":
-            filtered = filtered[filtered["Categoría"] == category_sel]
-        if "Email enviado" in filtered.columns and email_status != "Todos":
-            bool_value = (email_status == "Sí")
-            filtered = filtered[filtered["Email enviado"] == bool_value]
-        if "Fecha" in filtered.columns and fecha_inicio and fecha_fin:
-            filtered = filtered[(filtered["Fecha"].dt.date >= fecha_inicio) & (filtered["Fecha"].dt.date <= fecha_fin)]
-
-        # 🚀 Invertir orden
-        filtered_reversed = filtered.iloc[::-1].reset_index().rename(columns={"index": "_rowid"})
+        try:
+            min_date = date.fromisoformat(facets["min_day"]) if facets["min_day"] else None
+            max_date = date.fromisoformat(facets["max_day"]) if facets["max_day"] else None
+        except ValueError:
+            min_date = max_date = None
+        if min_date and max_date:
+            colF1, colF2 = st.columns(2)
+            with colF1:
+                fecha_inicio = st.date_input("Fecha desde", value=min_date, min_value=min_date, max_value=max_date)
+            with colF2:
+                fecha_fin = st.date_input("Fecha hasta", value=max_date, min_value=min_date, max_value=max_date)
+
+        search = st.text_input("Buscar dominio o email", placeholder="p. ej. uach.cl o admision@")
+
+        lead_filter = LeadFilter(
+            country=None if country_sel == "Todos" else country_sel,
+            category=None if category_sel == "Todos" else category_sel,
+            email_sent=None if email_status == "Todos" else email_status == "Sí",
+            date_from=fecha_inicio,
+            date_to=fecha_fin,
+        )
+
+        # 🚀 Paginación por clave: pila de cursores, se reinicia al cambiar filtros o búsqueda
+        page_key = (lead_filter.key(), search.strip().lower())
+        if st.session_state.get("page_key") != page_key:
+            st.session_state["page_key"] = page_key
+            st.session_state["page_cursors"] = [None]
+        cursors = st.session_state["page_cursors"]
+        rows, next_cursor = lead_store.page(lead_filter, search, before=cursors[-1])
+        filtered_total = lead_store.count(lead_filter, search)
+
+        rename_map = {
+            "country_name": "País",
+            "category": "Categoría",
+            "domain": "Dominio",
+            "email_best": "Email",
+            "sent": "Email enviado",
+            "last_seen": "Fecha"
+        }
+        page_df = pd.DataFrame(rows, columns=["_rowid", *rename_map]).rename(columns=rename_map)
+        page_df["Email enviado"] = page_df["Email enviado"].astype(bool)
+        page_df["Fecha"] = pd.to_datetime(page_df["Fecha"], errors="coerce")
 
         # 🚀 Tabla editable con checkboxes
         editable_df = st.data_editor(
-            filtered_reversed.head(100),
+            page_df,
             use_container_width=True,
             hide_index=True,
             column_config={
+                "_rowid": None,
                 "Email enviado": st.column_config.CheckboxColumn(
                     "Email enviado",
                     help="Marcar si el email fue enviado",
@@ -565,21 +627,29 @@ if os.path.exists(OUTPUT_CSV):
             }
         )
 
-        # Guardar si cambió
-        if not editable_df.equals(filtered_reversed.head(100)):
-            for _, row in editable_df.iterrows():
-                df.at[row["_rowid"], "Email enviado"] = row["Email enviado"]
-
-            # Convertir de nuevo a Sí/No antes de guardar
-            df["Email enviado"] = df["Email enviado"].map(lambda x: "Sí" if x else "No")
-
-            df_out = df.rename(columns={v: k for k, v in rename_map.items()})
-            df_out.to_csv(OUTPUT_CSV, index=False, encoding="utf-8-sig")
-
+        # Guardar si cambió (solo la columna "Email enviado" se persiste)
+        if not editable_df.equals(page_df):
+            changed = editable_df["Email enviado"] != page_df["Email enviado"]
+            lead_store.set_email_sent({
+                int(row["_rowid"]): bool(row["Email enviado"]) for _, row in editable_df[changed].iterrows()
+            })
             # 🚀 Fuerza a refrescar la tabla para evitar el bug
             st.rerun()
-            
-        st.caption(f"Mostrando las **100 filas más recientes** de {len(filtered)} filas filtradas (Total de registros: {len(df)})")
+
+        colN1, colN2, colN3 = st.columns([1, 2, 1])
+        with colN1:
+            if st.button("◀ Más recientes", disabled=len(cursors) == 1, use_container_width=True):
+                cursors.pop()
+                st.rerun()
+        with colN3:
+            if st.button("Más antiguos ▶", disabled=next_cursor is None, use_container_width=True):
+                cursors.append(next_cursor)
+                st.rerun()
+        with colN2:
+            st.caption(
+                f"Página **{len(cursors)}**: {len(rows)} filas de {filtered_total} filtradas "
+                f"(Total de registros: {lead_store.total()})"
+            )
 
     except Exception as e:
         st.error(f"Error al leer el CSV. Asegúrate de que el formato de las columnas sea correcto: {e}")
@@ -587,6 +657,39 @@ else:
     st.info("No se ha generado el CSV aún o la ruta es incorrecta. Asegúrate de que exista en: `scrapinglatam/latam_leads.csv`")
 
 
+# ------------------------------------------------------------------
+# 🔹 BOTÓN DE DESCARGA EN EL SIDEBAR (al final)
+# ------------------------------------------------------------------
+with st.sidebar:
+    st.markdown("---")
+    st.subheader("💾 Gestión de Archivos") # Título actualizado
+    export_fmt = st.selectbox("Formato de descarga", list(FORMATS), format_func=str.upper)
+    if os.path.exists(OUTPUT_CSV):
+        # Exporta en streaming solo las filas filtradas; se regenera únicamente si
+        # cambian el CSV, el formato o los filtros
+        try:
+            export_path = cached_export(export_fmt, lead_filter, OUTPUT_CSV)
+            with open(export_path, "rb") as f:
+                st.download_button(
+                    f"⬇️ Descargar {export_fmt.upper()} (filtrado)",
+                    f,
+                    file_name=f"{os.path.splitext(os.path.basename(OUTPUT_CSV))[0]}{FORMATS[export_fmt][1]}",
+                    mime=FORMATS[export_fmt][0],
+                    use_container_width=True
+                )
+        except Exception as e:
+            st.error(f"No se pudo preparar la descarga: {e}")
+    else:
+        st.download_button(
+            "⬇️ Descargar CSV",
+            data=b"",
+            file_name=os.path.basename(OUTPUT_CSV),
+            disabled=True,
+            use_container_width=True,
+            help="El archivo CSV aún no existe o está vacío."
+        )
+
+
 # ------------------------------------------------------------------
 # 🔹 AUDITORÍA Y LOGS (en desplegable)
 # ------------------------------------------------------------------
@@ -594,19 +697,27 @@ with st.expander("📜 Auditoría y Logs de Ejecución", expanded=False): # Tít
 
     # --- LOGS DE PROCESO (MOVIMIENTO DE CÓDIGO) ---
     st.markdown("#### 💬 Logs")
-    log_msg = "Logs aparecerán aquí al iniciar el rastreo..."
-    if st.session_state["logbuf"]:
-        log_msg = st.session_state["logbuf"]
-    
-    # Usar una clave dinámica para asegurar que el área de texto se actualiza correctamente
-    log_key = "current_logs" if st.session_state.get("proc") and st.session_state["proc"].poll() is None else "final_logs"
-    
-    st.text_area(
-        "Salida del subproceso (Scroll para ver los últimos eventos)", 
-        value=log_msg, 
-        height=240, 
-        key=log_key
-    )
+
+    @st.fragment(run_every=live_every)
+    def live_logs_panel():
+        """Últimas líneas del trabajo seguido; se refresca solo mientras está activo."""
+        job = job_queue.get_job(st.session_state["job_id"]) if st.session_state["job_id"] else None
+        log_msg = "Logs aparecerán aquí al iniciar el rastreo..."
+        job_logs = job_queue.tail_logs(job["id"]) if job else []
+        if job_logs:
+            log_msg = "\n".join(job_logs)
+
+        # Usar una clave dinámica para asegurar que el área de texto se actualiza correctamente
+        log_key = "current_logs" if job_active(job) else "final_logs"
+
+        st.text_area(
+            "Salida del trabajo (Scroll para ver los últimos eventos)", 
+            value=log_msg, 
+            height=240, 
+            key=log_key
+        )
+
+    live_logs_panel()
     
     st.markdown("---")
     st.markdown("#### 📊 Métricas de Auditoría (latam_audit.ndjson)")
@@ -621,48 +732,123 @@ with st.expander("📜 Auditoría y Logs de Ejecución", expanded=False): # Tít
         except Exception as e:
             st.error(f"No se pudo limpiar: {e}")
 
-    # --- CARGA Y DISPLAY DE MÉTRICAS DE AUDITORÍA ---
-    audit_rows = []
-    if os.path.exists(AUDIT_PATH):
-        try:
-            with open(AUDIT_PATH, "r", encoding="utf-8") as fh:
-                lines = fh.readlines()[-200:]
-            for ln in lines:
-                try:
-                    audit_rows.append(json.loads(ln))
-                except Exception:
-                    continue
-        except Exception:
-            pass
+    # --- MÉTRICAS DE TODO EL HISTÓRICO (agregados incrementales) ---
+    audit_rollups = get_audit_rollups()
+    audit_rollups.sync() # solo procesa los eventos añadidos desde el último rerun
+    audit_totals = audit_rollups.totals()
 
-    if audit_rows:
-        col1_a, col2_a, col3_a, col4_a = st.columns(4)
-        excl = sum(1 for r in audit_rows if r.get("exclusion_flag") == "Y")
+    if audit_totals:
+        col1_a, col2_a, col3_a, col4_a, col5_a = st.columns(5)
         
         with col1_a:
-            st.metric("Eventos (últimos)", len(audit_rows))
+            st.metric("Eventos (total)", audit_totals["events"])
         with col2_a:
-            st.metric("Exclusiones", excl)
+            st.metric("Exclusiones", audit_totals["exclusions"])
         with col3_a:
-            # Reutilizar col3_a para la métrica de emails, luego mover el siguiente
-            st.metric("Con emails", sum(1 for r in audit_rows if r.get("emails_found")))
-        # La métrica de tiempo medio está en col4_a
+            st.metric("Con emails", audit_totals["with_emails"], f"{audit_totals['yield']:.0%}", delta_color="off")
         with col4_a:
-            avg_time = int(sum(r.get("duration_ms", 0) or 0 for r in audit_rows) / max(1, len(audit_rows)))
-            st.metric("Tiempo medio (ms)", avg_time)
-
-        st.dataframe(pd.DataFrame([
-            {
-                "ts": r.get("timestamp"),
-                "dominio": r.get("domain"),
-                "http": r.get("http_status"),
-                "ms": r.get("duration_ms"),
-                "emails": ", ".join(r.get("emails_found", [])[:3]),
-                "email_best": r.get("email_best"),
-                "prio": r.get("priority"),
-                "excl": r.get("exclusion_flag"),
-            } for r in reversed(audit_rows)
-        ]), use_container_width=True)
+            st.metric("Tiempo medio (ms)", audit_totals["avg_ms"])
+        with col5_a:
+            st.metric("p50 / p95 (ms)", f"{audit_totals['p50_ms']} / {audit_totals['p95_ms']}")
+
+        def rollup_table(dim, label, fmt=lambda k: k or "(sin dato)"):
+            rows = audit_rollups.breakdown(dim)
+            st.dataframe(pd.DataFrame([
+                {
+                    label: fmt(r["key"]),
+                    "eventos": r["events"],
+                    "con emails": r["with_emails"],
+                    "rendimiento": f"{r['yield']:.0%}",
+                    "exclusiones": r["exclusions"],
+                    "ms medio": r["avg_ms"],
+                    "p50 ms": r["p50_ms"],
+                    "p95 ms": r["p95_ms"],
+                    "p99 ms": r["p99_ms"],
+                } for r in rows
+            ]), use_container_width=True, hide_index=True)
+
+        tab_day, tab_cat, tab_country, tab_query, tab_status, tab_source, tab_phase, tab_dom, tab_recent = st.tabs(
+            ["Por día", "Por categoría", "Por país", "Por consulta", "Por HTTP", "Por origen del email",
+             "Por fase de red", "Por dominio", "Últimos eventos"]
+        )
+        with tab_day:
+            rollup_table("day", "día")
+        with tab_cat:
+            rollup_table("category", "categoría")
+        with tab_country:
+            rollup_table("country", "país", lambda k: country_name(k) if k else "(sin dato)")
+        with tab_query:
+            rollup_table("query", "consulta")
+        with tab_status:
+            rollup_table("status", "http")
+        with tab_source:
+            # mailto / jsonld / footer = extracción estructurada; text = regex de respaldo
+            rollup_table("email_source", "origen", lambda k: k or "(sin email)")
+        with tab_phase:
+            # Dónde se va el tiempo de cada visita (solo eventos medidos con el backend aiohttp)
+            phase_labels = {
+                "queue_ms": "espera de conexión", "dns_ms": "DNS", "connect_ms": "conexión TCP",
+                "tls_ms": "TLS", "ttfb_ms": "primer byte (TTFB)", "download_ms": "descarga",
+                "bytes": "bytes recibidos", "redirects": "redirecciones",
+            }
+            phase_rows = audit_rollups.phases()
+            if not phase_rows:
+                st.info("Aún no hay eventos con tiempos por fase (requieren FETCHER_BACKEND = aiohttp).")
+            else:
+                st.dataframe(pd.DataFrame([
+                    {
+                        "fase": phase_labels.get(r["phase"], r["phase"]),
+                        "eventos": r["n"],
+                        "media": round(r["avg"], 1),
+                        "p50 ms": r.get("p50", ""),
+                        "p95 ms": r.get("p95", ""),
+                    } for r in phase_rows
+                ]), use_container_width=True, hide_index=True)
+                phase_dims = {"País": "country", "HTTP": "status", "Categoría": "category", "Día": "day"}
+                phase_dim = st.radio("Desglose por", list(phase_dims), horizontal=True, key="phase_dim")
+                st.dataframe(pd.DataFrame([
+                    {
+                        phase_dim.lower(): (country_name(r["key"]) if phase_dims[phase_dim] == "country" and r["key"]
+                                            else r["key"] or "(sin dato)"),
+                        "eventos": r["n"],
+                        **{f"{phase_labels[p]} (media)": round(r.get(p, 0.0), 1) for p in phase_labels},
+                    } for r in audit_rollups.phase_breakdown(phase_dims[phase_dim])
+                ]), use_container_width=True, hide_index=True)
+        with tab_dom:
+            st.dataframe(pd.DataFrame([
+                {
+                    "dominio": r["domain"],
+                    "eventos": r["events"],
+                    "con emails": r["with_emails"],
+                    "exclusiones": r["exclusions"],
+                    "ms medio": int(r["total_ms"] / max(1, r["events"])),
+                    "último http": r["last_status"],
+                    "última vez": r["last_seen"],
+                } for r in audit_rollups.top_domains()
+            ]), use_container_width=True, hide_index=True)
+        with tab_recent:
+            # Solo se leen las últimas líneas del archivo, no la auditoría entera
+            audit_rows = []
+            for ln in tail_lines(AUDIT_PATH, 200) if os.path.exists(AUDIT_PATH) else []:
+                try:
+                    audit_rows.append(json.loads(ln))
+                except Exception:
+                    continue
+            st.dataframe(pd.DataFrame([
+                {
+                    "ts": r.get("timestamp"),
+                    "dominio": r.get("domain"),
+                    "consulta": r.get("query", ""),
+                    "http": str(r.get("http_status")),
+                    "ms": r.get("duration_ms"),
+                    "ttfb ms": (r.get("timings") or {}).get("ttfb_ms"),
+                    "emails": ", ".join(r.get("emails_found", [])[:3]),
+                    "email_best": r.get("email_best"),
+                    "origen": r.get("email_source", ""),
+                    "prio": r.get("priority"),
+                    "excl": r.get("exclusion_flag"),
+                } for r in reversed(audit_rows)
+            ]), use_container_width=True)
     else:
         st.info("Aún no hay auditoría registrada.")
 
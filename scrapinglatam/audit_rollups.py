@@ -0,0 +1,347 @@
+import os
+import sys
+import json
+import math
+import sqlite3
+import hashlib
+from collections import defaultdict
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+AUDIT_PATH = os.path.join(BASE_DIR, "scrapinglatam", "audits", "latam_audit.ndjson")
+ROLLUPS_DB_PATH = os.path.join(BASE_DIR, "scrapinglatam", "audits", "audit_rollups.sqlite")
+
+# --- Agregados incrementales de la auditoría ---
+# La auditoría es de solo anexado: cada sincronización procesa únicamente los bytes
+# nuevos desde el último offset y suma sus eventos a tablas de agregados (por dominio,
+# por consulta/categoría/país, por estado HTTP, por origen del email y por día). Las latencias se guardan en
+# histogramas de cubetas logarítmicas (~5% de error relativo) para dar percentiles
+# sobre todo el histórico sin releer eventos. Los eventos con "timings" (fases de la
+# petición que mide el backend aiohttp: DNS, conexión, TLS, TTFB, descarga, bytes y
+# redirecciones) suman además a agregados por fase en las mismas dimensiones, para ver
+# en qué parte de la petición se va el tiempo. Si el archivo se borra o se reemplaza
+# (p. ej. "Limpiar auditoría"), los agregados se reconstruyen desde cero.
+
+SYNC_BLOCK_BYTES = 8 << 20
+HEAD_BYTES = 4096
+LATENCY_GROWTH = 1.1 # cada cubeta del histograma cubre un 10% más que la anterior
+DIMENSIONS = ("all", "day", "status", "category", "country", "query", "email_source")
+TIMED_PHASES = ("queue_ms", "dns_ms", "connect_ms", "tls_ms", "ttfb_ms", "download_ms") # con histograma
+PHASES = TIMED_PHASES + ("bytes", "redirects")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS rollup (
+    dim TEXT NOT NULL,              -- all | day | status | category | country | query | email_source
+    key TEXT NOT NULL,
+    events INTEGER NOT NULL DEFAULT 0,
+    with_emails INTEGER NOT NULL DEFAULT 0,
+    exclusions INTEGER NOT NULL DEFAULT 0,
+    total_ms INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dim, key)
+);
+CREATE TABLE IF NOT EXISTS latency_hist (
+    dim TEXT NOT NULL,
+    key TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (dim, key, bucket)
+);
+CREATE TABLE IF NOT EXISTS phase_rollup (
+    dim TEXT NOT NULL,
+    key TEXT NOT NULL,
+    phase TEXT NOT NULL,            -- ver PHASES
+    n INTEGER NOT NULL DEFAULT 0,   -- eventos con tiempos por fase
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dim, key, phase)
+);
+CREATE TABLE IF NOT EXISTS phase_hist (
+    dim TEXT NOT NULL,
+    key TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (dim, key, phase, bucket)
+);
+CREATE TABLE IF NOT EXISTS by_domain (
+    domain TEXT PRIMARY KEY,
+    events INTEGER NOT NULL DEFAULT 0,
+    with_emails INTEGER NOT NULL DEFAULT 0,
+    exclusions INTEGER NOT NULL DEFAULT 0,
+    total_ms INTEGER NOT NULL DEFAULT 0,
+    last_status TEXT,
+    last_seen TEXT
+);
+"""
+
+
+def latency_bucket(ms) -> int:
+    return int(math.log1p(max(0, ms)) / math.log(LATENCY_GROWTH))
+
+
+def bucket_upper_ms(bucket) -> int:
+    return int(math.expm1((bucket + 1) * math.log(LATENCY_GROWTH)))
+
+
+def _head_hash(path, n):
+    with open(path, "rb") as fh:
+        return hashlib.sha1(fh.read(n)).hexdigest()
+
+
+def tail_lines(path, n=200, block=1 << 16):
+    """Últimas `n` líneas del archivo leyendo desde el final (sin cargarlo entero)."""
+    with open(path, "rb") as fh:
+        fh.seek(0, os.SEEK_END)
+        pos = fh.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(block, pos)
+            pos -= step
+            fh.seek(pos)
+            data = fh.read(step) + data
+    return [ln.decode("utf-8", errors="replace") for ln in data.splitlines()[-n:] if ln.strip()]
+
+
+class AuditRollups:
+    """Agregados de la auditoría en SQLite, mantenidos de forma incremental."""
+
+    def __init__(self, audit_path=AUDIT_PATH, db_path=ROLLUPS_DB_PATH):
+        self.audit_path = audit_path
+        self.db_path = db_path
+        d = os.path.dirname(db_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        self.con.row_factory = sqlite3.Row
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.executescript(SCHEMA)
+
+    def close(self):
+        self.con.close()
+
+    def _meta(self, key, default=None):
+        row = self.con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else default
+
+    def _reset(self):
+        for table in ("meta", "rollup", "latency_hist", "phase_rollup", "phase_hist", "by_domain"):
+            self.con.execute(f"DELETE FROM {table}")
+
+    # --- Sincronización ---
+    def sync(self):
+        """Suma a los agregados los eventos nuevos. Devuelve cuántos se procesaron."""
+        if not os.path.exists(self.audit_path):
+            if self._meta("offset"):
+                with self.con:
+                    self._reset()
+            return 0
+        size = os.path.getsize(self.audit_path)
+        offset = int(self._meta("offset", 0))
+        head_len = int(self._meta("head_len", 0))
+        if (size < offset or self._meta("audit_path", self.audit_path) != self.audit_path
+                or (head_len and _head_hash(self.audit_path, head_len) != self._meta("head_hash"))):
+            with self.con:
+                self._reset()
+            offset = 0
+
+        processed = 0
+        with open(self.audit_path, "rb") as fh:
+            fh.seek(offset)
+            while offset < size:
+                data = fh.read(min(SYNC_BLOCK_BYTES, size - offset))
+                # Solo líneas completas; un evento a medio escribir queda para la próxima vez
+                end = data.rfind(b"\n") + 1
+                if end == 0:
+                    break
+                fh.seek(offset + end)
+                processed += self._ingest(data[:end].splitlines(), offset + end)
+                offset += end
+        return processed
+
+    def _ingest(self, lines, new_offset):
+        rollup = defaultdict(lambda: [0, 0, 0, 0])   # (dim, key) -> events, emails, excl, ms
+        hist = defaultdict(int)                       # (dim, key, bucket) -> n
+        phase_agg = defaultdict(lambda: [0, 0])       # (dim, key, phase) -> n, total
+        phase_hist = defaultdict(int)                 # (dim, key, phase, bucket) -> n
+        domains = {}
+        count = 0
+        for ln in lines:
+            try:
+                ev = json.loads(ln)
+            except Exception:
+                continue
+            count += 1
+            ms = int(ev.get("duration_ms") or 0)
+            has_emails = int(bool(ev.get("emails_found")))
+            excluded = int(ev.get("exclusion_flag") == "Y")
+            bucket = latency_bucket(ms)
+            keys = {
+                "all": "",
+                "day": str(ev.get("timestamp") or "")[:10],
+                "status": str(ev.get("http_status")),
+                "category": ev.get("category") or "",
+                "country": ev.get("country") or "",
+                "query": ev.get("query") or "",
+                "email_source": ev.get("email_source") or "",
+            }
+            for dim, key in keys.items():
+                agg = rollup[(dim, key)]
+                agg[0] += 1
+                agg[1] += has_emails
+                agg[2] += excluded
+                agg[3] += ms
+                hist[(dim, key, bucket)] += 1
+
+            timings = ev.get("timings")
+            if isinstance(timings, dict):
+                values = {phase: int(timings.get(phase) or 0) for phase in PHASES}
+                for dim, key in keys.items():
+                    for phase, value in values.items():
+                        agg = phase_agg[(dim, key, phase)]
+                        agg[0] += 1
+                        agg[1] += value
+                        if phase in TIMED_PHASES:
+                            phase_hist[(dim, key, phase, latency_bucket(value))] += 1
+
+            domain = ev.get("domain") or ""
+            if domain:
+                d = domains.setdefault(domain, [0, 0, 0, 0, None, None])
+                d[0] += 1
+                d[1] += has_emails
+                d[2] += excluded
+                d[3] += ms
+                d[4] = str(ev.get("http_status"))
+                d[5] = ev.get("last_seen") or ev.get("timestamp")
+
+        with self.con:
+            self.con.executemany(
+                "INSERT INTO rollup (dim, key, events, with_emails, exclusions, total_ms) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(dim, key) DO UPDATE SET events = events + excluded.events, "
+                "with_emails = with_emails + excluded.with_emails, exclusions = exclusions + excluded.exclusions, "
+                "total_ms = total_ms + excluded.total_ms",
+                [(dim, key, *agg) for (dim, key), agg in rollup.items()],
+            )
+            self.con.executemany(
+                "INSERT INTO latency_hist (dim, key, bucket, n) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(dim, key, bucket) DO UPDATE SET n = n + excluded.n",
+                [(*k, n) for k, n in hist.items()],
+            )
+            self.con.executemany(
+                "INSERT INTO phase_rollup (dim, key, phase, n, total) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(dim, key, phase) DO UPDATE SET n = n + excluded.n, total = total + excluded.total",
+                [(*k, *agg) for k, agg in phase_agg.items()],
+            )
+            self.con.executemany(
+                "INSERT INTO phase_hist (dim, key, phase, bucket, n) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(dim, key, phase, bucket) DO UPDATE SET n = n + excluded.n",
+                [(*k, n) for k, n in phase_hist.items()],
+            )
+            self.con.executemany(
+                "INSERT INTO by_domain (domain, events, with_emails, exclusions, total_ms, last_status, last_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(domain) DO UPDATE SET "
+                "events = events + excluded.events, with_emails = with_emails + excluded.with_emails, "
+                "exclusions = exclusions + excluded.exclusions, total_ms = total_ms + excluded.total_ms, "
+                "last_status = excluded.last_status, last_seen = excluded.last_seen",
+                [(domain, *d) for domain, d in domains.items()],
+            )
+            head_len = min(HEAD_BYTES, new_offset)
+            self.con.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+                ("audit_path", self.audit_path),
+                ("offset", str(new_offset)),
+                ("head_len", str(head_len)),
+                ("head_hash", _head_hash(self.audit_path, head_len)),
+            ])
+        return count
+
+    # --- Consultas ---
+    def _percentiles(self, dim, key, qs=(0.5, 0.95, 0.99), phase=None):
+        if phase is None:
+            rows = self.con.execute(
+                "SELECT bucket, n FROM latency_hist WHERE dim = ? AND key = ? ORDER BY bucket", (dim, key)
+            ).fetchall()
+        else:
+            rows = self.con.execute(
+                "SELECT bucket, n FROM phase_hist WHERE dim = ? AND key = ? AND phase = ? ORDER BY bucket",
+                (dim, key, phase),
+            ).fetchall()
+        total = sum(r["n"] for r in rows)
+        out = {}
+        for q in qs:
+            target, acc = q * total, 0
+            for r in rows:
+                acc += r["n"]
+                if acc >= target:
+                    out[q] = bucket_upper_ms(r["bucket"])
+                    break
+            else:
+                out[q] = 0
+        return out
+
+    def _with_stats(self, row, dim):
+        r = dict(row)
+        r["yield"] = r["with_emails"] / r["events"] if r["events"] else 0.0
+        r["avg_ms"] = int(r["total_ms"] / r["events"]) if r["events"] else 0
+        pct = self._percentiles(dim, r["key"])
+        r["p50_ms"], r["p95_ms"], r["p99_ms"] = pct[0.5], pct[0.95], pct[0.99]
+        return r
+
+    def totals(self):
+        """Totales de todo el histórico: eventos, con emails, exclusiones, latencias."""
+        row = self.con.execute("SELECT * FROM rollup WHERE dim = 'all' AND key = ''").fetchone()
+        if row is None:
+            return None
+        return self._with_stats(row, "all")
+
+    def breakdown(self, dim, limit=50, order="events"):
+        """Agregados por día, estado HTTP, categoría, país, consulta u origen del email."""
+        if dim not in DIMENSIONS:
+            raise ValueError(f"Dimensión desconocida: {dim}")
+        order_sql = "key DESC" if dim == "day" else f"{order} DESC, key"
+        rows = self.con.execute(
+            f"SELECT * FROM rollup WHERE dim = ? ORDER BY {order_sql} LIMIT ?", (dim, limit)
+        ).fetchall()
+        return [self._with_stats(r, dim) for r in rows]
+
+    def phases(self, dim="all", key=""):
+        """Por fase de la petición: muestras, media y percentiles (los de bytes/redirects sin percentiles)."""
+        rows = self.con.execute(
+            "SELECT phase, n, total FROM phase_rollup WHERE dim = ? AND key = ?", (dim, key)
+        ).fetchall()
+        by_phase = {r["phase"]: r for r in rows}
+        out = []
+        for phase in PHASES:
+            r = by_phase.get(phase)
+            if r is None:
+                continue
+            item = {"phase": phase, "n": r["n"], "total": r["total"], "avg": r["total"] / r["n"] if r["n"] else 0.0}
+            if phase in TIMED_PHASES:
+                pct = self._percentiles(dim, key, qs=(0.5, 0.95), phase=phase)
+                item["p50"], item["p95"] = pct[0.5], pct[0.95]
+            out.append(item)
+        return out
+
+    def phase_breakdown(self, dim, limit=50):
+        """Media de cada fase por clave de `dim` (las claves con más eventos medidos primero)."""
+        if dim not in DIMENSIONS:
+            raise ValueError(f"Dimensión desconocida: {dim}")
+        keys = self.con.execute(
+            "SELECT key, n FROM phase_rollup WHERE dim = ? AND phase = ? ORDER BY n DESC, key LIMIT ?",
+            (dim, PHASES[0], limit),
+        ).fetchall()
+        out = []
+        for k in keys:
+            row = {"key": k["key"], "n": k["n"]}
+            for r in self.con.execute(
+                "SELECT phase, n, total FROM phase_rollup WHERE dim = ? AND key = ?", (dim, k["key"])
+            ):
+                row[r["phase"]] = r["total"] / r["n"] if r["n"] else 0.0
+            out.append(row)
+        return out
+
+    def top_domains(self, limit=50, order="events"):
+        rows = self.con.execute(
+            f"SELECT * FROM by_domain ORDER BY {order} DESC, domain LIMIT ?", (limit,)
+        ).fetchall()
+        return [dict(r) for r in rows]
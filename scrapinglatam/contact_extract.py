@@ -0,0 +1,168 @@
+import os
+import re
+import sys
+import json
+import html
+from typing import NamedTuple
+from urllib.parse import unquote
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+# --- Extracción de contactos consciente del HTML ---
+# En vez de pasar la regex por todo el HTML crudo (scripts, estilos y atributos
+# incluidos, de donde salen teléfonos basura y "emails" como logo@2x.png), se recorre
+# la página con expresiones que solo tocan etiquetas y bloques concretos, por orden
+# de fiabilidad:
+#   mailto  -> href="mailto:..." / href="tel:..."
+#   jsonld  -> <script type="application/ld+json"> (Organization, ContactPoint, ...)
+#   footer  -> texto de <footer>, <address> y bloques con id/class "contact"/"footer"
+#   text    -> regex sobre el texto visible (sin scripts/estilos ni atributos), solo si
+#              lo anterior no dio nada
+# Cada email recuerda el camino por el que se encontró; el crawler guarda en la
+# auditoría el del email_best (email_source).
+
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}")
+PHONE_RE = re.compile(r"(?:\+?\d{1,3}[\s\-\.]?)?(?:\(?\d{2,4}\)?[\s\-\.]?)\d{3,4}[\s\-\.]?\d{3,4}")
+
+SOURCES = ("mailto", "jsonld", "footer", "text")
+
+# "Emails" que en realidad son nombres de archivo (retina: logo@2x.png)
+FILE_SUFFIXES = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg", ".ico", ".css", ".js", ".avif", ".bmp")
+
+_HREF_RE = re.compile(r"""href\s*=\s*["']?\s*(mailto|tel|callto):([^"'>\s]+)""", re.I)
+_JSONLD_RE = re.compile(r"""<script\b[^>]*type\s*=\s*["']?application/ld\+json["']?[^>]*>(.*?)</script\s*>""", re.I | re.S)
+SKIP_TAGS = ("script", "style", "noscript", "template", "svg") # bloques sin texto visible
+_SKIP_OPEN_RE = re.compile(r"<(%s)\b" % "|".join(SKIP_TAGS), re.I)
+_SKIP_CLOSE_RE = {tag: re.compile(r"</%s\s*>" % tag, re.I) for tag in SKIP_TAGS}
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.S)
+_TAG_RE = re.compile(r"<[^>]*>")
+_FOOTER_RE = re.compile(r"<(footer|address)\b[^>]*>(.*?)</\1\s*>", re.I | re.S)
+_CONTACT_OPEN_RE = re.compile(r"""<[a-z][a-z0-9]*\b[^>]*\b(?:id|class)\s*=\s*["'][^"']*(?:contact|footer)[^"']*["'][^>]*>""", re.I)
+CONTACT_BLOCK_CHARS = 4000 # texto que se mira tras la apertura de un bloque "contact"
+
+JSONLD_EMAIL_KEYS = ("email",)
+JSONLD_PHONE_KEYS = ("telephone", "faxNumber")
+
+
+class Contacts(NamedTuple):
+    emails: list        # en orden de hallazgo, sin repetir
+    phones: list
+    email_sources: dict # email -> camino (ver SOURCES)
+
+
+def _valid_email(e):
+    low = e.lower()
+    return not low.endswith(FILE_SUFFIXES) and ".." not in low
+
+
+def strip_skip_blocks(page):
+    """
+    `page` sin los bloques de SKIP_TAGS (cada uno cambiado por un espacio). Lineal: una
+    apertura sin cierre no se busca otra vez (con una regex perezosa, cada <script sin
+    cerrar recorría el resto de la página). Como antes, una apertura sin cierre se deja.
+    """
+    out = []
+    pos = 0
+    unclosed = set() # etiquetas sin cierre desde algún punto: tampoco lo tendrán después
+    for m in _SKIP_OPEN_RE.finditer(page):
+        if m.start() < pos:
+            continue # dentro de un bloque ya quitado
+        tag = m.group(1).lower()
+        if tag in unclosed:
+            continue
+        close = _SKIP_CLOSE_RE[tag].search(page, m.end())
+        if close is None:
+            unclosed.add(tag)
+            continue
+        out.append(page[pos:m.start()])
+        out.append(" ")
+        pos = close.end()
+    out.append(page[pos:])
+    return "".join(out)
+
+
+def _visible_text(fragment):
+    return html.unescape(_TAG_RE.sub(" ", fragment))
+
+
+def _walk_jsonld(node, emails, phones):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in JSONLD_EMAIL_KEYS and isinstance(value, str):
+                emails.append(value)
+            elif key in JSONLD_PHONE_KEYS and isinstance(value, str):
+                phones.append(value)
+            elif isinstance(value, (dict, list)):
+                _walk_jsonld(value, emails, phones)
+    elif isinstance(node, list):
+        for item in node:
+            _walk_jsonld(item, emails, phones)
+
+
+def extract_contacts(page):
+    """Emails y teléfonos de una página HTML, con el camino por el que salió cada email."""
+    emails = {}
+    phones = {}
+
+    def add_email(raw, source):
+        for part in unquote(raw).split("?", 1)[0].split(","):
+            for e in EMAIL_RE.findall(html.unescape(part)):
+                e = e.strip('.,;:()[]<>"\'').lower()
+                if _valid_email(e) and e not in emails:
+                    emails[e] = source
+
+    def add_phone(raw):
+        p = " ".join(unquote(raw).split())
+        if sum(ch.isdigit() for ch in p) >= 7:
+            phones.setdefault(p, None)
+
+    # 1) Enlaces mailto:/tel:
+    for scheme, value in _HREF_RE.findall(page):
+        if scheme.lower() == "mailto":
+            add_email(value, "mailto")
+        else:
+            add_phone(value)
+
+    # 2) JSON-LD (schema.org Organization/ContactPoint/LocalBusiness...)
+    for block in _JSONLD_RE.findall(page):
+        try:
+            data = json.loads(block.strip())
+        except ValueError:
+            continue
+        found_emails, found_phones = [], []
+        _walk_jsonld(data, found_emails, found_phones)
+        for e in found_emails:
+            add_email(e, "jsonld")
+        for p in found_phones:
+            add_phone(p)
+
+    # A partir de aquí, nada de scripts, estilos ni comentarios
+    body = _COMMENT_RE.sub(" ", strip_skip_blocks(page))
+
+    # 3) Pie de página y bloques de contacto
+    need_emails, need_phones = not emails, not phones
+    if need_emails or need_phones:
+        blocks = [m.group(2) for m in _FOOTER_RE.finditer(body)]
+        blocks += [body[m.end():m.end() + CONTACT_BLOCK_CHARS] for m in _CONTACT_OPEN_RE.finditer(body)]
+        for block in blocks:
+            text = _visible_text(block)
+            if need_emails:
+                for e in EMAIL_RE.findall(text):
+                    add_email(e, "footer")
+            if need_phones:
+                for p in PHONE_RE.findall(text):
+                    add_phone(p)
+
+    # 4) Último recurso: regex sobre el texto visible
+    if not emails or not phones:
+        text = _visible_text(body)
+        if not emails:
+            for e in EMAIL_RE.findall(text):
+                add_email(e, "text")
+        if not phones:
+            for p in PHONE_RE.findall(text):
+                add_phone(p.strip())
+
+    return Contacts(list(emails), list(phones), emails)
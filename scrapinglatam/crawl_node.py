@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+from scrapinglatam.latam_lead_crawler_serpapi import (
+    CONFIG_PATH, FIELDNAMES, LeadCrawler, CrawlerConfig, load_crawler_config,
+)
+from scrapinglatam.work_queue import WorkQueue, DEFAULT_LEASE_SECONDS, default_node_id
+from scrapinglatam.serpapi_keys import SerpKeyPool
+from scrapinglatam.lead_sink import LeadSink
+
+# --- Nodo de una campaña distribuida ---
+# Varios nodos (en una o varias máquinas) trabajan la misma campaña a través de la
+# cola compartida de work_queue.py: cada uno toma queries y URLs en préstamo, las
+# procesa con las mismas etapas que LeadCrawler (paginación SerpAPI con filtros,
+# frontera por host, extracción de contactos) y guarda los leads en el almacén
+# compartido, que deduplica por dominio. La auditoría se escribe en local (la de cada
+# nodo), y el CSV de la campaña se obtiene con "export". Uso:
+#   python -m scrapinglatam.crawl_node --db /mnt/compartido/campana.sqlite seed --name "LatAm Q3"
+#   python -m scrapinglatam.crawl_node --db /mnt/compartido/campana.sqlite run --campaign 1   (en cada nodo)
+#   python -m scrapinglatam.crawl_node --db /mnt/compartido/campana.sqlite status --campaign 1
+#   python -m scrapinglatam.crawl_node --db /mnt/compartido/campana.sqlite export --campaign 1 --out leads.csv
+
+POLL_SECONDS = 2.0 # espera cuando no hay nada pendiente pero otros nodos aún trabajan
+DEFAULT_NODE_WORKERS = 20
+
+
+class NodeCrawler(LeadCrawler):
+    """LeadCrawler que toma su trabajo de la cola compartida en vez de un plan propio."""
+
+    def __init__(self, config: CrawlerConfig, queue: WorkQueue, campaign_id, node,
+                 workers=DEFAULT_NODE_WORKERS, lease_seconds=DEFAULT_LEASE_SECONDS, **kwargs):
+        super().__init__(config, **kwargs)
+        self.queue = queue
+        self.campaign_id = campaign_id
+        self.node = node
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self._held = set() # ids prestados a este nodo en curso
+        self._discovered = {} # query -> resultados filtrados de su paginación
+        self._serp_result = {} # query -> lo que LeadCrawler anotaría en serpapi_done.json
+        self._stop = asyncio.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    # Sin consumidor de run(): los logs van a la salida y el resto de eventos se descarta
+    def _emit(self, event):
+        if event["type"] == "log":
+            print(f"[{self.node}] {event['message']}", flush=True)
+
+    async def enqueue_fetch(self, query, results):
+        self.metrics["fetched"] += len(results)
+        self._discovered[query].extend(results)
+
+    def record_serp_done(self, query, num, results, domains, status, pages=1, filtered=None):
+        # El registro de queries hechas es la propia cola (result_json del elemento)
+        self._serp_result[query] = {"num": num, "results": results, "pages": pages, "status": status,
+                                    "filtered": filtered or {}}
+
+    async def _call(self, fn, *args, **kwargs):
+        """La cola es SQLite con esperas de bloqueo: fuera del loop."""
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    # --- Elementos ---
+    async def _process_query(self, item):
+        query = item["query"]
+        self._discovered[query] = []
+        try:
+            await self.process_query(query)
+            found = self._discovered.get(query, [])
+            serp = self._serp_result.pop(query, None)
+        finally:
+            self._discovered.pop(query, None)
+        if serp is None: # SerpAPI no respondió: que la reintente este u otro nodo
+            await self._call(self.queue.release, self.node, item["id"], error="SerpAPI sin respuesta")
+            return
+        new = await self._call(self.queue.complete, self.node, item, result=serp, urls=found)
+        if new is None:
+            self.log(f"[NODE] Préstamo de '{query}' caducado; sus URLs las encola otro nodo")
+        else:
+            self.metrics["urls_queued"] += new
+            self.log(f"[NODE] '{query}': {len(found)} URLs, {new} nuevas en la cola")
+
+    async def _process_url(self, fetcher, item):
+        page = await self.fetch_page(fetcher, item)
+        result = {"skipped": page is None}
+        if page is not None:
+            out = await self.extract_page(page)
+            self._audit_fh.write(json.dumps(out["audit"], ensure_ascii=False) + '\n')
+            self._audit_fh.flush()
+            result["http_status"] = page["http_status"]
+            if out["row"]:
+                added = await self._call(self.queue.add_lead, self.campaign_id, self.node, out["row"])
+                self.metrics["leads" if added else "leads_duplicate"] += 1
+                result["lead"] = added
+        await self._call(self.queue.complete, self.node, item, result=result)
+
+    async def _work(self, fetcher):
+        while not self._stop.is_set():
+            # Sin keys utilizables solo se visitan URLs ya descubiertas
+            kinds = ("url",) if self.key_pool.exhausted() or self.credits_exhausted() else ("query", "url")
+            items = await self._call(self.queue.lease, self.campaign_id, self.node, 1, self.lease_seconds, kinds)
+            if not items:
+                if await self._call(self.queue.drained, self.campaign_id) or kinds == ("url",):
+                    return
+                try:
+                    await asyncio.wait_for(self._stop.wait(), POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            item = items[0]
+            self._held.add(item["id"])
+            try:
+                if item["kind"] == "query":
+                    await self._process_query(item)
+                else:
+                    await self._process_url(fetcher, item)
+            except Exception as e:
+                self.log(f"[NODE] Error en {item['kind']} '{item['key']}': {e}")
+                await self._call(self.queue.release, self.node, item["id"], error=str(e))
+            finally:
+                self._held.discard(item["id"])
+
+    async def _heartbeat(self, started_at):
+        """Renueva los préstamos en curso a un tercio de su duración."""
+        while True:
+            await self._call(self.queue.node_heartbeat, self.node, started_at)
+            lost = await self._call(self.queue.renew, self.node, set(self._held), self.lease_seconds)
+            for item_id in lost & self._held: # los terminados mientras tanto no cuentan
+                self.log(f"[NODE] Préstamo {item_id} perdido (caducó); otro nodo lo repetirá")
+            await asyncio.sleep(self.lease_seconds / 3)
+
+    async def serve(self):
+        cfg = self.config
+        self.load_negative_domains()
+        self.load_aliases()
+        self.frontier = self.build_frontier()
+        if self.key_pool is None:
+            self.key_pool = SerpKeyPool(cfg.api_keys(), rate_per_minute=cfg.serpapi_rate_per_minute,
+                                        strategy=cfg.serpapi_key_strategy)
+        await self.key_pool.prime(self.log)
+        os.makedirs(os.path.dirname(cfg.audit_path) or ".", exist_ok=True)
+        started_at = time.time()
+        self.log(f"[NODE] Campaña {self.campaign_id}: {self.workers} elementos a la vez, préstamos de {self.lease_seconds:.0f}s")
+        heartbeat = asyncio.create_task(self._heartbeat(started_at))
+        try:
+            with open(cfg.audit_path, 'a', encoding='utf-8') as self._audit_fh:
+                async with self.build_fetcher() as fetcher:
+                    workers = [asyncio.create_task(self._work(fetcher)) for _ in range(self.workers)]
+                    try:
+                        await asyncio.gather(*workers)
+                    finally:
+                        for task in workers:
+                            task.cancel()
+                        await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            self.close()
+            # Lo que quede prestado (parada a medias) vuelve a la cola sin gastar un intento
+            for item_id in list(self._held):
+                self.queue.release(self.node, item_id, error="nodo detenido", charge=False)
+            if self.metrics:
+                self.log("[METRICS] " + ", ".join(f"{k}={v}" for k, v in sorted(self.metrics.items())))
+            if self.proxy_pool is not None:
+                self.log("[PROXY] " + self.proxy_pool.summary())
+
+
+def cmd_seed(queue, args):
+    config = load_crawler_config(args.config)
+    raw = {}
+    if os.path.exists(args.config):
+        with open(args.config, "r", encoding="utf-8") as fh:
+            raw = json.load(fh)
+    raw.pop("SERPAPI_KEY", None) # las keys las pone cada nodo desde su entorno
+    queries = LeadCrawler(config).build_query_plan()
+    campaign_id = queue.create_campaign(args.name, raw, queries)
+    print(f"[SEED] Campaña {campaign_id} ('{args.name}') con {len(queries)} queries")
+
+
+def cmd_run(queue, args):
+    campaign = queue.campaign(args.campaign)
+    if campaign is None:
+        print(f"[ERROR] No existe la campaña {args.campaign}")
+        return
+    config = CrawlerConfig.from_dict(campaign["config"])
+    if not config.api_keys():
+        print("[ERROR] Debes definir SERPAPI_KEY (o SERPAPI_KEYS) en el entorno del nodo.")
+        return
+    node = NodeCrawler(config, queue, args.campaign, args.node or default_node_id(),
+                       workers=args.workers, lease_seconds=args.lease_seconds)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, node.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        await node.serve()
+
+    asyncio.run(run())
+    print(f"[NODE] {node.node} terminado: {json.dumps(queue.stats(args.campaign)['items'])}")
+
+
+def cmd_status(queue, args):
+    stats = queue.stats(args.campaign)
+    print(f"[STATUS] Campaña {args.campaign}: {stats['leads']} leads")
+    for key, n in sorted(stats["items"].items()):
+        print(f"[STATUS]   {key}: {n}")
+    for n in stats["nodes"]:
+        print(f"[STATUS]   nodo {n['node']} ({n['host']}, pid {n['pid']}): latido hace {time.time() - n['heartbeat']:.0f}s")
+
+
+def cmd_export(queue, args):
+    sink = LeadSink(args.out, FIELDNAMES)
+    n = 0
+    try:
+        for row in queue.iter_leads(args.campaign):
+            sink.add({k: row.get(k, "") for k in FIELDNAMES})
+            n += 1
+    finally:
+        sink.close()
+    print(f"[EXPORT] {n} leads anexados a {args.out}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Campaña de rastreo repartida entre varios nodos")
+    parser.add_argument("--db", required=True, help="SQLite de la cola en el volumen compartido")
+    parser.add_argument("--wal", action="store_true", help="modo WAL (solo si todos los nodos están en la misma máquina)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("seed", help="crea una campaña con el plan de queries de la config")
+    p.add_argument("--name", required=True)
+    p.add_argument("--config", default=CONFIG_PATH)
+
+    p = sub.add_parser("run", help="trabaja la campaña hasta vaciarla")
+    p.add_argument("--campaign", type=int, required=True)
+    p.add_argument("--node", help="identificador del nodo (por defecto host-pid)")
+    p.add_argument("--workers", type=int, default=DEFAULT_NODE_WORKERS, help="elementos en curso a la vez")
+    p.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS)
+
+    p = sub.add_parser("status", help="estado de la cola, leads y nodos activos")
+    p.add_argument("--campaign", type=int, required=True)
+
+    p = sub.add_parser("export", help="anexa los leads de la campaña a un CSV")
+    p.add_argument("--campaign", type=int, required=True)
+    p.add_argument("--out", required=True)
+
+    args = parser.parse_args(argv)
+    queue = WorkQueue(args.db, journal_mode="WAL" if args.wal else "DELETE")
+    {"seed": cmd_seed, "run": cmd_run, "status": cmd_status, "export": cmd_export}[args.command](queue, args)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n[NODE] Detenido por el usuario.")
@@ -0,0 +1,465 @@
+import os
+import sys
+import json
+import time
+import signal
+import sqlite3
+import asyncio
+import argparse
+from contextlib import aclosing
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+JOBS_DB_PATH = os.path.join(BASE_DIR, "scrapinglatam", "jobs.sqlite")
+WORKER_LOG_PATH = os.path.join(BASE_DIR, "scrapinglatam", "audits", "crawler_worker.log")
+
+from scrapinglatam.latam_lead_crawler_serpapi import (
+    CrawlerConfig, LeadCrawler, CreditPool, SeenDomainIndex, FIELDNAMES, ROBOTS_TTL_HOURS,
+    iter_csv_domains,
+)
+from scrapinglatam.lead_sink import LeadSink
+from scrapinglatam.frontier import RobotsCache
+from scrapinglatam.near_dup import NearDupIndex
+from scrapinglatam.domain_aliases import DomainAliases
+from scrapinglatam.proxy_pool import ProxyPool
+from scrapinglatam.fetchers import make_session
+from scrapinglatam.serpapi_keys import SerpKeyPool
+
+# --- Worker persistente con cola de trabajos en SQLite ---
+# La app encola trabajos (config + API key) y consulta su estado; un único proceso
+# worker los ejecuta, varios a la vez, compartiendo el pool de conexiones HTTP,
+# el tope de créditos, los pools de API keys, los índices de dominios, la caché de
+# robots.txt y el escritor de cada CSV.
+#
+# La API key de la app solo está en jobs.sqlite mientras el trabajo espera en cola: al
+# reclamarlo, el worker la borra de config_json y la guarda en memoria (secure_delete
+# y un checkpoint del WAL para que no queden restos en el archivo). Si el worker se
+# detiene, la devuelve con el trabajo a la cola; si muere, el trabajo se retoma con
+# SERPAPI_KEY del entorno o SERPAPI_KEYS de la configuración.
+
+HEARTBEAT_SECONDS = 5
+HEARTBEAT_STALE_SECONDS = 20 # sin latido en este tiempo, el worker se da por muerto
+ACTIVE_STATUSES = ("queued", "running", "cancel_requested")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL,
+    config_json TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    queries_total INTEGER DEFAULT 0,
+    queries_done INTEGER DEFAULT 0,
+    leads INTEGER DEFAULT 0,
+    credits_spent INTEGER DEFAULT 0,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS job_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_logs_job ON job_logs(job_id, id);
+CREATE TABLE IF NOT EXISTS worker (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    pid INTEGER,
+    started_at REAL,
+    heartbeat REAL
+);
+"""
+
+
+class JobQueue:
+    """Acceso a la cola de trabajos. Cada llamada abre su conexión (barato en SQLite)."""
+
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = path
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with self._connect() as con:
+            con.executescript(SCHEMA)
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA busy_timeout=10000")
+        con.execute("PRAGMA secure_delete=ON") # la key borrada no queda en páginas libres
+        return con
+
+    # --- Lado app ---
+    def enqueue(self, config: dict, serpapi_key: str) -> int:
+        cfg = dict(config, SERPAPI_KEY=serpapi_key)
+        with self._connect() as con:
+            cur = con.execute(
+                "INSERT INTO jobs (status, config_json, created_at) VALUES ('queued', ?, ?)",
+                (json.dumps(cfg, ensure_ascii=False), time.time()),
+            )
+            return cur.lastrowid
+
+    def request_cancel(self, job_id):
+        with self._connect() as con:
+            con.execute("UPDATE jobs SET status = 'cancelled', finished_at = ?, "
+                        "config_json = json_remove(config_json, '$.SERPAPI_KEY') WHERE id = ? AND status = 'queued'",
+                        (time.time(), job_id))
+            con.execute("UPDATE jobs SET status = 'cancel_requested' WHERE id = ? AND status = 'running'", (job_id,))
+
+    def get_job(self, job_id):
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT id, status, created_at, started_at, finished_at, queries_total, queries_done, "
+                "leads, credits_spent, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def list_jobs(self, limit=20):
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT id, status, created_at, started_at, finished_at, queries_total, queries_done, "
+                "leads, credits_spent, error FROM jobs ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def tail_logs(self, job_id, limit=200):
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT message FROM job_logs WHERE job_id = ? ORDER BY id DESC LIMIT ?", (job_id, limit)
+            ).fetchall()
+        return [r["message"] for r in reversed(rows)]
+
+    def worker_alive(self) -> bool:
+        with self._connect() as con:
+            row = con.execute("SELECT heartbeat FROM worker WHERE id = 1").fetchone()
+        return bool(row and row["heartbeat"] and time.time() - row["heartbeat"] < HEARTBEAT_STALE_SECONDS)
+
+    # --- Lado worker ---
+    def claim_next(self):
+        """
+        Pasa el trabajo en cola más antiguo a 'running' de forma atómica. La config se
+        devuelve con la API key, que a la vez se borra de la base (ver la cabecera).
+        """
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute("SELECT id, config_json FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                con.execute("COMMIT")
+                return None
+            con.execute("UPDATE jobs SET status = 'running', started_at = ?, "
+                        "config_json = json_remove(config_json, '$.SERPAPI_KEY') WHERE id = ?",
+                        (time.time(), row["id"]))
+            con.execute("COMMIT")
+            con.execute("PRAGMA wal_checkpoint(TRUNCATE)") # el WAL aún guarda la fila anterior
+            return row["id"], json.loads(row["config_json"])
+        except Exception:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+    def requeue(self, job_id, serpapi_key=""):
+        """Devuelve a la cola un trabajo que el worker no terminó, con su API key si la tenía."""
+        with self._connect() as con:
+            if serpapi_key:
+                con.execute("UPDATE jobs SET status = 'queued', "
+                            "config_json = json_set(config_json, '$.SERPAPI_KEY', ?) WHERE id = ?",
+                            (serpapi_key, job_id))
+            else:
+                con.execute("UPDATE jobs SET status = 'queued' WHERE id = ?", (job_id,))
+
+    def scrub_keys(self):
+        """Borra la API key de los trabajos que ya no están en cola (bases de versiones anteriores)."""
+        with self._connect() as con:
+            cur = con.execute("UPDATE jobs SET config_json = json_remove(config_json, '$.SERPAPI_KEY') "
+                              "WHERE status != 'queued' AND json_extract(config_json, '$.SERPAPI_KEY') IS NOT NULL")
+            if cur.rowcount:
+                con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def status(self, job_id):
+        with self._connect() as con:
+            row = con.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["status"] if row else None
+
+    def update_progress(self, job_id, **fields):
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._connect() as con:
+            con.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+
+    def append_logs(self, job_id, messages):
+        if not messages:
+            return
+        now = time.time()
+        with self._connect() as con:
+            con.executemany("INSERT INTO job_logs (job_id, ts, message) VALUES (?, ?, ?)",
+                            [(job_id, now, m) for m in messages])
+
+    def finish(self, job_id, status, error=None):
+        with self._connect() as con:
+            con.execute("UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                        (status, time.time(), error, job_id))
+
+    def requeue_orphans(self):
+        """Trabajos que quedaron 'running' de un worker muerto vuelven a la cola."""
+        with self._connect() as con:
+            con.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+            con.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE status = 'cancel_requested'",
+                        (time.time(),))
+
+    def register_worker(self, started_at):
+        """
+        Se apunta como el worker de la cola. Devuelve el pid de otro worker vivo (y no se
+        apunta) o None si la cola queda a su cargo.
+        """
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute("SELECT pid, heartbeat FROM worker WHERE id = 1").fetchone()
+            if (row and row["pid"] != os.getpid() and row["heartbeat"]
+                    and time.time() - row["heartbeat"] < HEARTBEAT_STALE_SECONDS):
+                con.execute("COMMIT")
+                return row["pid"]
+            self._write_heartbeat(con, started_at)
+            con.execute("COMMIT")
+            return None
+        except Exception:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+    def _write_heartbeat(self, con, started_at):
+        con.execute(
+            "INSERT INTO worker (id, pid, started_at, heartbeat) VALUES (1, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET pid = excluded.pid, started_at = excluded.started_at, "
+            "heartbeat = excluded.heartbeat",
+            (os.getpid(), started_at, time.time()),
+        )
+
+    def heartbeat(self, started_at):
+        with self._connect() as con:
+            self._write_heartbeat(con, started_at)
+
+    def worker_stopped(self):
+        with self._connect() as con:
+            con.execute("UPDATE worker SET heartbeat = NULL WHERE id = 1 AND pid = ?", (os.getpid(),))
+
+
+class CrawlerWorker:
+    """Ejecuta trabajos de la cola con recursos compartidos y calientes entre trabajos."""
+
+    def __init__(self, queue: JobQueue, max_jobs=2, connection_limit=40, credit_limit=0,
+                 poll_interval=1.0, idle_exit_seconds=0):
+        self.queue = queue
+        self.max_jobs = max_jobs
+        self.connection_limit = connection_limit
+        self.credit_pool = CreditPool(credit_limit)
+        self.poll_interval = poll_interval
+        self.idle_exit_seconds = idle_exit_seconds
+        self.session = None
+        self.seen_indexes = {} # ruta del índice -> SeenDomainIndex compartido
+        self.alias_maps = {} # ruta del mapa -> DomainAliases compartido
+        self.key_pools = {} # keys de SerpAPI -> SerpKeyPool compartido (ritmo y saldo comunes)
+        self.proxy_pools = {} # proxies y perfiles -> ProxyPool compartido (cupos y salud comunes)
+        self.robots_cache = RobotsCache(ttl_seconds=ROBOTS_TTL_HOURS * 3600)
+        self.near_dup_index = NearDupIndex() # páginas casi idénticas vistas por cualquier trabajo
+        self.sinks = {} # ruta del CSV -> LeadSink compartido (único escritor del proceso)
+        self.running = {} # job_id -> asyncio.Task
+        self._stop = asyncio.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _seen_index_for(self, config):
+        path = os.path.splitext(config.output_csv)[0] + "_seen.idx"
+        if path not in self.seen_indexes:
+            if os.path.exists(path) and os.path.exists(config.output_csv):
+                self.seen_indexes[path] = SeenDomainIndex(path)
+            else:
+                items = iter_csv_domains(config.output_csv) if os.path.exists(config.output_csv) else []
+                self.seen_indexes[path] = SeenDomainIndex.build(path, items)
+        return self.seen_indexes[path]
+
+    def _aliases_for(self, config):
+        if config.alias_ttl_days <= 0:
+            return None
+        path = os.path.splitext(config.output_csv)[0] + "_aliases.ndjson"
+        if path not in self.alias_maps:
+            self.alias_maps[path] = DomainAliases(path, ttl_days=float(config.alias_ttl_days))
+        return self.alias_maps[path]
+
+    def _key_pool_for(self, config):
+        keys = tuple(config.api_keys())
+        if keys not in self.key_pools:
+            self.key_pools[keys] = SerpKeyPool(keys, rate_per_minute=config.serpapi_rate_per_minute,
+                                               strategy=config.serpapi_key_strategy)
+        return self.key_pools[keys]
+
+    def _proxy_pool_for(self, config):
+        if not config.proxies and len(config.header_profile_pool) <= 1:
+            return None
+        key = (tuple(config.proxies), tuple(config.header_profile_pool or [config.header_profile]))
+        if key not in self.proxy_pools:
+            self.proxy_pools[key] = ProxyPool(config.proxies, profiles=key[1], per_proxy=config.proxy_concurrency,
+                                              max_failures=config.proxy_max_failures,
+                                              health_url=config.proxy_health_url)
+        return self.proxy_pools[key]
+
+    def _sink_for(self, config):
+        if config.output_csv not in self.sinks:
+            self.sinks[config.output_csv] = LeadSink(config.output_csv, FIELDNAMES, fsync=config.csv_fsync)
+        return self.sinks[config.output_csv]
+
+    async def _run_job(self, job_id, cfg):
+        job_key = cfg.pop("SERPAPI_KEY", "") # solo en memoria desde claim_next()
+        config = CrawlerConfig.from_dict(cfg, serpapi_key=job_key or os.environ.get("SERPAPI_KEY") or "")
+        crawler = LeadCrawler(config, seen_index=self._seen_index_for(config), credit_pool=self.credit_pool,
+                              robots_cache=self.robots_cache, key_pool=self._key_pool_for(config),
+                              near_dup_index=self.near_dup_index, proxy_pool=self._proxy_pool_for(config),
+                              aliases=self._aliases_for(config))
+        sink = self._sink_for(config)
+        logs = []
+        queries_done = 0
+        leads = 0
+        status = "done"
+        error = None
+        last_flush = time.time()
+        try:
+            async with aclosing(crawler.run(self.session)) as events:
+                async for event in events:
+                    kind = event["type"]
+                    if kind == "log":
+                        logs.append(event["message"])
+                    elif kind == "plan":
+                        self.queue.update_progress(job_id, queries_total=len(event["plan"]["queries"]))
+                    elif kind == "lead":
+                        sink.add(event["row"])
+                        leads += 1
+                    elif kind == "query_done":
+                        queries_done += 1
+                        sink.flush(block=False) # si la app está reescribiendo el CSV, en el próximo lote
+                        self.queue.update_progress(job_id, queries_done=queries_done, leads=leads,
+                                                   credits_spent=crawler.credits_spent)
+                        if self.queue.status(job_id) == "cancel_requested":
+                            logs.append("[INFO] Trabajo cancelado por el usuario.")
+                            status = "cancelled"
+                            break
+                    if logs and (len(logs) >= 50 or time.time() - last_flush > 1):
+                        self.queue.append_logs(job_id, logs)
+                        logs = []
+                        last_flush = time.time()
+        except asyncio.CancelledError:
+            # El worker se detiene: el trabajo vuelve a la cola y se retoma al reiniciar
+            status = "queued"
+            logs.append("[INFO] Worker detenido; el trabajo vuelve a la cola.")
+            raise
+        except Exception as e:
+            status = "failed"
+            error = str(e)
+            logs.append(f"[ERROR] {e}")
+        finally:
+            if not sink.flush(block=False):
+                await asyncio.to_thread(sink.flush) # esperar al lock sin bloquear el loop
+            self.queue.append_logs(job_id, logs)
+            self.queue.update_progress(job_id, queries_done=queries_done, leads=leads,
+                                       credits_spent=crawler.credits_spent)
+            if status == "queued":
+                self.queue.requeue(job_id, job_key)
+            else:
+                self.queue.finish(job_id, status, error)
+            print(f"[WORKER] Trabajo {job_id} terminado: {status}")
+
+    async def _heartbeat_loop(self, started_at):
+        while not self._stop.is_set():
+            self.queue.heartbeat(started_at)
+            try:
+                await asyncio.wait_for(self._stop.wait(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def serve(self):
+        started_at = time.time()
+        other = self.queue.register_worker(started_at)
+        if other is not None:
+            # Sus trabajos 'running' no son huérfanos: no se tocan
+            print(f"[WORKER] Ya hay un worker activo (pid {other}) para esta cola; saliendo")
+            return
+        self.queue.requeue_orphans()
+        self.queue.scrub_keys()
+        idle_since = time.time()
+        print(f"[WORKER] Iniciado (pid {os.getpid()}), hasta {self.max_jobs} trabajos a la vez")
+        # Sesión compartida con medición de fases (DNS, conexión, TLS, TTFB...) para la auditoría
+        async with make_session(limit=self.connection_limit) as session:
+            self.session = session
+            heartbeat = asyncio.create_task(self._heartbeat_loop(started_at))
+            try:
+                while not self._stop.is_set():
+                    for job_id, task in list(self.running.items()):
+                        if task.done():
+                            del self.running[job_id]
+                    while len(self.running) < self.max_jobs and not self.credit_pool.exhausted():
+                        claimed = self.queue.claim_next()
+                        if claimed is None:
+                            break
+                        job_id, cfg = claimed
+                        print(f"[WORKER] Trabajo {job_id} iniciado")
+                        self.running[job_id] = asyncio.create_task(self._run_job(job_id, cfg))
+                    if self.running:
+                        idle_since = time.time()
+                    elif self.idle_exit_seconds and time.time() - idle_since > self.idle_exit_seconds:
+                        print("[WORKER] Sin trabajos; saliendo por inactividad")
+                        break
+                    try:
+                        await asyncio.wait_for(self._stop.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                for task in self.running.values():
+                    task.cancel()
+                await asyncio.gather(*self.running.values(), return_exceptions=True)
+                self._stop.set()
+                await heartbeat
+                self.queue.worker_stopped()
+                for sink in self.sinks.values():
+                    sink.close()
+                for idx in self.seen_indexes.values():
+                    idx.close()
+                for aliases in self.alias_maps.values():
+                    aliases.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker persistente del crawler de leads")
+    parser.add_argument("--db", default=JOBS_DB_PATH)
+    parser.add_argument("--max-jobs", type=int, default=2, help="trabajos simultáneos")
+    parser.add_argument("--connections", type=int, default=40, help="conexiones HTTP globales")
+    parser.add_argument("--credit-limit", type=int, default=0, help="tope de créditos de todo el worker (0 = sin tope)")
+    parser.add_argument("--idle-exit", type=float, default=0, help="minutos sin trabajos antes de salir (0 = nunca)")
+    args = parser.parse_args()
+
+    worker = CrawlerWorker(JobQueue(args.db), max_jobs=args.max_jobs, connection_limit=args.connections,
+                           credit_limit=args.credit_limit, idle_exit_seconds=args.idle_exit * 60)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, worker.stop)
+            except (NotImplementedError, RuntimeError):
+                pass # Windows: Ctrl+C llega como KeyboardInterrupt
+        await worker.serve()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("\n[WORKER] Detenido por el usuario.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+import requests
+
+# --- Libro local de créditos SerpAPI ---
+# El crawler anota cada búsqueda realmente cobrada por SerpAPI (las respuestas con
+# error y las servidas desde su caché no consumen crédito y no se anotan). La app consulta el saldo de la cuenta
+# como mucho cada N minutos en segundo plano y, entre consultas, le descuenta las
+# búsquedas del libro posteriores a la última lectura.
+
+
+def key_fingerprint(api_key: str) -> str:
+    """Identificador corto de la API key (la key nunca se escribe en disco)."""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+
+
+def record_search(path, api_key, query, start=0):
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    entry = {"ts": time.time(), "key": key_fingerprint(api_key), "query": query, "start": start}
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class LedgerReader:
+    """Lee el libro de forma incremental (solo los bytes nuevos desde la última vez)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.entries = []  # (ts, key)
+
+    def refresh(self):
+        if not os.path.exists(self.path):
+            self.offset = 0
+            self.entries = []
+            return
+        size = os.path.getsize(self.path)
+        if size < self.offset:  # el archivo se truncó o se reemplazó
+            self.offset = 0
+            self.entries = []
+        if size == self.offset:
+            return
+        with open(self.path, "rb") as fh:
+            fh.seek(self.offset)
+            data = fh.read(size - self.offset)
+        # Solo se consumen líneas completas; una línea a medio escribir queda para después
+        end = data.rfind(b"\n") + 1
+        for ln in data[:end].splitlines():
+            try:
+                e = json.loads(ln)
+                self.entries.append((float(e.get("ts", 0)), e.get("key", "")))
+            except Exception:
+                continue
+        self.offset += end
+
+    def count_since(self, ts, api_key):
+        self.refresh()
+        fp = key_fingerprint(api_key)
+        return sum(1 for t, k in self.entries if t > ts and k == fp)
+
+    def prune_before(self, ts):
+        self.entries = [e for e in self.entries if e[0] > ts]
+
+
+def fetch_account_info(api_key: str, timeout=10) -> dict:
+    """Respuesta cruda del endpoint de cuenta de SerpAPI (no consume búsquedas)."""
+    resp = requests.get("https://serpapi.com/account", params={"api_key": api_key}, timeout=timeout)
+    return resp.json()
+
+
+def fetch_account_balance(api_key: str, timeout=10):
+    """(usados, restantes, límite) según el endpoint de cuenta de SerpAPI."""
+    data = fetch_account_info(api_key, timeout=timeout)
+    used = int(data.get("this_month_usage", data.get("searches_per_month", 0)))
+    remaining = int(data.get("plan_searches_left", data.get("total_searches_left", 0)))
+    # el límite del plan se deduce:
+    limit = used + remaining
+    return used, remaining, limit
+
+
+class BalanceCache:
+    """
+    Saldo de SerpAPI refrescado en un hilo en segundo plano cada `refresh_seconds`
+    y conciliado con el libro local entre refrescos. snapshot() nunca hace red.
+    """
+
+    def __init__(self, api_key, ledger_path, refresh_seconds=300):
+        self.api_key = api_key
+        self.refresh_seconds = refresh_seconds
+        self.ledger = LedgerReader(ledger_path)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._balance = None      # (used, remaining, limit)
+        self._fetched_at = 0.0
+        self.error = None
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                balance = fetch_account_balance(self.api_key)
+                with self._lock:
+                    self._balance = balance
+                    self._fetched_at = time.time()
+                    self.error = None
+                    self.ledger.prune_before(self._fetched_at)
+            except Exception as e:
+                with self._lock:
+                    self.error = str(e)
+            self._wakeup.wait(self.refresh_seconds)
+            self._wakeup.clear()
+
+    def refresh_now(self):
+        """Pide un refresco inmediato (sin esperar a que termine)."""
+        self._wakeup.set()
+
+    def snapshot(self):
+        """
+        Devuelve dict con used, remaining, limit, local (búsquedas del libro desde la
+        última lectura) y fetched_at; None si aún no hubo ninguna lectura correcta.
+        """
+        with self._lock:
+            if self._balance is None:
+                return None
+            used, remaining, limit = self._balance
+            local = self.ledger.count_since(self._fetched_at, self.api_key)
+            return {
+                "used": used + local,
+                "remaining": max(0, remaining - local),
+                "limit": limit,
+                "local": local,
+                "fetched_at": self._fetched_at,
+            }
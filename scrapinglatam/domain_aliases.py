@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+# --- Mapa de alias -> dominio canónico (redirecciones aprendidas) ---
+# Muchos sitios responden en varios hosts o ccTLD (club.com.ar -> club.com,
+# http://uba.ar -> https://www.uba.ar) y el SERP devuelve cualquiera de ellos. Cuando
+# una visita termina, tras las redirecciones, en otro dominio registrable, se anota
+# alias -> (dominio canónico, URL final). Con eso el crawler deduplica por el dominio
+# canónico (el alias cuenta como ya visto si el canónico lo está) y las visitas
+# siguientes al alias van directas a la URL canónica, sin recorrer otra vez la cadena.
+#
+# Persistencia: NDJSON de solo anexado junto al CSV (<csv>_aliases.ndjson); al abrir
+# gana la última línea de cada alias y, si el archivo acumula muchas líneas viejas, se
+# reescribe. Las entradas caducan a los ttl_days (los sitios cambian de dominio).
+
+MAX_HOPS = 5 # alias encadenados (a -> b -> c) que se siguen como mucho
+COMPACT_RATIO = 2 # se reescribe al abrir si hay más del doble de líneas que de alias
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return parts.scheme, parts.netloc
+
+
+class DomainAliases:
+    """alias -> {"domain", "url", "keeps_path", "ts"}, persistente y compartible por proceso."""
+
+    def __init__(self, path, ttl_days=90):
+        self.path = path
+        self.ttl_days = ttl_days
+        self._entries = {}
+        self._fh = None
+        self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        lines = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as fh:
+                for ln in fh:
+                    lines += 1
+                    try:
+                        entry = json.loads(ln)
+                        self._entries[entry.pop("alias")] = entry
+                    except (ValueError, KeyError, AttributeError):
+                        continue
+        expired = [a for a, e in self._entries.items() if not self._fresh(e)]
+        for alias in expired:
+            del self._entries[alias]
+        if lines > COMPACT_RATIO * len(self._entries) + 100:
+            self._rewrite()
+
+    def _rewrite(self):
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as out:
+            for alias, entry in self._entries.items():
+                out.write(json.dumps({"alias": alias, **entry}, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+
+    def _fresh(self, entry):
+        return self.ttl_days <= 0 or time.time() - entry.get("ts", 0) < self.ttl_days * 86400
+
+    def get(self, domain):
+        """Entrada canónica de `domain` siguiendo la cadena de alias, o None si no es alias."""
+        entry = None
+        seen = {domain}
+        for _ in range(MAX_HOPS):
+            nxt = self._entries.get(entry["domain"] if entry else domain)
+            if nxt is None or not self._fresh(nxt) or nxt["domain"] in seen:
+                break
+            entry = nxt
+            seen.add(entry["domain"])
+        return entry
+
+    def resolve(self, domain):
+        """Dominio canónico de `domain` (él mismo si no es alias)."""
+        entry = self.get(domain)
+        return entry["domain"] if entry else domain
+
+    def rewrite(self, url, domain):
+        """URL a pedir en lugar de `url` (de `domain`), o la misma si no es alias."""
+        entry = self.get(domain)
+        if entry is None:
+            return url
+        if not entry["keeps_path"]:
+            return entry["url"] # el alias manda todo a la misma página
+        scheme, netloc = _origin(entry["url"])
+        parts = urlsplit(url)
+        return urlunsplit((scheme, netloc, parts.path, parts.query, ""))
+
+    def add(self, alias, domain, requested_url, final_url):
+        """Anota que `requested_url` (de `alias`) acabó en `final_url` (de `domain`)."""
+        if not alias or not domain or alias == domain:
+            return
+        if self.resolve(domain) == alias:
+            self._entries.pop(domain, None) # el sentido se invirtió: manda el último visto
+        keeps_path = urlsplit(requested_url).path.rstrip("/") == urlsplit(final_url).path.rstrip("/")
+        old = self._entries.get(alias)
+        if old and old["domain"] == domain and old["keeps_path"] == keeps_path and old["url"] == final_url:
+            old["ts"] = time.time() # sin cambios: solo se refresca en memoria
+            return
+        entry = {"domain": domain, "url": final_url, "keeps_path": keeps_path, "ts": int(time.time())}
+        self._entries[alias] = entry
+        if self._fh is None:
+            d = os.path.dirname(self.path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            self._fh = open(self.path, "a", encoding="utf-8")
+        self._fh.write(json.dumps({"alias": alias, **entry}, ensure_ascii=False) + "\n")
+        self._fh.flush()
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
@@ -0,0 +1,44 @@
+import functools
+from urllib.parse import urlsplit
+
+import tldextract
+
+# --- Resolución de dominios sin red ---
+# tldextract por defecto descarga la Public Suffix List en el primer uso (lento en
+# frío y falla en workers sin salida a internet). Aquí solo se usa el snapshot de
+# la PSL que trae el paquete (versión fijada en requirements.txt), sin caché en disco.
+_EXTRACT = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None, fallback_to_snapshot=True)
+
+
+def host_of(url_or_host: str) -> str:
+    """Host en minúsculas, sin puerto, credenciales ni punto final."""
+    s = (url_or_host or "").strip()
+    if not s:
+        return ""
+    if "//" not in s:
+        s = "//" + s
+    try:
+        host = urlsplit(s).hostname or ""
+    except ValueError:
+        return ""
+    return host.rstrip(".").lower()
+
+
+@functools.lru_cache(maxsize=65536)
+def registered_domain_of_host(host: str) -> str:
+    """Dominio registrable (dominio + sufijo público) de un host ya normalizado."""
+    info = _EXTRACT(host)
+    if not info.domain or not info.suffix:
+        return ""
+    return f"{info.domain}.{info.suffix}"
+
+
+def normalize_domain(url_or_host: str) -> str:
+    """
+    Dominio registrable de una URL o host ('https://www.uba.edu.ar/x' -> 'uba.edu.ar').
+    Devuelve "" si no hay sufijo público reconocible (IPs, localhost...).
+    """
+    host = host_of(url_or_host)
+    if not host:
+        return ""
+    return registered_domain_of_host(host)
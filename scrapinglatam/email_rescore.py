@@ -0,0 +1,121 @@
+import os
+import re
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+OUTPUT_CSV = os.path.join(BASE_DIR, "scrapinglatam", "latam_leads.csv")
+
+from scrapinglatam.latam_lead_crawler_serpapi import EMAIL_AVOID, EMAIL_PREFER
+from scrapinglatam.lead_store import rewrite_csv_column
+from scrapinglatam.lead_sink import csv_lock
+
+# --- Recalcular email_best en todo el almacén ---
+# Misma regla que pick_best_email() (se descartan EMAIL_AVOID; gana la primera palabra
+# de EMAIL_PREFER, luego el email del propio dominio, luego la parte local más corta y,
+# a igualdad, el orden en emails_all), pero aplicada por bloques con operaciones
+# vectorizadas (Arrow/numpy) sobre emails_all "explotado". Así, al tocar las listas de
+# preferencia se reordena todo el histórico sin volver a descargar nada.
+
+CHUNK_ROWS = 100_000
+NO_PREFERENCE = 999
+
+
+def best_emails(emails_all: pd.Series, domains: pd.Series) -> pd.Series:
+    """email_best recalculado para cada fila (Series alineada con `emails_all`)."""
+    # Todo con kernels de Arrow/numpy: ningún bucle de Python por email
+    lists = pc.split_pattern(pa.array(emails_all.fillna("").to_numpy(dtype=object), pa.string()), ",")
+    emails = pc.utf8_trim_whitespace(pc.list_flatten(lists))
+    rows = pc.list_parent_indices(lists).to_numpy()
+    keep = pc.not_equal(emails, "").to_numpy(zero_copy_only=False)
+    emails, rows = pc.filter(emails, pa.array(keep)), rows[keep]
+    best = np.full(len(emails_all), "", dtype=object)
+    if len(emails) == 0:
+        return pd.Series(best, index=emails_all.index)
+
+    pos = np.arange(len(rows)) - np.searchsorted(rows, rows, side="left") # orden dentro de la fila
+    low = pc.utf8_lower(emails)
+    avoid = (pc.match_substring_regex(low, "|".join(re.escape(w) for w in EMAIL_AVOID)).to_numpy(zero_copy_only=False)
+             if EMAIL_AVOID else np.zeros(len(rows), dtype=bool))
+    prefer = np.full(len(rows), NO_PREFERENCE)
+    for idx in reversed(range(len(EMAIL_PREFER))):
+        prefer = np.where(pc.match_substring(low, EMAIL_PREFER[idx]).to_numpy(zero_copy_only=False), idx, prefer)
+    email_domain = pc.replace_substring_regex(low, "^.*@", "").to_numpy(zero_copy_only=False)
+    row_domain = domains.fillna("").str.lower().to_numpy(dtype=object)[rows]
+    same_domain = np.where((row_domain != "") & (email_domain == row_domain), -1, 0)
+    local_len = pc.utf8_length(pc.replace_substring_regex(low, "@.*$", "")).to_numpy()
+
+    # El primer candidato de cada fila tras ordenar por (fila, preferencia, dominio, largo, posición)
+    order = np.lexsort((pos, local_len, same_domain, prefer, rows))
+    order = order[~avoid[order]]
+    values = emails.to_numpy(zero_copy_only=False)
+    first_idx = np.flatnonzero(pos == 0)
+    best[rows[first_idx]] = values[first_idx] # si todos están vetados se queda el primero (como pick_best_email)
+    winners = order[np.unique(rows[order], return_index=True)[1]]
+    best[rows[winners]] = values[winners]
+    return pd.Series(best, index=emails_all.index)
+
+
+def rescore_leads(path=OUTPUT_CSV, dry_run=False, store=None, chunk_rows=CHUNK_ROWS):
+    """
+    Recalcula email_best en `path`. Devuelve (filas, {rowid: nuevo email_best}) con solo
+    las filas que cambian; el CSV se reescribe (en streaming) únicamente si hay cambios.
+    `store` (LeadStore, opcional) recibe los mismos cambios sin reconstruir el espejo.
+    """
+    if store is not None:
+        store.sync()
+    changes = {}
+    rows = 0
+    # Solo se leen las columnas que intervienen en la regla
+    reader = pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig", chunksize=chunk_rows,
+                         usecols=["domain", "emails_all", "email_best"], skip_blank_lines=True)
+    for chunk in reader:
+        new_best = best_emails(chunk["emails_all"], chunk["domain"])
+        changed = (new_best != chunk["email_best"]).to_numpy()
+        # rowid = posición de la fila (1 = primera); el índice sigue entre bloques
+        changes.update(zip((chunk.index[changed] + 1).tolist(), new_best[changed].tolist()))
+        rows += len(chunk)
+    if changes and not dry_run:
+        # El espejo se actualiza sin soltar el lock: nada se anexa entre medias
+        with csv_lock(path):
+            rewrite_csv_column(path, "email_best", changes)
+            if store is not None:
+                store.update_email_best(changes)
+    return rows, changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recalcula email_best en todo el CSV de leads")
+    parser.add_argument("--input", default=OUTPUT_CSV, help="CSV de leads")
+    parser.add_argument("--dry-run", action="store_true", help="solo informar de los cambios")
+    parser.add_argument("--force", action="store_true", help="reescribir aunque haya un worker activo")
+    args = parser.parse_args(argv)
+
+    store = None
+    if not args.dry_run:
+        from scrapinglatam.crawler_worker import JobQueue
+        if not args.force and JobQueue().worker_alive():
+            parser.error("hay un worker de rastreo activo escribiendo en el CSV; detenlo o usa --force")
+        from scrapinglatam.lead_store import LeadStore, LEADS_DB_PATH
+        if os.path.abspath(args.input) == os.path.abspath(OUTPUT_CSV) and os.path.exists(LEADS_DB_PATH):
+            store = LeadStore(args.input)
+
+    started = time.time()
+    rows, changes = rescore_leads(args.input, dry_run=args.dry_run, store=store)
+    for rowid, email in list(changes.items())[:10]:
+        print(f"[RESCORE] fila {rowid}: {email}")
+    verb = "cambiarían" if args.dry_run else "actualizadas"
+    print(f"[RESCORE] {rows} filas revisadas, {len(changes)} {verb} en {time.time() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
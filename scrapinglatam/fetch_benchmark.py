@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import socket
+import multiprocessing as mp
+
+import aiohttp
+from aiohttp import web
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+from scrapinglatam.fetchers import BACKENDS, make_fetcher
+from scrapinglatam.proxy_pool import ProxyPool, ProxiedFetcher
+
+# --- Benchmark de backends HTTP contra un servidor local ---
+# Un proceso sirve páginas HTML sintéticas (tamaño y latencia configurables) y cada
+# backend se mide en su propio proceso, para que la memoria (RSS máximo) y la CPU sean
+# comparables: peticiones/s, latencias p50/p95, errores, CPU y memoria añadida.
+# Se mide el cliente directamente, sin la frontera (su cortesía por host dominaría
+# con un único servidor). Uso:
+#   python -m scrapinglatam.fetch_benchmark --requests 2000 --concurrency 50 --page-kb 40
+#
+# Con --proxies N el mismo proceso servidor levanta N proxies HTTP locales de pega que
+# reenvían al servidor, y las peticiones pasan por el pool de proxy_pool.py; con
+# --bad-proxies se añaden proxies que rechazan la conexión y con --blocked-proxies
+# otros que responden 429, para ver cómo el pool los retira sin perder ritmo:
+#   python -m scrapinglatam.fetch_benchmark --backends aiohttp --proxies 4 --bad-proxies 1 --blocked-proxies 1
+
+
+def _page(size_kb):
+    filler = "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>\n"
+    body = filler * max(1, size_kb * 1024 // len(filler))
+    return f"<html><body>{body}<a href='mailto:contacto@ejemplo.cl'>contacto@ejemplo.cl</a></body></html>"
+
+
+async def _listen(handler):
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, backlog=1024)
+    await site.start()
+    return site._server.sockets[0].getsockname()[1]
+
+
+def _closed_port():
+    """Puerto local sin nadie escuchando: un proxy caído (conexión rechazada)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve(port_queue, page_kb, latency_ms, proxies=0, bad_proxies=0, blocked_proxies=0):
+    html = _page(page_kb)
+
+    async def handler(request):
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        return web.Response(text=html, content_type="text/html")
+
+    async def main():
+        port = await _listen(handler)
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+
+        # Proxy de reenvío: la petición llega con la URL absoluta (GET http://host/ruta)
+        async def forward(request):
+            async with session.get(request.raw_path, headers={"User-Agent": request.headers.get("User-Agent", "")}) as resp:
+                return web.Response(body=await resp.read(), status=resp.status, content_type="text/html")
+
+        async def blocked(request):
+            return web.Response(status=429, text="Too Many Requests")
+
+        proxy_urls = [f"http://127.0.0.1:{await _listen(forward)}" for _ in range(proxies)]
+        proxy_urls += [f"http://127.0.0.1:{_closed_port()}" for _ in range(bad_proxies)]
+        proxy_urls += [f"http://127.0.0.1:{await _listen(blocked)}" for _ in range(blocked_proxies)]
+        port_queue.put((port, proxy_urls))
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def _rss_peak_mb():
+    # ru_maxrss: KB en Linux, bytes en macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_backend(backend, url, requests, concurrency, result_queue, proxies=(), per_proxy=0):
+    pool = None
+
+    async def main():
+        nonlocal pool
+        latencies = []
+        errors = 0
+        fetcher = make_fetcher(backend, limit=concurrency)
+        if proxies:
+            pool = ProxyPool(proxies, per_proxy=per_proxy or concurrency, log=lambda message: None)
+            fetcher = ProxiedFetcher(fetcher, pool)
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            nonlocal errors
+            async with sem:
+                try:
+                    status, text, ms = (await fetcher.get(f"{url}/p{i}"))[:3]
+                    if status != 200 or "@" not in text:
+                        errors += 1
+                    latencies.append(ms)
+                except Exception:
+                    errors += 1
+
+        async with fetcher:
+            await one(-1) # calentamiento: conexión inicial fuera de la medida
+            latencies.clear()
+            started = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(requests)))
+            return time.perf_counter() - started, latencies, errors
+
+    try:
+        base_rss = _rss_peak_mb()
+        cpu0 = time.process_time()
+        elapsed, latencies, errors = asyncio.run(main())
+        latencies.sort()
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0
+        result_queue.put({
+            "backend": backend,
+            "requests": requests,
+            "errors": errors,
+            "seconds": round(elapsed, 3),
+            "req_per_s": round(requests / elapsed, 1) if elapsed else 0,
+            "p50_ms": pick(0.5),
+            "p95_ms": pick(0.95),
+            "cpu_s": round(time.process_time() - cpu0, 2),
+            "rss_peak_mb": round(_rss_peak_mb(), 1),
+            "rss_added_mb": round(_rss_peak_mb() - base_rss, 1),
+            "proxies": pool.summary() if pool is not None else "",
+        })
+    except Exception as e:
+        result_queue.put({"backend": backend, "error": str(e)})
+
+
+def run_benchmark(backends, requests=2000, concurrency=50, page_kb=40, latency_ms=0,
+                  proxies=0, bad_proxies=0, blocked_proxies=0, per_proxy=0):
+    """Mide cada backend contra un servidor local (y sus proxies de pega). Devuelve una lista de dicts."""
+    ctx = mp.get_context("spawn")
+    port_queue = ctx.Queue()
+    server = ctx.Process(target=_serve, args=(port_queue, page_kb, latency_ms, proxies, bad_proxies, blocked_proxies),
+                         daemon=True)
+    server.start()
+    try:
+        port, proxy_urls = port_queue.get(timeout=30)
+        url = f"http://127.0.0.1:{port}"
+        results = []
+        for backend in backends:
+            result_queue = ctx.Queue()
+            proc = ctx.Process(target=_run_backend, args=(backend, url, requests, concurrency, result_queue,
+                                                          proxy_urls, per_proxy))
+            proc.start()
+            results.append(result_queue.get())
+            proc.join()
+        return results
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara los backends HTTP del crawler contra un servidor local")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="lista separada por comas")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--page-kb", type=int, default=40, help="tamaño de cada página HTML")
+    parser.add_argument("--latency-ms", type=int, default=0, help="retardo del servidor por respuesta")
+    parser.add_argument("--proxies", type=int, default=0, help="proxies locales de pega por los que pasar")
+    parser.add_argument("--bad-proxies", type=int, default=0, help="proxies que rechazan la conexión")
+    parser.add_argument("--blocked-proxies", type=int, default=0, help="proxies que responden 429")
+    parser.add_argument("--per-proxy", type=int, default=0, help="peticiones simultáneas por proxy (0 = concurrency)")
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    args = parser.parse_args(argv)
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = [b for b in backends if b not in BACKENDS]
+    if unknown:
+        parser.error(f"backends desconocidos: {', '.join(unknown)}")
+
+    results = run_benchmark(backends, args.requests, args.concurrency, args.page_kb, args.latency_ms,
+                            args.proxies, args.bad_proxies, args.blocked_proxies, args.per_proxy)
+    cols = ["backend", "req_per_s", "p50_ms", "p95_ms", "errors", "cpu_s", "rss_added_mb", "rss_peak_mb"]
+    print("[BENCH] " + " | ".join(cols))
+    for r in results:
+        if "error" in r:
+            print(f"[BENCH] {r['backend']} | no disponible: {r['error']}")
+        else:
+            print("[BENCH] " + " | ".join(str(r[c]) for c in cols))
+            if r["proxies"]:
+                print(f"[BENCH]   proxies: {r['proxies']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import contextvars
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import aiohttp
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+# --- Clientes HTTP intercambiables para visitar las webs ---
+# El rastreo solo necesita "GET y texto": cada backend implementa get() y traduce sus
+# errores a asyncio.TimeoutError (tiempo agotado) o FetchError (red/protocolo), de modo
+# que el crawler y la frontera no dependen del cliente. Backend, verificación TLS y
+# perfil de cabeceras se eligen en crawler_config.json (FETCHER_BACKEND, VERIFY_TLS,
+# HEADER_PROFILE). Para compararlos: python -m scrapinglatam.fetch_benchmark
+#
+# - aiohttp: el de siempre; puede envolver la ClientSession compartida del worker.
+# - httpx:   opcional (pip install "httpx[http2]"); negocia HTTP/2 por TLS si h2 está
+#            instalado, con multiplexación de peticiones al mismo host.
+# - urllib:  biblioteca estándar en un pool de hilos; sin dependencias, de referencia.
+#
+# Con aiohttp cada get() devuelve además los tiempos por fase (ver PHASES), medidos
+# con ganchos TraceConfig y, para separar TCP de TLS (aiohttp no tiene señal de TLS),
+# con un conector que abre el socket antes de pasarle el handshake. Los demás backends
+# devuelven timings=None.
+#
+# get() acepta además `proxy` (URL http://[usuario:clave@]host:puerto) y `headers` por
+# petición: los usa ProxiedFetcher (proxy_pool.py) para repartir las visitas entre
+# varias salidas, cada una con su perfil de cabeceras.
+
+DEFAULT_TIMEOUT = 15
+
+HEADER_PROFILES = {
+    "chrome": {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                      "Chrome/126.0.0.0 Safari/537.36",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+        "Accept-Language": "es-419,es;q=0.9,en;q=0.8",
+    },
+    "chrome_mac": {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) "
+                      "Chrome/126.0.0.0 Safari/537.36",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+        "Accept-Language": "es-ES,es;q=0.9,en;q=0.8",
+    },
+    "edge": {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                      "Chrome/126.0.0.0 Safari/537.36 Edg/126.0.0.0",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+        "Accept-Language": "es-MX,es;q=0.9,en;q=0.8",
+    },
+    "safari": {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+                      "Version/17.5 Safari/605.1.15",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "es-419,es;q=0.9",
+    },
+    "firefox": {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:128.0) Gecko/20100101 Firefox/128.0",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "es-ES,es;q=0.8,en-US;q=0.5,en;q=0.3",
+    },
+    # Identificarse como bot: algunos sitios lo prefieren y robots.txt aplica tal cual
+    "bot": {
+        "User-Agent": "scrapinglatam-bot/1.0",
+        "Accept": "text/html,*/*;q=0.5",
+    },
+}
+DEFAULT_HEADER_PROFILE = "chrome"
+
+
+class FetchError(Exception):
+    """Error de red o de protocolo al descargar una URL (común a todos los backends)."""
+
+
+class ProxyError(FetchError):
+    """El fallo es del proxy (no conecta, rechaza el túnel o pide credenciales), no del sitio."""
+
+
+class FetchResult(NamedTuple):
+    status: int
+    text: str
+    elapsed_ms: int
+    timings: Optional[dict] = None # fases de la petición (solo aiohttp)
+    final_url: Optional[str] = None # URL tras las redirecciones
+
+
+# --- Tiempos por fase (aiohttp) ---
+# ms acumulados entre saltos de redirección; connect/tls solo cuentan en conexiones
+# nuevas (reused = la conexión salió del pool).
+PHASES = ("queue_ms", "dns_ms", "connect_ms", "tls_ms", "ttfb_ms", "download_ms")
+
+_connect_timings = contextvars.ContextVar("connect_timings", default=None)
+
+
+def _new_timings():
+    return dict.fromkeys(PHASES, 0.0) | {"bytes": 0, "redirects": 0, "reused": False, "_marks": {}}
+
+
+def _finish_timings(t):
+    t.pop("_marks", None)
+    for phase in PHASES:
+        t[phase] = int(round(t[phase]))
+    return t
+
+
+def _mark(name):
+    async def start(session, ctx, params):
+        if isinstance(ctx.trace_request_ctx, dict):
+            ctx.trace_request_ctx["_marks"][name] = time.perf_counter()
+    return start
+
+
+def _span(name, phase):
+    async def end(session, ctx, params):
+        t = ctx.trace_request_ctx
+        if isinstance(t, dict) and name in t["_marks"]:
+            t[phase] += (time.perf_counter() - t["_marks"].pop(name)) * 1000
+    return end
+
+
+async def _on_connection_create_end(session, ctx, params):
+    t = ctx.trace_request_ctx
+    if isinstance(t, dict) and "create" in t["_marks"]:
+        total = (time.perf_counter() - t["_marks"].pop("create")) * 1000
+        split = t["_marks"].pop("split", None)
+        dns = t["_marks"].pop("dns_total", 0.0)
+        if split is None: # http:// o conector sin medición propia: todo es "connect"
+            t["connect_ms"] += max(0.0, total - dns)
+        else:
+            t["connect_ms"] += split[0]
+            t["tls_ms"] += split[1]
+
+
+async def _on_dns_end(session, ctx, params):
+    t = ctx.trace_request_ctx
+    if isinstance(t, dict) and "dns" in t["_marks"]:
+        ms = (time.perf_counter() - t["_marks"].pop("dns")) * 1000
+        t["dns_ms"] += ms
+        t["_marks"]["dns_total"] = t["_marks"].get("dns_total", 0.0) + ms
+
+
+async def _on_reuse(session, ctx, params):
+    if isinstance(ctx.trace_request_ctx, dict):
+        ctx.trace_request_ctx["reused"] = True
+
+
+async def _on_redirect(session, ctx, params):
+    if isinstance(ctx.trace_request_ctx, dict):
+        ctx.trace_request_ctx["redirects"] += 1
+
+
+def phase_trace_config():
+    """TraceConfig que rellena el dict pasado como trace_request_ctx a session.get()."""
+    tc = aiohttp.TraceConfig()
+    tc.on_connection_queued_start.append(_mark("queue"))
+    tc.on_connection_queued_end.append(_span("queue", "queue_ms"))
+    tc.on_connection_create_start.append(_mark("create"))
+    tc.on_connection_create_end.append(_on_connection_create_end)
+    tc.on_connection_reuseconn.append(_on_reuse)
+    tc.on_dns_resolvehost_start.append(_mark("dns"))
+    tc.on_dns_resolvehost_end.append(_on_dns_end)
+    tc.on_request_headers_sent.append(_mark("sent"))
+    tc.on_request_end.append(_span("sent", "ttfb_ms"))     # cabeceras de respuesta recibidas
+    tc.on_request_redirect.append(_span("sent", "ttfb_ms"))
+    tc.on_request_redirect.append(_on_redirect)
+    return tc
+
+
+class TimedConnector(aiohttp.TCPConnector):
+    """
+    TCPConnector que, en conexiones TLS, abre primero el socket (TCP) y luego hace el
+    handshake sobre él, para medir cada parte por separado.
+    """
+
+    async def _wrap_create_connection(self, *args, req, timeout, client_error=aiohttp.ClientConnectorError, **kwargs):
+        marks = _connect_timings.get()
+        if marks is None or not kwargs.get("ssl") or len(args) != 3 or kwargs.get("local_addr"):
+            return await super()._wrap_create_connection(*args, req=req, timeout=timeout,
+                                                         client_error=client_error, **kwargs)
+        factory, host, port = args
+        family = kwargs.pop("family", 0) or socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM, kwargs.pop("proto", 0))
+        kwargs.pop("flags", None)
+        kwargs.pop("local_addr", None)
+        start = time.perf_counter()
+        try:
+            sock.setblocking(False)
+            async with asyncio.timeout(timeout.sock_connect):
+                await self._loop.sock_connect(sock, (host, port))
+        except OSError as exc:
+            sock.close()
+            if exc.errno is None and isinstance(exc, asyncio.TimeoutError):
+                raise
+            raise client_error(req.connection_key, exc) from exc
+        except BaseException:
+            sock.close()
+            raise
+        connected = time.perf_counter()
+        try:
+            result = await super()._wrap_create_connection(factory, req=req, timeout=timeout,
+                                                           client_error=client_error, sock=sock, **kwargs)
+        except BaseException:
+            sock.close()
+            raise
+        marks["split"] = ((connected - start) * 1000, (time.perf_counter() - connected) * 1000)
+        return result
+
+
+def make_session(limit=20, **kwargs):
+    """ClientSession con medición de fases; úsese también para la sesión compartida."""
+    return aiohttp.ClientSession(connector=TimedConnector(limit=limit),
+                                 trace_configs=[phase_trace_config()], **kwargs)
+
+
+def header_profile(name):
+    if name not in HEADER_PROFILES:
+        raise ValueError(f"Perfil de cabeceras desconocido: {name} (disponibles: {', '.join(HEADER_PROFILES)})")
+    return dict(HEADER_PROFILES[name])
+
+
+class Fetcher:
+    """Interfaz común. Usar como `async with` o llamar a close() al terminar."""
+
+    name = ""
+
+    def __init__(self, verify_tls=False, headers=None, timeout=DEFAULT_TIMEOUT, limit=20):
+        self.verify_tls = verify_tls
+        self.headers = dict(headers if headers is not None else HEADER_PROFILES[DEFAULT_HEADER_PROFILE])
+        self.timeout = timeout
+        self.limit = limit
+
+    async def get(self, url, timeout=None, proxy=None, headers=None) -> FetchResult:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class AiohttpFetcher(Fetcher):
+    name = "aiohttp"
+
+    def __init__(self, session=None, **kwargs):
+        super().__init__(**kwargs)
+        self._own_session = session is None
+        self.session = session or make_session(limit=self.limit)
+
+    async def get(self, url, timeout=None, proxy=None, headers=None):
+        """
+        Una sesión sin phase_trace_config (p. ej. creada fuera con aiohttp.ClientSession)
+        funciona igual, con las fases a 0 salvo download_ms y bytes.
+        """
+        start = time.perf_counter()
+        timings = _new_timings()
+        # El conector lee las marcas por contexto: la conexión se abre dentro de esta tarea
+        token = _connect_timings.set(timings["_marks"])
+        try:
+            async with self.session.get(url, ssl=bool(self.verify_tls), headers=headers or self.headers,
+                                        proxy=proxy, timeout=aiohttp.ClientTimeout(total=timeout or self.timeout),
+                                        trace_request_ctx=timings) as resp:
+                body_start = time.perf_counter()
+                body = await resp.read()
+                text = await resp.text(errors="ignore") # decodifica el cuerpo ya leído
+                timings["download_ms"] = (time.perf_counter() - body_start) * 1000
+                timings["bytes"] = len(body)
+                return FetchResult(resp.status, text, int((time.perf_counter() - start) * 1000),
+                                   _finish_timings(timings), str(resp.url))
+        except asyncio.TimeoutError:
+            raise
+        except (aiohttp.ClientProxyConnectionError, aiohttp.ClientHttpProxyError) as e:
+            raise ProxyError(str(e) or type(e).__name__) from e
+        except aiohttp.ClientError as e:
+            raise FetchError(str(e) or type(e).__name__) from e
+        finally:
+            _connect_timings.reset(token)
+
+    async def close(self):
+        if self._own_session:
+            await self.session.close()
+
+
+class HttpxFetcher(Fetcher):
+    name = "httpx"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        try:
+            import httpx
+        except ImportError as e:
+            raise RuntimeError('El backend httpx requiere httpx (pip install "httpx[http2]")') from e
+        try:
+            import h2  # noqa: F401 (HTTP/2 solo si está instalado)
+            http2 = True
+        except ImportError:
+            http2 = False
+        self._httpx = httpx
+        self.http2 = http2
+        self.client = self._new_client(None)
+        self._proxied = {} # proxy -> AsyncClient (el proxy se fija al crear el cliente)
+
+    def _new_client(self, proxy):
+        httpx = self._httpx
+        limits = httpx.Limits(max_connections=self.limit, max_keepalive_connections=self.limit)
+        return httpx.AsyncClient(http2=self.http2, verify=bool(self.verify_tls), headers=self.headers,
+                                 limits=limits, timeout=self.timeout, follow_redirects=True, proxy=proxy)
+
+    async def get(self, url, timeout=None, proxy=None, headers=None):
+        httpx = self._httpx
+        client = self.client
+        if proxy:
+            if proxy not in self._proxied:
+                self._proxied[proxy] = self._new_client(proxy)
+            client = self._proxied[proxy]
+        start = time.perf_counter()
+        try:
+            resp = await client.get(url, headers=headers, timeout=timeout or self.timeout)
+        except httpx.TimeoutException as e:
+            raise asyncio.TimeoutError() from e
+        except httpx.ProxyError as e:
+            raise ProxyError(str(e) or type(e).__name__) from e
+        except httpx.HTTPError as e:
+            raise FetchError(str(e) or type(e).__name__) from e
+        return FetchResult(resp.status_code, resp.text, int((time.perf_counter() - start) * 1000),
+                           final_url=str(resp.url))
+
+    async def close(self):
+        for client in [self.client, *self._proxied.values()]:
+            await client.aclose()
+
+
+class UrllibFetcher(Fetcher):
+    name = "urllib"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        import ssl
+        context = ssl.create_default_context()
+        if not self.verify_tls:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        self._context = context
+        self._openers = {None: urllib.request.build_opener(urllib.request.HTTPSHandler(context=context))}
+        self._pool = ThreadPoolExecutor(max_workers=self.limit, thread_name_prefix="fetch")
+
+    def _opener(self, proxy):
+        if proxy not in self._openers:
+            self._openers[proxy] = urllib.request.build_opener(
+                urllib.request.HTTPSHandler(context=self._context),
+                urllib.request.ProxyHandler({"http": proxy, "https": proxy}))
+        return self._openers[proxy]
+
+    def _get_blocking(self, url, timeout, proxy=None, headers=None):
+        start = time.perf_counter()
+        request = urllib.request.Request(url, headers=headers or self.headers)
+        try:
+            with self._opener(proxy).open(request, timeout=timeout) as resp:
+                status, body, charset = resp.status, resp.read(), resp.headers.get_content_charset()
+                final_url = resp.geturl()
+        except urllib.error.HTTPError as e:
+            if e.code == 407:
+                raise ProxyError(f"HTTP 407 del proxy {proxy}") from e
+            status, body, charset = e.code, e.read(), e.headers.get_content_charset()
+            final_url = e.geturl()
+        except TimeoutError as e:
+            raise asyncio.TimeoutError() from e
+        except (urllib.error.URLError, OSError) as e:
+            if isinstance(getattr(e, "reason", None), TimeoutError):
+                raise asyncio.TimeoutError() from e
+            if proxy: # la conexión es con el proxy: si no se establece, el fallo es suyo
+                raise ProxyError(str(e)) from e
+            raise FetchError(str(e)) from e
+        text = body.decode(charset or "utf-8", errors="ignore")
+        return FetchResult(status, text, int((time.perf_counter() - start) * 1000), final_url=final_url)
+
+    async def get(self, url, timeout=None, proxy=None, headers=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, self._get_blocking, url, timeout or self.timeout,
+                                          proxy, headers)
+
+    async def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+BACKENDS = {
+    "aiohttp": AiohttpFetcher,
+    "httpx": HttpxFetcher,
+    "urllib": UrllibFetcher,
+}
+
+
+def make_fetcher(backend="aiohttp", session=None, **kwargs) -> Fetcher:
+    """
+    Crea el fetcher del backend indicado. `session` (aiohttp.ClientSession) solo se usa
+    con el backend aiohttp, para compartir el pool de conexiones existente.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend HTTP desconocido: {backend} (disponibles: {', '.join(BACKENDS)})")
+    if backend == "aiohttp":
+        return AiohttpFetcher(session=session, **kwargs)
+    return BACKENDS[backend](**kwargs)
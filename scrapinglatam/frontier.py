@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+import asyncio
+from collections import deque
+from urllib import robotparser
+from urllib.parse import urlsplit
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+from scrapinglatam.domains import host_of
+
+# --- Frontera de rastreo con cortesía por host ---
+# Las URLs se encolan por host. Cada host tiene como mucho `per_host` peticiones en
+# vuelo y un intervalo mínimo entre arranques (el mayor entre el configurado y el
+# Crawl-delay de su robots.txt). Un semáforo global acota las conexiones totales; como
+# sus esperas son FIFO, los hosts se van intercalando y un host lento o con retraso no
+# ocupa huecos que otros podrían usar (la espera por cortesía se hace sin tener plaza).
+
+ROBOTS_TIMEOUT = 10
+MAX_CRAWL_DELAY = 30 # segundos; un Crawl-delay mayor se recorta
+
+
+class RobotsDisallowed(Exception):
+    """robots.txt del host no permite la URL."""
+
+
+def _user_agent(fetcher):
+    return fetcher.headers.get("User-Agent") or "*"
+
+
+class RobotsCache:
+    """
+    robots.txt por host (esquema + host) con TTL; se puede compartir entre rastreos.
+    Las reglas se evalúan con el User-Agent del fetcher que pregunta.
+    """
+
+    def __init__(self, ttl_seconds=24 * 3600):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {} # origen -> (expira, RobotFileParser o None = todo permitido)
+        self._pending = {} # origen -> Future de la descarga en curso
+
+    @staticmethod
+    def _origin(url):
+        parts = urlsplit(url)
+        return f"{parts.scheme or 'http'}://{parts.netloc}"
+
+    async def _fetch(self, fetcher, origin):
+        parser = None
+        try:
+            status, text = (await fetcher.get(origin + "/robots.txt", timeout=ROBOTS_TIMEOUT))[:2]
+            if status == 200:
+                parser = robotparser.RobotFileParser()
+                parser.parse(text.splitlines())
+            # 4xx: no hay reglas; 5xx/errores: se permite (solo se cachea un rato)
+        except Exception:
+            return time.time() + min(self.ttl_seconds, 3600), None
+        return time.time() + self.ttl_seconds, parser
+
+    async def rules(self, fetcher, url):
+        origin = self._origin(url)
+        entry = self._entries.get(origin)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        if origin not in self._pending:
+            # Una sola descarga por origen aunque lleguen varias URLs a la vez
+            self._pending[origin] = asyncio.ensure_future(self._fetch(fetcher, origin))
+        try:
+            entry = await asyncio.shield(self._pending[origin])
+        finally:
+            if self._pending.get(origin) is not None and self._pending[origin].done():
+                self._pending.pop(origin, None)
+        self._entries[origin] = entry
+        return entry[1]
+
+    async def allowed(self, fetcher, url) -> bool:
+        parser = await self.rules(fetcher, url)
+        return parser is None or parser.can_fetch(_user_agent(fetcher), url)
+
+    async def crawl_delay(self, fetcher, url) -> float:
+        parser = await self.rules(fetcher, url)
+        if parser is None:
+            return 0.0
+        delay = parser.crawl_delay(_user_agent(fetcher))
+        return min(float(delay or 0), MAX_CRAWL_DELAY)
+
+
+class _HostState:
+    __slots__ = ("pending", "loops", "next_start", "delay")
+
+    def __init__(self, delay):
+        self.pending = deque()
+        self.loops = 0
+        self.next_start = 0.0
+        self.delay = delay
+
+
+class HostFrontier:
+    """Planificador de peticiones por host para un rastreo."""
+
+    def __init__(self, global_limit=20, per_host=2, per_host_delay=1.0, robots=None):
+        self.per_host = max(1, int(per_host))
+        self.per_host_delay = max(0.0, float(per_host_delay))
+        self.robots = robots
+        self._slots = asyncio.Semaphore(max(1, int(global_limit)))
+        self._hosts = {}
+
+    async def fetch(self, fetcher, url, handler=None):
+        """
+        Encola `url` en su host y, cuando le toca, devuelve `await fetcher.get(url)` (o
+        `await handler(fetcher, url)`). Lanza RobotsDisallowed si robots.txt no la permite.
+        """
+        host = host_of(url) or url
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self.per_host_delay)
+        future = asyncio.get_running_loop().create_future()
+        state.pending.append((fetcher, url, handler, future))
+        if state.loops < self.per_host:
+            state.loops += 1
+            asyncio.ensure_future(self._host_loop(host, state))
+        return await future
+
+    async def _host_loop(self, host, state):
+        loop = asyncio.get_running_loop()
+        try:
+            while state.pending:
+                fetcher, url, handler, future = state.pending.popleft()
+                if future.cancelled():
+                    continue
+                try:
+                    if self.robots is not None:
+                        if not await self.robots.allowed(fetcher, url):
+                            raise RobotsDisallowed(url)
+                        state.delay = max(self.per_host_delay, await self.robots.crawl_delay(fetcher, url))
+                    # Reserva el siguiente hueco del host antes de esperar, así los bucles
+                    # concurrentes del mismo host quedan espaciados `delay` entre sí
+                    start_at = max(loop.time(), state.next_start)
+                    state.next_start = start_at + state.delay
+                    if start_at > loop.time():
+                        await asyncio.sleep(start_at - loop.time())
+                    async with self._slots:
+                        result = await (handler(fetcher, url) if handler else fetcher.get(url))
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            state.loops -= 1
+            if state.loops == 0 and not state.pending:
+                self._hosts.pop(host, None)
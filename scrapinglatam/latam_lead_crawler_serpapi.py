@@ -3,11 +3,10 @@ import sys
 import json
 import time
 import asyncio
-import aiohttp
-import tldextract
-from serpapi import GoogleSearch
 import csv
 import re
+from collections import Counter
+from dataclasses import dataclass, field
 from datetime import datetime
 
 # --- Directorio base del proyecto ---
@@ -19,10 +18,23 @@ CONFIG_PATH = os.path.join(BASE_DIR, "scrapinglatam", "crawler_config.json")
 DEFAULT_CATEGORIES_PATH = os.path.join(BASE_DIR, "scrapinglatam", "default_categories.json")
 OUTPUT_CSV = os.path.join(BASE_DIR, "scrapinglatam", "latam_leads.csv")
 AUDIT_PATH = os.path.join(BASE_DIR, "scrapinglatam", "audits", "latam_audit.ndjson")
+SERP_DONE_PATH = os.path.join(BASE_DIR, "scrapinglatam", "serpapi_done.json")
+LEDGER_PATH = os.path.join(BASE_DIR, "scrapinglatam", "audits", "serpapi_ledger.ndjson")
 
-# --- Constantes por defecto del crawler ---
-SERPAPI_KEY = os.environ.get("SERPAPI_KEY")
+from scrapinglatam.query_planner import query_permutations, load_history, plan_queries
+from scrapinglatam.domains import normalize_domain
+from scrapinglatam.seen_index import SeenDomainIndex
+from scrapinglatam.domain_aliases import DomainAliases
+from scrapinglatam.credit_ledger import record_search
+from scrapinglatam.frontier import HostFrontier, RobotsCache, RobotsDisallowed
+from scrapinglatam.fetchers import FetchError, make_fetcher, header_profile
+from scrapinglatam.proxy_pool import ProxyPool, ProxiedFetcher, parse_proxies, PROXY_CONCURRENCY, MAX_FAILURES
+from scrapinglatam.contact_extract import EMAIL_RE, extract_contacts
+from scrapinglatam.near_dup import NearDupIndex, fingerprint
+from scrapinglatam.serpapi_keys import SerpKeyPool, KeysExhausted, serpapi_search, backoff_seconds, is_cached
+from scrapinglatam.lead_sink import LeadSink, DEFAULT_FSYNC
 
+# --- Constantes por defecto del crawler ---
 COUNTRIES_QUERY = [
     'site:.ar', 'site:.cl', 'site:.co', 'site:.pe', 'site:.uy',
     'site:.bo', 'site:.py', 'site:.ve', 'site:.ec'
@@ -57,33 +69,193 @@ CATEGORIES = load_defaults(DEFAULT_CATEGORIES_PATH, [
 MAX_QUERIES = 36
 RESULTS_PER_QUERY = 20
 REQUERY_TTL_DAYS = 0 # si >0, reconsulta dominios tras X días
+CREDIT_BUDGET = 0 # si >0, tope de créditos SerpAPI del plan (además de MAX_QUERIES)
+SERP_PAGE_SIZE = 10 # Google devuelve ~10 orgánicos por página aunque se pida más
+MAX_PAGES_PER_QUERY = 5 # páginas máximas por query (cada página es un crédito)
+PAGE_SATURATION = 0.7 # corta la paginación si esta fracción de la página ya es conocida
+NEGATIVE_TTL_DAYS = 30 # dominios sin emails en la auditoría cuentan como conocidos X días
+ALIAS_TTL_DAYS = 90 # días que vale una redirección aprendida a otro dominio (ver domain_aliases.py)
+FILTER_OFF_COUNTRY = True # descarta resultados fuera del ccTLD del query (site:.xx)
+PER_HOST_CONCURRENCY = 2 # peticiones simultáneas como máximo a un mismo host
+PER_HOST_DELAY = 1.0 # segundos mínimos entre peticiones al mismo host (o su Crawl-delay)
+RESPECT_ROBOTS = True # no visitar URLs que robots.txt prohíbe
+ROBOTS_TTL_HOURS = 24 # horas que se reutiliza un robots.txt descargado
+FETCHER_BACKEND = "aiohttp" # cliente HTTP para las webs: aiohttp | httpx | urllib (ver fetchers.py)
+VERIFY_TLS = False # muchos sitios pequeños tienen certificados caducados o incompletos
+HEADER_PROFILE = "chrome" # cabeceras de un navegador común para evitar bloqueos (chrome | firefox | bot | ...)
+HEADER_PROFILE_POOL = [] # si hay varios, se reparten entre las salidas del pool (ver proxy_pool.py)
+PROXY_CONCURRENCY_PER_PROXY = PROXY_CONCURRENCY # peticiones simultáneas por proxy
+PROXY_MAX_FAILURES = MAX_FAILURES # fallos seguidos que retiran un proxy del pool
+PROXY_HEALTH_URL = "" # URL para comprobar un proxy retirado antes de devolverlo al pool
+FETCH_TIMEOUT = 15 # segundos por página
+SERPAPI_RATE_PER_MINUTE = 0 # búsquedas/min por key; 0 = el límite por hora de la cuenta
+SERPAPI_KEY_STRATEGY = "least_used" # reparto entre keys: least_used | round_robin
+SERPAPI_MAX_RETRIES = 4 # reintentos por página ante 429/5xx/errores de red
+CSV_FSYNC = DEFAULT_FSYNC # fsync del CSV de leads: batch | interval | never (ver lead_sink.py)
+FETCH_WORKERS = 0 # tareas de descarga del pipeline; 0 = 2 x CONNECTION_LIMIT
+EXTRACT_WORKERS = 4 # extracciones de contactos simultáneas (en hilos)
+PIPELINE_QUEUE_SIZE = 200 # capacidad de las colas de URLs y de resultados
+PAGE_QUEUE_SIZE = 16 # páginas descargadas esperando extracción (acota la memoria)
+QUEUE_SAMPLE_SECONDS = 1.0 # muestreo de la profundidad de las colas
+QUEUE_REPORT_SECONDS = 15.0 # cada cuánto se informa de las colas (evento "queues")
+NEAR_DUP_DISTANCE = 3 # bits de SimHash distintos para tratar dos páginas como casi iguales
+NEAR_DUP_INDEX_SIZE = 5000 # huellas recientes recordadas; 0 desactiva la detección (ver near_dup.py)
+
+# Directorios, redes sociales y agregadores que nunca son el sitio del lead.
+# Con punto: dominio registrado o sufijo de host; sin punto: nombre en cualquier TLD.
+DENYLIST_HOSTS = [
+    "facebook", "instagram", "linkedin", "twitter.com", "x.com", "youtube", "tiktok",
+    "pinterest", "wikipedia", "wikimedia", "google", "mercadolibre", "linguee",
+    "transfermarkt", "espn", "forbes", "paginasamarillas", "amarillas", "freelancer",
+    "computrabajo", "indeed", "glassdoor", "tripadvisor", "booking", "waze", "yelp",
+]
+
+# --- Configuración tipada de una ejecución ---
+@dataclass
+class CrawlerConfig:
+    """Parámetros de un rastreo. Cada LeadCrawler tiene la suya (sin globals)."""
+    countries: list = field(default_factory=lambda: list(COUNTRIES_QUERY))
+    categories: list = field(default_factory=lambda: list(CATEGORIES))
+    max_queries: int = MAX_QUERIES
+    results_per_query: int = RESULTS_PER_QUERY
+    requery_ttl_days: float = REQUERY_TTL_DAYS
+    credit_budget: int = CREDIT_BUDGET
+    serp_page_size: int = SERP_PAGE_SIZE
+    max_pages_per_query: int = MAX_PAGES_PER_QUERY
+    page_saturation: float = PAGE_SATURATION
+    negative_ttl_days: float = NEGATIVE_TTL_DAYS
+    alias_ttl_days: float = ALIAS_TTL_DAYS
+    filter_off_country: bool = FILTER_OFF_COUNTRY
+    denylist_hosts: list = field(default_factory=lambda: list(DENYLIST_HOSTS))
+    serpapi_key: str = field(default_factory=lambda: os.environ.get("SERPAPI_KEY") or "")
+    # Keys adicionales del pool (además de serpapi_key); SERPAPI_KEYS=k1,k2 en el entorno
+    serpapi_keys: list = field(default_factory=lambda: [k.strip() for k in os.environ.get("SERPAPI_KEYS", "").split(",") if k.strip()])
+    serpapi_rate_per_minute: float = SERPAPI_RATE_PER_MINUTE
+    serpapi_key_strategy: str = SERPAPI_KEY_STRATEGY
+    serpapi_max_retries: int = SERPAPI_MAX_RETRIES
+    output_csv: str = OUTPUT_CSV
+    csv_fsync: str = CSV_FSYNC
+    audit_path: str = AUDIT_PATH
+    serp_done_path: str = SERP_DONE_PATH
+    ledger_path: str = LEDGER_PATH
+    connection_limit: int = 20
+    per_host_concurrency: int = PER_HOST_CONCURRENCY
+    per_host_delay: float = PER_HOST_DELAY
+    respect_robots: bool = RESPECT_ROBOTS
+    robots_ttl_hours: float = ROBOTS_TTL_HOURS
+    fetcher_backend: str = FETCHER_BACKEND
+    verify_tls: bool = VERIFY_TLS
+    header_profile: str = HEADER_PROFILE
+    header_profile_pool: list = field(default_factory=lambda: list(HEADER_PROFILE_POOL))
+    # Proxies HTTP de salida ("direct" = IP propia); CRAWLER_PROXIES=p1,p2 en el entorno
+    proxies: list = field(default_factory=lambda: parse_proxies(os.environ.get("CRAWLER_PROXIES", "")))
+    proxy_concurrency: int = PROXY_CONCURRENCY_PER_PROXY
+    proxy_max_failures: int = PROXY_MAX_FAILURES
+    proxy_health_url: str = PROXY_HEALTH_URL
+    fetch_timeout: float = FETCH_TIMEOUT
+    fetch_workers: int = FETCH_WORKERS
+    extract_workers: int = EXTRACT_WORKERS
+    pipeline_queue_size: int = PIPELINE_QUEUE_SIZE
+    page_queue_size: int = PAGE_QUEUE_SIZE
+    near_dup_distance: int = NEAR_DUP_DISTANCE
+    near_dup_index_size: int = NEAR_DUP_INDEX_SIZE
+    query_pause: float = 1.0 # segundos entre consultas a SerpAPI
+
+    # Claves de crawler_config.json -> atributo
+    JSON_KEYS = {
+        "COUNTRIES_QUERY": "countries",
+        "CATEGORIES": "categories",
+        "MAX_QUERIES": "max_queries",
+        "RESULTS_PER_QUERY": "results_per_query",
+        "REQUERY_TTL_DAYS": "requery_ttl_days",
+        "CREDIT_BUDGET": "credit_budget",
+        "SERP_PAGE_SIZE": "serp_page_size",
+        "MAX_PAGES_PER_QUERY": "max_pages_per_query",
+        "PAGE_SATURATION": "page_saturation",
+        "NEGATIVE_TTL_DAYS": "negative_ttl_days",
+        "ALIAS_TTL_DAYS": "alias_ttl_days",
+        "FILTER_OFF_COUNTRY": "filter_off_country",
+        "DENYLIST_HOSTS": "denylist_hosts",
+        "OUTPUT_CSV": "output_csv",
+        "CONNECTION_LIMIT": "connection_limit",
+        "PER_HOST_CONCURRENCY": "per_host_concurrency",
+        "PER_HOST_DELAY": "per_host_delay",
+        "RESPECT_ROBOTS": "respect_robots",
+        "ROBOTS_TTL_HOURS": "robots_ttl_hours",
+        "FETCHER_BACKEND": "fetcher_backend",
+        "VERIFY_TLS": "verify_tls",
+        "HEADER_PROFILE": "header_profile",
+        "HEADER_PROFILE_POOL": "header_profile_pool",
+        "PROXIES": "proxies",
+        "PROXY_CONCURRENCY": "proxy_concurrency",
+        "PROXY_MAX_FAILURES": "proxy_max_failures",
+        "PROXY_HEALTH_URL": "proxy_health_url",
+        "FETCH_TIMEOUT": "fetch_timeout",
+        "FETCH_WORKERS": "fetch_workers",
+        "EXTRACT_WORKERS": "extract_workers",
+        "PIPELINE_QUEUE_SIZE": "pipeline_queue_size",
+        "PAGE_QUEUE_SIZE": "page_queue_size",
+        "NEAR_DUP_DISTANCE": "near_dup_distance",
+        "NEAR_DUP_INDEX_SIZE": "near_dup_index_size",
+        "SERPAPI_KEYS": "serpapi_keys",
+        "SERPAPI_RATE_PER_MINUTE": "serpapi_rate_per_minute",
+        "SERPAPI_KEY_STRATEGY": "serpapi_key_strategy",
+        "SERPAPI_MAX_RETRIES": "serpapi_max_retries",
+        "CSV_FSYNC": "csv_fsync",
+    }
 
-# --- Overrides opcionales desde JSON ---
-def _override_globals(d):
-    g = globals()
-    if "COUNTRIES_QUERY" in d and isinstance(d["COUNTRIES_QUERY"], list):
-        g["COUNTRIES_QUERY"] = d["COUNTRIES_QUERY"]
-    if "CATEGORIES" in d and isinstance(d["CATEGORIES"], list):
-        g["CATEGORIES"] = d["CATEGORIES"]
-    for k in ["MAX_QUERIES", "RESULTS_PER_QUERY", "REQUERY_TTL_DAYS"]:
-        if k in d and d[k] is not None:
-            g[k] = d[k]
-    if "OUTPUT_CSV" in d and isinstance(d["OUTPUT_CSV"], str) and d["OUTPUT_CSV"].strip():
-        g["OUTPUT_CSV"] = os.path.join(BASE_DIR, "scrapinglatam", d["OUTPUT_CSV"].strip())
-
-def load_config_overrides():
-    if os.path.exists(CONFIG_PATH):
+    def pages_per_query(self):
+        """Páginas SERP (créditos) por query: las que cubren results_per_query, con tope max_pages_per_query."""
+        page_size = max(1, int(self.serp_page_size))
+        pages = -(-int(self.results_per_query) // page_size)
+        return max(1, min(int(self.max_pages_per_query), pages))
+
+    def api_keys(self):
+        """serpapi_key seguida de las keys adicionales del pool, sin repetir."""
+        return list(dict.fromkeys(k for k in [self.serpapi_key, *self.serpapi_keys] if k))
+
+    @classmethod
+    def from_dict(cls, d, **overrides):
+        """Construye la config desde el formato de crawler_config.json."""
+        cfg = cls(**overrides)
+        for key, attr in cls.JSON_KEYS.items():
+            if key not in d or d[key] is None or attr in overrides:
+                continue
+            value = d[key]
+            if attr in ("countries", "categories"):
+                if isinstance(value, list):
+                    setattr(cfg, attr, value)
+            elif attr == "denylist_hosts":
+                if isinstance(value, list):
+                    cfg.denylist_hosts = [str(h).strip().lower() for h in value if str(h).strip()]
+            elif attr in ("serpapi_keys", "proxies", "header_profile_pool"):
+                if isinstance(value, str):
+                    value = value.split(",")
+                if isinstance(value, list):
+                    setattr(cfg, attr, [str(k).strip() for k in value if str(k).strip()])
+            elif attr == "output_csv":
+                if isinstance(value, str) and value.strip():
+                    cfg.output_csv = os.path.join(BASE_DIR, "scrapinglatam", value.strip())
+            else:
+                setattr(cfg, attr, value)
+        return cfg
+
+def load_crawler_config(path=CONFIG_PATH, **overrides):
+    """Lee crawler_config.json (si existe) y devuelve una CrawlerConfig."""
+    if os.path.exists(path):
         try:
-            with open(CONFIG_PATH, "r", encoding="utf-8") as fh:
+            with open(path, "r", encoding="utf-8") as fh:
                 data = json.load(fh)
-            _override_globals(data or {})
-            print(f"[CFG] Overrides aplicados desde {CONFIG_PATH}")
-            print(f"[CFG] COUNTRIES_QUERY = {globals().get('COUNTRIES_QUERY')}")
-            print(f"[CFG] CATEGORIES = {globals().get('CATEGORIES')}")
+            cfg = CrawlerConfig.from_dict(data or {}, **overrides)
+            print(f"[CFG] Overrides aplicados desde {path}")
+            print(f"[CFG] COUNTRIES_QUERY = {cfg.countries}")
+            print(f"[CFG] CATEGORIES = {cfg.categories}")
+            return cfg
         except Exception as e:
-            print(f"[CFG] No se pudo leer {CONFIG_PATH}: {e}")
+            print(f"[CFG] No se pudo leer {path}: {e}")
     else:
         print("[CFG] Sin overrides; usando constantes por defecto.")
+    return CrawlerConfig(**overrides)
 
 # ---- Esquema CSV consistente ----
 FIELDNAMES = [
@@ -99,7 +271,8 @@ FIELDNAMES = [
     "phones",
     "priority",
     "last_seen",
-    "email_sent"
+    "email_sent",
+    "near_dup_of" # dominio del lead casi idéntico del que se reutilizaron los contactos
 ]
 
 def ensure_dir_for(path: str):
@@ -107,85 +280,34 @@ def ensure_dir_for(path: str):
     if d:
         os.makedirs(d, exist_ok=True)
 
-def read_existing_header(path):
-    if not os.path.exists(path) or os.path.getsize(path) == 0:
-        return None
-    try:
-        with open(path, "r", encoding="utf-8-sig", newline="") as f:
-            reader = csv.reader(f)
-            header = next(reader, None)
-            return header
-    except Exception:
-        return None
+def iter_csv_domains(path):
+    """Pares (dominio, timestamp) del CSV de leads."""
+    with open(path, newline="", encoding="utf-8-sig") as fh:
+        reader = csv.DictReader(fh)
+        for row in reader:
+            if "domain" in row and row["domain"]:
+                ts = None
+                if "last_seen" in row and row["last_seen"]:
+                    try:
+                        ts = datetime.fromisoformat(row["last_seen"]).timestamp()
+                    except Exception:
+                        ts = time.time()
+                else:
+                    ts = time.time()
+                yield row["domain"].lower(), ts
 
-def open_csv_with_schema(path, fieldnames):
-    ensure_dir_for(path)
-    existing = read_existing_header(path)
-    if existing is None:
-        f = open(path, "w", encoding="utf-8-sig", newline="")
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        f.flush()
-        return f, writer
-    if list(existing) != list(fieldnames):
-        base, ext = os.path.splitext(path)
-        rotated = f"{base}_OLD_{datetime.now().strftime('%Y%m%d_%H%M%S')}{ext}"
-        os.rename(path, rotated)
-        print(f"[CSV] Encabezado distinto. Archivo antiguo rotado a: {rotated}")
-        f = open(path, "w", encoding="utf-8-sig", newline="")
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        f.flush()
-        return f, writer
-    f = open(path, "a", encoding="utf-8-sig", newline="")
-    writer = csv.DictWriter(f, fieldnames=fieldnames)
-    return f, writer
-
-# --- Control de dominios procesados ---
-seen_domains = {} # dominio: timestamp última consulta
-
-def load_seen_domains():
-    """Carga dominios ya procesados desde el CSV existente."""
-    if os.path.exists(OUTPUT_CSV):
-        try:
-            with open(OUTPUT_CSV, newline="", encoding="utf-8-sig") as fh:
-                reader = csv.DictReader(fh)
-                for row in reader:
-                    if "domain" in row and row["domain"]:
-                        ts = None
-                        if "last_seen" in row and row["last_seen"]:
-                            try:
-                                ts = datetime.fromisoformat(row["last_seen"]).timestamp()
-                            except Exception:
-                                ts = time.time()
-                        else:
-                            ts = time.time()
-                        seen_domains[row["domain"].lower()] = ts
-            print(f"[DOMAINS] Precargados {len(seen_domains)} dominios desde {OUTPUT_CSV}")
-        except Exception as e:
-            print(f"[DOMAINS] Error al precargar dominios: {e}")
-
-def should_process(domain: str) -> bool:
-    """Decide si un dominio debe procesarse según TTL."""
-    now = time.time()
-    if domain not in seen_domains:
-        return True
-    if REQUERY_TTL_DAYS <= 0:
-        return False
-    last_ts = seen_domains[domain]
-    days = (now - last_ts) / (60*60*24)
-    return days >= REQUERY_TTL_DAYS
-
-def mark_processed(domain: str):
-    seen_domains[domain] = time.time()
-
-# --- Generación de queries ---
-def get_query_permutations():
-    queries = []
-    for country in COUNTRIES_QUERY:
-        for category in CATEGORIES:
-            queries.append(f"{category} {country}")
-    return queries
+def domain_of(url: str) -> str:
+    return normalize_domain(url)
+
+def is_denylisted(domain: str, denylist=DENYLIST_HOSTS) -> bool:
+    label = domain.split(".", 1)[0]
+    for entry in denylist:
+        if "." in entry:
+            if domain == entry or domain.endswith("." + entry):
+                return True
+        elif label == entry:
+            return True
+    return False
 
 # --- Separar categoría y país de un query ---
 def split_query(query: str):
@@ -220,10 +342,7 @@ def split_query(query: str):
         
     return category, country_code
 
-# Regex
-EMAIL_RE = re.compile(r"[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}")
-PHONE_RE = re.compile(r"(?:\+?\d{1,3}[\s\-\.]?)?(?:\(?\d{2,4}\)?[\s\-\.]?)\d{3,4}[\s\-\.]?\d{3,4}")
-
+# Regla de email_best (email_rescore.py la aplica vectorizada a todo el CSV)
 EMAIL_AVOID = ("noreply", "no-reply", "donotreply", "do-not-reply", "webmaster", "postmaster", "abuse")
 EMAIL_PREFER = ("contacto", "contact", "info", "comercial", "ventas", "sales", "admisiones", "secretaria", "general", "prensa", "comunicacion", "informes")
 
@@ -265,159 +384,799 @@ def pick_best_email(emails, domain):
     scored.sort(key=lambda t: (t[0] if t[0] >= 0 else 999, t[1], t[2]))
     return scored[0][3]
 
-async def fetch_serpapi(query, params):
-    try:
-        search = GoogleSearch(params)
-        results = search.get_dict()
-        return results.get("organic_results", [])
-    except Exception as e:
-        print(f"[ERROR] SerpAPI para '{query}': {e}")
-        return []
-
-async def fetch_website_emails(session, url, priority):
-    domain_info = tldextract.extract(url)
-    domain = (domain_info.domain + "." + domain_info.suffix).lower()
-
-    if not should_process(domain):
-        print(f"[SKIP] Dominio ya procesado recientemente: {domain}")
-        return None
+# --- Créditos compartidos entre rastreos ---
+class CreditPool:
+    """Tope de créditos común a varios LeadCrawler del mismo proceso (limit <= 0: sin tope)."""
 
-    start_time = time.time()
-    http_status = None
-    exclusion_flag = 'N'
-    emails_found = []
-    phones_found = []
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.spent = 0
 
-    try:
-        # Usar un user-agent común para evitar bloqueos
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        async with session.get(url, ssl=False, timeout=15, headers=headers) as response:
-            http_status = response.status
-            content = await response.text(errors="ignore")
-            emails_found = clean_emails(EMAIL_RE.findall(content))
-            phones_found = list(dict.fromkeys(m.strip() for m in PHONE_RE.findall(content)))
-    except asyncio.TimeoutError:
-        http_status = "Timeout"
-        exclusion_flag = 'Y'
-        print(f"[WEB] Timeout al acceder a {url}")
-    except aiohttp.ClientError as e:
-        http_status = "Error"
-        exclusion_flag = 'Y'
-        print(f"[WEB] Error al acceder a {url}: {e}")
-    except Exception as e:
-        http_status = "Error"
-        exclusion_flag = 'Y'
-        print(f"[WEB] Error genérico en {url}: {e}")
-
-    duration_ms = int((time.time() - start_time) * 1000)
-    email_best = pick_best_email(emails_found, domain) if emails_found else ""
-
-    ensure_dir_for(AUDIT_PATH)
-    audit_event = {
-        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
-        "domain": domain,
-        "url": url,
-        "http_status": http_status,
-        "duration_ms": duration_ms,
-        "emails_found": emails_found,
-        "email_best": email_best,
-        "phones_found": phones_found,
-        "priority": priority,
-        "exclusion_flag": exclusion_flag,
-        "last_seen": datetime.now().isoformat(),
-    }
-    with open(AUDIT_PATH, 'a', encoding='utf-8') as f:
-        f.write(json.dumps(audit_event, ensure_ascii=False) + '\n')
+    def exhausted(self) -> bool:
+        return self.limit > 0 and self.spent >= self.limit
+
+    def spend(self, n=1):
+        self.spent += n
+
+# --- Crawler embebible ---
+class LeadCrawler:
+    """
+    Un rastreo con su propia config y estado (índice de dominios, caché negativa,
+    métricas, créditos). run() es un iterador asíncrono de eventos:
+      {"type": "log", "message"}          líneas de log (las mismas que imprime el script)
+      {"type": "plan", "plan"}            plan de consultas calculado
+      {"type": "query", "query", "index", "total"}
+      {"type": "page", "query", "page", "results", "saturation"}
+      {"type": "lead", "row"}             fila lista para el CSV (FIELDNAMES)
+      {"type": "query_done", "query"}   paginación terminada y todas sus visitas procesadas
+      {"type": "queues", "depths", "in_flight"}  profundidad de las colas del pipeline (periódico)
+      {"type": "done", "metrics", "credits_spent"}
+    Varias instancias pueden correr a la vez en el mismo proceso. Para cortar antes
+    de "done", consumir con contextlib.aclosing(crawler.run()) para liberar recursos.
+
+    Por dentro es un pipeline de colas acotadas: las páginas SERP alimentan la cola de
+    descargas, fetch_workers tareas la vacían hacia la de extracción (cuerpos HTML, la
+    que acota la memoria), extract_workers sacan contactos hacia la del sink, que escribe
+    la auditoría y emite los leads. Cada cola llena frena a la etapa anterior, hasta la
+    paginación de SerpAPI; las visitas de una query se solapan con la siguiente.
+    """
+
+    def __init__(self, config: CrawlerConfig, seen_index=None, credit_pool=None, robots_cache=None, key_pool=None,
+                 near_dup_index=None, proxy_pool=None, aliases=None):
+        self.config = config
+        # SeenDomainIndex: dominio -> timestamp última consulta (mmap en disco).
+        # Si se inyecta uno (p.ej. compartido por el worker) no se abre ni se cierra aquí.
+        self.seen_index = seen_index
+        self._owns_seen_index = seen_index is None
+        # DomainAliases: alias -> dominio canónico aprendido de las redirecciones (ídem)
+        self.aliases = aliases
+        self._owns_aliases = aliases is None
+        # Dominio canónico -> URL que lo visita en este rastreo. Se reserva al encolar el
+        # resultado, no al terminar: con queries solapadas en el pipeline, el mismo sitio
+        # puede llegar por otra query antes de que la primera visita acabe
+        self._claimed = {}
+        self.credit_pool = credit_pool
+        # SerpKeyPool: keys de SerpAPI con ritmo, saldo y failover (el worker lo comparte)
+        self.key_pool = key_pool
+        # robots.txt por host; el worker comparte uno entre trabajos
+        self.robots_cache = robots_cache
+        # NearDupIndex: huellas SimHash de páginas con emails (el worker comparte una)
+        self.near_dup_index = near_dup_index
+        # ProxyPool: salidas (proxies y perfiles de cabeceras) con su salud; el worker lo comparte
+        self.proxy_pool = proxy_pool
+        self.frontier = None
+        self.negative_domains = {} # dominio: timestamp del último intento fallido
+        self.metrics = Counter() # resultados SERP, descartes, fetches
+        self.credits_spent = 0
+        self.serp_done = None
+        self.queries = None
+        self._events = asyncio.Queue()
+        self._events_drained = asyncio.Event()
+        self._queues = {}
+        self._in_flight = Counter() # query -> resultados aún dentro del pipeline
+        self._searched = set() # queries con la paginación terminada
+        self._audit_fh = None
+
+    # --- Eventos ---
+    def _emit(self, event):
+        self._events.put_nowait(event)
+
+    def log(self, message):
+        self._emit({"type": "log", "message": message})
+
+    # --- Control de dominios procesados ---
+    def seen_index_path(self):
+        return os.path.splitext(self.config.output_csv)[0] + "_seen.idx"
+
+    def load_seen_domains(self):
+        """Abre el índice de dominios procesados; solo se construye desde el CSV si no existe."""
+        if self.seen_index is not None:
+            return
+        path = self.seen_index_path()
+        output_csv = self.config.output_csv
+        try:
+            # Sin CSV el índice no tiene sentido (se borraron los leads): se reinicia
+            if os.path.exists(path) and os.path.exists(output_csv):
+                self.seen_index = SeenDomainIndex(path)
+                self.log(f"[DOMAINS] Índice de dominios abierto: {len(self.seen_index)} entradas ({path})")
+                return
+            items = iter_csv_domains(output_csv) if os.path.exists(output_csv) else []
+            self.seen_index = SeenDomainIndex.build(path, items)
+            self.log(f"[DOMAINS] Índice construido con {len(self.seen_index)} dominios desde {output_csv}")
+        except Exception as e:
+            self.log(f"[DOMAINS] Error al precargar dominios: {e}")
+
+    def aliases_path(self):
+        return os.path.splitext(self.config.output_csv)[0] + "_aliases.ndjson"
+
+    def load_aliases(self):
+        """Abre el mapa de alias -> dominio canónico (no se usa con alias_ttl_days <= 0)."""
+        if self.aliases is not None or self.config.alias_ttl_days <= 0:
+            return
+        try:
+            self.aliases = DomainAliases(self.aliases_path(), ttl_days=float(self.config.alias_ttl_days))
+            if len(self.aliases):
+                self.log(f"[DOMAINS] {len(self.aliases)} alias de dominio conocidos")
+        except Exception as e:
+            self.log(f"[DOMAINS] Error al cargar los alias de dominio: {e}")
+
+    def canonical_domain(self, domain: str) -> str:
+        return self.aliases.resolve(domain) if self.aliases is not None and domain else domain
+
+    def close(self):
+        if self.seen_index is not None and self._owns_seen_index:
+            self.seen_index.close()
+            self.seen_index = None
+        if self.aliases is not None and self._owns_aliases:
+            self.aliases.close()
+            self.aliases = None
+
+    def claim(self, domain: str, url: str) -> bool:
+        """Reserva `domain` para la visita de `url`; False si otra URL ya lo tiene reservado."""
+        return self._claimed.setdefault(domain, url) == url
+
+    def should_process(self, domain: str) -> bool:
+        """Decide si un dominio debe procesarse según TTL."""
+        now = time.time()
+        last_ts = self.seen_index.get(domain) if self.seen_index is not None else None
+        if last_ts is None:
+            return True
+        if self.config.requery_ttl_days <= 0:
+            return False
+        days = (now - last_ts) / (60*60*24)
+        return days >= self.config.requery_ttl_days
+
+    def mark_processed(self, domain: str):
+        if self.seen_index is not None:
+            self.seen_index.add(domain, time.time())
+        self.negative_domains.pop(domain, None)
+
+    # --- Caché negativa: dominios visitados sin emails (o con error) ---
+    def load_negative_domains(self):
+        """Carga desde la auditoría los dominios cuyo último evento no tuvo emails."""
+        audit_path = self.config.audit_path
+        if self.config.negative_ttl_days <= 0 or not os.path.exists(audit_path):
+            return
+        try:
+            with open(audit_path, "r", encoding="utf-8") as fh:
+                for ln in fh:
+                    try:
+                        ev = json.loads(ln)
+                    except Exception:
+                        continue
+                    domain = (ev.get("domain") or "").lower()
+                    if not domain:
+                        continue
+                    if ev.get("emails_found"):
+                        self.negative_domains.pop(domain, None)
+                        continue
+                    try:
+                        ts = datetime.fromisoformat(ev.get("last_seen") or "").timestamp()
+                    except Exception:
+                        ts = time.time()
+                    self.negative_domains[domain] = ts
+            self.log(f"[DOMAINS] {len(self.negative_domains)} dominios en caché negativa")
+        except Exception as e:
+            self.log(f"[DOMAINS] Error al cargar la caché negativa: {e}")
+
+    def is_negatively_cached(self, domain: str) -> bool:
+        ttl = self.config.negative_ttl_days
+        if ttl <= 0 or domain not in self.negative_domains:
+            return False
+        days = (time.time() - self.negative_domains[domain]) / (60*60*24)
+        return days < ttl
+
+    def mark_negative(self, domain: str):
+        self.negative_domains[domain] = time.time()
+
+    # --- Presupuesto y filtros ---
+    def credits_exhausted(self) -> bool:
+        if self.credit_pool is not None and self.credit_pool.exhausted():
+            return True
+        if self.key_pool is not None and self.key_pool.exhausted():
+            return True
+        budget = self.config.credit_budget
+        return budget > 0 and self.credits_spent >= budget
+
+    def max_pages_per_query(self):
+        """Páginas necesarias para cubrir results_per_query, con tope max_pages_per_query."""
+        return self.config.pages_per_query()
 
-    if not emails_found:
+    def filter_serp_results(self, query, search_results, query_domains):
+        """
+        Filtra los resultados SERP antes de abrir ninguna conexión.
+        Devuelve (resultados a visitar, Counter de descartes por motivo).
+        """
+        _, country = split_query(query)
+        kept = []
+        dropped = Counter()
+        for result in search_results:
+            url = result.get("link")
+            domain = domain_of(url)
+            # Duplicados, vistos y caché negativa por el dominio canónico (el alias es el mismo sitio)
+            canonical = self.canonical_domain(domain)
+            if not url or not domain:
+                reason = "invalid"
+            elif canonical in query_domains:
+                reason = "duplicate"
+            elif canonical in self._claimed or not self.should_process(canonical):
+                reason = "seen"
+            elif self.is_negatively_cached(canonical):
+                reason = "negative"
+            elif is_denylisted(domain, self.config.denylist_hosts):
+                reason = "denylist"
+            elif self.config.filter_off_country and country and not domain.endswith("." + country):
+                reason = "off_country"
+            else:
+                reason = None
+            if domain:
+                query_domains.add(canonical)
+            if reason:
+                dropped[reason] += 1
+                continue
+            self._claimed[canonical] = url
+            kept.append(result)
+        return kept, dropped
+
+    # --- Plan de consultas ---
+    def build_query_plan(self):
+        """Ordena las queries por rendimiento histórico y las corta al presupuesto."""
+        cfg = self.config
+        history = load_history(cfg.audit_path, cfg.output_csv, cfg.serp_done_path)
+        plan = plan_queries(query_permutations(cfg.countries, cfg.categories), history,
+                            cfg.max_queries, cfg.credit_budget,
+                            pages_per_query=self.max_pages_per_query())
+        self.log(f"[PLAN] {len(plan['queries'])}/{plan['candidates']} queries, "
+                 f"{plan['credits']} créditos, ~{plan['expected_leads']:.1f} leads esperados")
+        for s in plan["queries"]:
+            self.log(f"[PLAN]   {s['query']} -> {s['expected_leads']:.2f} leads esperados "
+                     f"(historial: {s['history_leads']} leads en {s['history_credits']} créditos)")
+        self._emit({"type": "plan", "plan": plan})
+        return [s["query"] for s in plan["queries"]]
+
+    # --- Registro de consultas hechas (serpapi_done.json) ---
+    def load_serp_done(self):
+        path = self.config.serp_done_path
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as fh:
+                    data = json.load(fh)
+                if isinstance(data, dict) and isinstance(data.get("queries"), dict):
+                    return data
+            except Exception as e:
+                self.log(f"[SERP] No se pudo leer {path}: {e}")
+        return {"version": 2, "queries": {}}
+
+    def record_serp_done(self, query, num, results, domains, status, pages=1, filtered=None):
+        path = self.config.serp_done_path
+        self.serp_done["queries"][query] = {
+            "ts": int(time.time()),
+            "num": num,
+            "results": results,
+            "pages": pages,
+            "status": status,
+            "domains": domains,
+        }
+        if filtered:
+            self.serp_done["queries"][query]["filtered"] = filtered
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(self.serp_done, fh, ensure_ascii=False, indent=2)
+            os.replace(tmp, path)
+        except Exception as e:
+            self.log(f"[SERP] No se pudo guardar {path}: {e}")
+
+    # --- Preparación ---
+    def prepare(self):
+        """Carga estado y calcula el plan. run() la llama si no se hizo antes."""
+        if self.queries is not None:
+            return self.queries
+        self.load_seen_domains()
+        self.load_negative_domains()
+        self.load_aliases()
+        self.queries = self.build_query_plan()
+        self.serp_done = self.load_serp_done()
+        ensure_dir_for(self.config.audit_path)
+        return self.queries
+
+    # --- SerpAPI y sitios ---
+    async def fetch_serpapi(self, query, params):
+        """
+        Resultados orgánicos de una página con una key del pool. Reintenta 429/5xx/red con
+        espera exponencial y cambia de key si una se agota. None = SerpAPI no respondió
+        (no es lo mismo que "sin resultados": la consulta no se da por hecha).
+        """
+        retries = max(0, int(self.config.serpapi_max_retries))
+        attempt = 0
+        while attempt <= retries:
+            try:
+                key = await self.key_pool.acquire()
+            except KeysExhausted:
+                self.log("[KEYS] No queda ninguna API key de SerpAPI con búsquedas disponibles")
+                return None
+            try:
+                # El cliente de SerpAPI es síncrono: se ejecuta en un hilo para no bloquear el loop
+                status, results = await asyncio.to_thread(serpapi_search, dict(params, api_key=key.api_key))
+            except Exception as e:
+                status, results = None, {"error": str(e)}
+            cached = is_cached(results)
+            outcome = self.key_pool.report(key, status, results.get("error"), cached=cached)
+            if outcome == "ok":
+                # Las respuestas con error y las servidas desde la caché de SerpAPI no
+                # consumen crédito: ni se anotan en el libro ni cuentan para el presupuesto
+                if cached:
+                    self.metrics["serp_cached"] += 1
+                else:
+                    record_search(self.config.ledger_path, key.api_key, query, params.get("start", 0))
+                    self.credits_spent += 1
+                    if self.credit_pool is not None:
+                        self.credit_pool.spend()
+                return results.get("organic_results", [])
+            if outcome in ("empty", "error"):
+                self.log(f"[ERROR] SerpAPI para '{query}': {results['error']}")
+                return []
+            self.metrics[f"serp_{outcome}"] += 1
+            if outcome in ("exhausted", "invalid"):
+                self.log(f"[KEYS] Key {key.fingerprint} retirada ({outcome}); se sigue con las demás")
+                continue # sin espera ni reintento gastado: otra key
+            attempt += 1
+            if attempt <= retries:
+                # 429: la key queda en enfriamiento y acquire() elige otra si la hay
+                wait = 0 if outcome == "rate_limited" else backoff_seconds(attempt)
+                self.log(f"[RETRY] SerpAPI '{query}' ({status or 'red'}: {results.get('error')}); "
+                         f"reintento {attempt}/{retries}" + (f" en {wait:.1f}s" if wait else ""))
+                await asyncio.sleep(wait)
+        self.log(f"[ERROR] SerpAPI para '{query}': sin respuesta tras {retries + 1} intentos")
         return None
 
-    mark_processed(domain)
-
-    return {
-        "query": "",
-        "country": "",
-        "category": "",
-        "domain": domain,
-        "homepage_url": url,
-        "http_status": http_status,
-        "duration_ms": duration_ms,
-        "emails_all": ", ".join(emails_found),
-        "email_best": email_best,
-        "phones": ", ".join(phones_found),
-        "priority": priority,
-        "last_seen": datetime.now().isoformat(),
-        "email_sent": "No"
-    }
+    async def fetch_page(self, fetcher, item):
+        """Etapa de descarga: la página de un resultado SERP (None si el dominio ya se procesó)."""
+        url, query = item["url"], item["query"]
+        serp_domain = domain_of(url)
+        domain = self.canonical_domain(serp_domain)
+        if not self.claim(domain, item["url"]):
+            self.metrics["claimed_duplicates"] += 1
+            self.log(f"[SKIP] Dominio ya visitado en este rastreo: {domain}")
+            return None
+        if not self.should_process(domain):
+            self.log(f"[SKIP] Dominio ya procesado recientemente: {domain}")
+            return None
+        if domain != serp_domain:
+            # Alias conocido: directo a la URL canónica, sin repetir la redirección
+            url = self.aliases.rewrite(url, serp_domain)
+            self.metrics["alias_rewrites"] += 1
 
-async def process_query(session, query, params, csv_writer):
-    print(f"[QUERY] Buscando para: '{query}'")
-    search_results = await fetch_serpapi(query, params)
-    if not search_results:
-        print(f"[QUERY] Sin resultados para: '{query}'")
-        return
+        page = dict(item, domain=domain, http_status=None, content="", duration_ms=None, timings=None,
+                    exclusion_flag='N', final_url=url, serp_domain=serp_domain)
+        start_time = time.time()
+        try:
+            # La frontera decide cuándo: cortesía por host y tope global de conexiones
+            result = await self.frontier.fetch(fetcher, url)
+            page.update(http_status=result.status, content=result.text, duration_ms=result.elapsed_ms,
+                        timings=result.timings, final_url=result.final_url or url)
+        except RobotsDisallowed:
+            page.update(http_status="Robots", exclusion_flag='Y')
+            self.metrics["robots_disallowed"] += 1
+            self.log(f"[ROBOTS] robots.txt no permite {url}")
+        except asyncio.TimeoutError:
+            page.update(http_status="Timeout", exclusion_flag='Y')
+            self.log(f"[WEB] Timeout al acceder a {url}")
+        except FetchError as e:
+            page.update(http_status="Error", exclusion_flag='Y')
+            self.log(f"[WEB] Error al acceder a {url}: {e}")
+        except Exception as e:
+            page.update(http_status="Error", exclusion_flag='Y')
+            self.log(f"[WEB] Error genérico en {url}: {e}")
 
-    tasks = []
-    for result in search_results:
-        url = result.get("link")
-        if url:
-            tasks.append(fetch_website_emails(session, url, priority=result.get("position")))
+        if page["duration_ms"] is None: # fallo: tiempo total, incluida la espera en la frontera
+            page["duration_ms"] = int((time.time() - start_time) * 1000)
 
-    results = await asyncio.gather(*tasks)
+        final_domain = domain_of(page["final_url"])
+        if final_domain and final_domain != domain:
+            # Las redirecciones acabaron en otro dominio: ese es el canónico
+            if self.aliases is not None:
+                self.aliases.add(domain, final_domain, url, page["final_url"])
+            self.metrics["redirect_aliases"] += 1
+            if not self.claim(final_domain, item["url"]) or not self.should_process(final_domain):
+                self.metrics["alias_duplicates"] += 1
+                self.log(f"[SKIP] {domain} redirige a {final_domain}, ya procesado")
+                return None
+            page["domain"] = final_domain
+        return page
 
-    for row in results:
-        if not row:
-            continue
+    def build_near_dup_index(self):
+        """Índice de páginas casi idénticas de la config (None si está desactivado)."""
+        cfg = self.config
+        if int(cfg.near_dup_index_size) <= 0:
+            return None
+        if self.near_dup_index is None:
+            self.near_dup_index = NearDupIndex(int(cfg.near_dup_index_size), int(cfg.near_dup_distance))
+        return self.near_dup_index
 
-        # Añadir datos de query
-        row["query"] = query
-        category, country = split_query(query)
-        # ESTA LÍNEA AHORA GUARDA LA CATEGORÍA COMPLETA (Ej: "futbol americano")
-        row["category"] = category 
-        row["country"] = country
-        row["email_sent"] = "No"
+    @staticmethod
+    def _extract_or_reuse(content, index, domain):
+        """
+        (contactos, huella, emails en crudo, original) de una página. Si es casi idéntica
+        a otra ya extraída y tiene exactamente los mismos emails (una pasada de EMAIL_RE
+        sobre el HTML, mucho más barata que la extracción), se reutiliza la extracción de
+        aquella (original = dato del índice); si no, se extrae.
+        """
+        fp = fingerprint(content) if index is not None else None
+        if fp is None:
+            return extract_contacts(content), None, None, None
+        raw_emails = frozenset(e.lower() for e in EMAIL_RE.findall(content))
+        hit = index.find(fp)
+        if hit is not None and hit[0]["domain"] != domain and hit[0]["raw_emails"] == raw_emails:
+            original, dist = hit
+            return original["contacts"], fp, raw_emails, dict(original, distance=dist)
+        return extract_contacts(content), fp, raw_emails, None
 
+    async def extract_page(self, page):
+        """Etapa de extracción: contactos de la página, evento de auditoría y fila del lead."""
+        query, domain, url = page["query"], page["domain"], page["final_url"]
+        category, country = split_query(query) if query else ("", "")
+        emails_found = []
+        phones_found = []
+        email_sources = {}
+        near_dup_of = None
+        if page["content"]:
+            # Huella y regex sobre páginas grandes tardan: en un hilo, para que el loop
+            # siga atendiendo descargas mientras tanto
+            index = self.build_near_dup_index()
+            contacts, fp, raw_emails, original = await asyncio.to_thread(
+                self._extract_or_reuse, page.pop("content"), index, domain)
+            emails_found = clean_emails(contacts.emails)
+            phones_found = contacts.phones
+            email_sources = contacts.email_sources
+            if original is not None:
+                near_dup_of = {"domain": original["domain"], "url": original["url"], "distance": original["distance"]}
+                self.metrics["near_duplicates"] += 1
+            elif fp is not None and emails_found:
+                index.add(fp, {"domain": domain, "url": url, "contacts": contacts, "raw_emails": raw_emails})
+
+        email_best = pick_best_email(emails_found, domain) if emails_found else ""
+        email_source = email_sources.get(email_best, "")
+        if email_source:
+            self.metrics[f"email_source_{email_source}"] += 1
+
+        audit_event = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+            "query": query,
+            "category": category,
+            "country": country,
+            "domain": domain,
+            "url": page["url"],
+            # URL tras las redirecciones y, si es otro, el dominio que traía el SERP (alias)
+            "final_url": url,
+            "serp_domain": page["serp_domain"] if page["serp_domain"] != domain else None,
+            "http_status": page["http_status"],
+            "duration_ms": page["duration_ms"],
+            # dns/connect/tls/ttfb/download en ms, bytes y redirecciones (solo backend aiohttp)
+            "timings": page["timings"],
+            "emails_found": emails_found,
+            "email_best": email_best,
+            "email_source": email_source, # mailto | jsonld | footer | text
+            "phones_found": phones_found,
+            "priority": page["priority"],
+            "exclusion_flag": page["exclusion_flag"],
+            # Casi idéntica a otra página ya extraída y con los mismos emails: se reutilizaron
+            # los contactos del lead de near_dup_of["domain"] (la fila lo enlaza)
+            "near_dup_of": near_dup_of,
+            "last_seen": datetime.now().isoformat(),
+        }
+
+        if not emails_found:
+            self.mark_negative(domain)
+            return {"query": query, "audit": audit_event, "row": None}
+        if near_dup_of is not None:
+            self.log(f"[DUP] {domain} es casi idéntica a {near_dup_of['domain']} "
+                     f"({near_dup_of['distance']} bits); se reutilizan sus contactos")
+
+        self.mark_processed(domain)
+        row = {
+            "query": query,
+            "country": country,
+            # ESTA LÍNEA AHORA GUARDA LA CATEGORÍA COMPLETA (Ej: "futbol americano")
+            "category": category,
+            "domain": domain,
+            "homepage_url": url,
+            "http_status": page["http_status"],
+            "duration_ms": page["duration_ms"],
+            "emails_all": ", ".join(emails_found),
+            "email_best": email_best,
+            "phones": ", ".join(phones_found),
+            "priority": page["priority"],
+            "last_seen": datetime.now().isoformat(),
+            "email_sent": "No",
+            "near_dup_of": near_dup_of["domain"] if near_dup_of else "",
+        }
         # Asegurar todos los campos
         for k in FIELDNAMES:
             row.setdefault(k, "")
-        csv_writer.writerow(row)
+        return {"query": query, "audit": audit_event, "row": row}
 
-async def main():
-    load_config_overrides()
-    if not SERPAPI_KEY:
-        print("[ERROR] Debes definir SERPAPI_KEY en el entorno.")
-        return
+    async def sink_page(self, item):
+        """Etapa final: línea de auditoría y evento "lead" (un solo escritor del NDJSON)."""
+        self._audit_fh.write(json.dumps(item["audit"], ensure_ascii=False) + '\n')
+        if self._queues["sink"].empty():
+            self._audit_fh.flush()
+        row = item["row"]
+        if row:
+            # Si quien consume run() no da abasto, la etapa espera (y con ella las anteriores)
+            while self._events.qsize() >= self._queues["sink"].maxsize:
+                self._events_drained.clear()
+                await self._events_drained.wait()
+            self.metrics["leads"] += 1
+            self._emit({"type": "lead", "row": row})
+        return None
+
+    async def process_query(self, query):
+        cfg = self.config
+        self.log(f"[QUERY] Buscando para: '{query}'")
+
+        page_size = max(1, int(cfg.serp_page_size))
+        max_pages = self.max_pages_per_query()
+        params = {
+            "engine": "google",
+            "q": query,
+            "api_key": cfg.serpapi_key,
+        }
+        query_domains = []
+        seen_in_query = set()
+        query_dropped = Counter()
+        total_results = 0
+        pages = 0
+        start = 0
+        serp_failed = False
+        while pages < max_pages and not self.credits_exhausted():
+            page_params = dict(params, num=page_size, start=start)
+            search_results = await self.fetch_serpapi(query, page_params)
+            if search_results is None:
+                serp_failed = True
+                break
+            pages += 1
+            if not search_results:
+                break
+
+            total_results += len(search_results)
+            for result in search_results:
+                domain = domain_of(result.get("link"))
+                if domain and domain not in query_domains:
+                    query_domains.append(domain)
+
+            # Página saturada = casi nada de lo que trae se llegaría a visitar
+            to_fetch, dropped = self.filter_serp_results(query, search_results, seen_in_query)
+            saturation = 1 - len(to_fetch) / len(search_results)
+            query_dropped.update(dropped)
+            self.metrics["serp_results"] += len(search_results)
+            for reason, n in dropped.items():
+                self.metrics[f"filtered_{reason}"] += n
 
-    load_seen_domains()
+            # Las visitas de esta página corren en el pipeline mientras se pide la siguiente
+            # a SerpAPI; si la cola de descargas está llena, la paginación espera
+            await self.enqueue_fetch(query, to_fetch)
 
-    queries_to_run = get_query_permutations()
-    queries_to_run = queries_to_run[:MAX_QUERIES]
+            self._emit({"type": "page", "query": query, "page": pages,
+                        "results": len(search_results), "saturation": saturation})
+            self.log(f"[PAGE] '{query}' página {pages} (start={start}): {len(search_results)} resultados, "
+                     f"{int(saturation * 100)}% ya conocidos")
+            if saturation >= cfg.page_saturation:
+                self.log(f"[PAGE] '{query}' saturada; se detiene la paginación")
+                break
+            if total_results >= int(cfg.results_per_query):
+                break
+            start += len(search_results)
+
+        if serp_failed and not total_results:
+            # Sin respuesta de SerpAPI: no se anota, así el plan la vuelve a incluir
+            self.log(f"[QUERY] '{query}' sin respuesta de SerpAPI; queda pendiente")
+            return
+        status = "partial" if serp_failed else "ok" if total_results else "empty"
+        self.record_serp_done(query, page_size, total_results, query_domains,
+                              status, pages=pages, filtered=dict(query_dropped))
+        if query_dropped:
+            self.log(f"[FILTER] '{query}' descartados: " + ", ".join(f"{k}={v}" for k, v in sorted(query_dropped.items())))
+        if not total_results:
+            self.log(f"[QUERY] Sin resultados para: '{query}'")
+
+    def build_frontier(self):
+        """Frontera del rastreo: conexiones globales de la config y cortesía por host."""
+        cfg = self.config
+        robots = None
+        if cfg.respect_robots:
+            if self.robots_cache is None:
+                self.robots_cache = RobotsCache(ttl_seconds=float(cfg.robots_ttl_hours) * 3600)
+            robots = self.robots_cache
+        return HostFrontier(cfg.connection_limit, per_host=cfg.per_host_concurrency,
+                            per_host_delay=cfg.per_host_delay, robots=robots)
+
+    def build_proxy_pool(self):
+        """Pool de salidas de la config (None si no hay proxies ni varios perfiles)."""
+        cfg = self.config
+        if self.proxy_pool is None and (cfg.proxies or len(cfg.header_profile_pool) > 1):
+            self.proxy_pool = ProxyPool(cfg.proxies, profiles=cfg.header_profile_pool or [cfg.header_profile],
+                                        per_proxy=cfg.proxy_concurrency, max_failures=cfg.proxy_max_failures,
+                                        health_url=cfg.proxy_health_url, log=self.log)
+            self.log(f"[PROXY] {len(self.proxy_pool)} salidas, {self.proxy_pool.per_proxy} peticiones por salida")
+        return self.proxy_pool
+
+    def build_fetcher(self, session=None):
+        """
+        Cliente HTTP del rastreo según la config. Con el backend aiohttp se reutiliza
+        `session` si se pasa; si no, se abre uno propio limitado a connection_limit.
+        Con proxies (o varios perfiles de cabeceras) las peticiones salen por el pool.
+        """
+        cfg = self.config
+        fetcher = make_fetcher(cfg.fetcher_backend, session=session, verify_tls=bool(cfg.verify_tls),
+                               headers=header_profile(cfg.header_profile), timeout=float(cfg.fetch_timeout),
+                               limit=cfg.connection_limit)
+        pool = self.build_proxy_pool()
+        return ProxiedFetcher(fetcher, pool) if pool is not None else fetcher
+
+    # --- Pipeline: SERP -> descargas -> extracción -> sink ---
+    async def enqueue_fetch(self, query, results):
+        """Pasa los resultados filtrados de una página SERP a la etapa de descargas."""
+        for result in results:
+            self.metrics["fetched"] += 1
+            self._in_flight[query] += 1
+            await self._queues["fetch"].put({"query": query, "url": result["link"], "priority": result.get("position")})
+
+    async def _stage(self, name, inbox, handle, outbox=None):
+        """Trabajador de una etapa: toma de `inbox`, procesa y pasa el resultado a `outbox`."""
+        while True:
+            item = await inbox.get()
+            try:
+                try:
+                    out = await handle(item)
+                except Exception as e:
+                    self.log(f"[PIPE] Error en la etapa {name} ({item.get('url') or item['query']}): {e}")
+                    out = None
+                if out is not None and outbox is not None:
+                    await outbox.put(out) # cola llena: esta etapa espera a la siguiente
+                else:
+                    self._item_done(item["query"])
+            finally:
+                inbox.task_done()
+
+    def _item_done(self, query):
+        self._in_flight[query] -= 1
+        self._maybe_query_done(query)
+
+    def _maybe_query_done(self, query):
+        """query_done cuando la paginación terminó y todos sus resultados salieron del pipeline."""
+        if query in self._searched and self._in_flight[query] <= 0:
+            self._searched.discard(query)
+            self._in_flight.pop(query, None)
+            self._emit({"type": "query_done", "query": query})
+
+    async def _monitor_queues(self):
+        """Muestrea la profundidad de las colas: picos en métricas y un evento periódico."""
+        last_report = time.time()
+        while True:
+            await asyncio.sleep(QUEUE_SAMPLE_SECONDS)
+            depths = {name: q.qsize() for name, q in self._queues.items()}
+            for name, depth in depths.items():
+                key = f"queue_peak_{name}"
+                self.metrics[key] = max(self.metrics[key], depth)
+            if time.time() - last_report >= QUEUE_REPORT_SECONDS:
+                last_report = time.time()
+                self._emit({"type": "queues", "depths": depths, "in_flight": sum(self._in_flight.values())})
+                self.log("[PIPE] colas " + ", ".join(f"{name}={depths[name]}/{q.maxsize}" for name, q in self._queues.items())
+                         + f"; en vuelo={sum(self._in_flight.values())}")
+
+    async def _run_pipeline(self, fetcher, queries):
+        cfg = self.config
+        fetch_workers = int(cfg.fetch_workers) or 2 * int(cfg.connection_limit)
+        extract_workers = max(1, int(cfg.extract_workers))
+        queue_size = max(1, int(cfg.pipeline_queue_size))
+        # Entre descarga y extracción viajan los cuerpos HTML: esa cola es la que acota la memoria
+        self._queues = {
+            "fetch": asyncio.Queue(maxsize=queue_size),
+            "extract": asyncio.Queue(maxsize=max(1, int(cfg.page_queue_size))),
+            "sink": asyncio.Queue(maxsize=queue_size),
+        }
+        self._in_flight = Counter()
+        self._searched = set()
+        q = self._queues
+        self.log(f"[PIPE] {fetch_workers} descargas, {extract_workers} extracciones, "
+                 f"colas de {queue_size} (páginas en espera: {q['extract'].maxsize})")
+
+        with open(cfg.audit_path, 'a', encoding='utf-8') as self._audit_fh:
+            workers = [asyncio.create_task(self._stage("fetch", q["fetch"], lambda item: self.fetch_page(fetcher, item), q["extract"]))
+                       for _ in range(fetch_workers)]
+            workers += [asyncio.create_task(self._stage("extract", q["extract"], self.extract_page, q["sink"]))
+                        for _ in range(extract_workers)]
+            workers.append(asyncio.create_task(self._stage("sink", q["sink"], self.sink_page)))
+            workers.append(asyncio.create_task(self._monitor_queues()))
+            try:
+                await self._crawl_queries(queries)
+                for name in ("fetch", "extract", "sink"): # en orden: cada etapa alimenta la siguiente
+                    await q[name].join()
+            finally:
+                for task in workers: # cancelación: no dejar visitas huérfanas
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
 
-    ensure_dir_for(AUDIT_PATH)
-    csvfile, csv_writer = open_csv_with_schema(OUTPUT_CSV, FIELDNAMES)
+    async def _crawl(self, session=None):
+        try:
+            queries = self.prepare()
+            self.frontier = self.build_frontier()
+            if self.key_pool is None:
+                cfg = self.config
+                self.key_pool = SerpKeyPool(cfg.api_keys(), rate_per_minute=cfg.serpapi_rate_per_minute,
+                                            strategy=cfg.serpapi_key_strategy)
+            await self.key_pool.prime(self.log)
+            async with self.build_fetcher(session) as fetcher:
+                await self._run_pipeline(fetcher, queries)
+        finally:
+            self.close()
+            if self.metrics:
+                self.log("[METRICS] " + ", ".join(f"{k}={v}" for k, v in sorted(self.metrics.items())))
+            if self.key_pool is not None and len(self.key_pool):
+                self.log("[KEYS] " + self.key_pool.summary())
+            if self.proxy_pool is not None:
+                self.log("[PROXY] " + self.proxy_pool.summary())
+            self._emit({"type": "done", "metrics": dict(self.metrics), "credits_spent": self.credits_spent})
+
+    async def _crawl_queries(self, queries):
+        for i, query in enumerate(queries):
+            if self.key_pool.exhausted():
+                self.log("[KEYS] No queda ninguna API key de SerpAPI utilizable; se detiene el rastreo.")
+                break
+            if self.credits_exhausted():
+                self.log(f"[INFO] Presupuesto de {self.config.credit_budget} créditos agotado.")
+                break
+            self._emit({"type": "query", "query": query, "index": i, "total": len(queries)})
+            await self.process_query(query)
+            self._searched.add(query)
+            self._maybe_query_done(query)
+            await asyncio.sleep(self.config.query_pause) # Pequeña pausa entre consultas a SerpAPI
+
+    async def run(self, session=None):
+        """
+        Ejecuta el rastreo y produce eventos a medida que ocurren. `session` permite
+        compartir un aiohttp.ClientSession entre varios rastreos (backend aiohttp).
+        """
+        task = asyncio.create_task(self._crawl(session))
+        try:
+            while True:
+                event = await self._events.get()
+                self._events_drained.set()
+                yield event
+                if event["type"] == "done":
+                    break
+            await task # propaga la excepción del rastreo, si la hubo
+        finally:
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+
+async def main():
+    config = load_crawler_config(CONFIG_PATH)
+    if not config.api_keys():
+        print("[ERROR] Debes definir SERPAPI_KEY (o SERPAPI_KEYS) en el entorno.")
+        return
+
+    crawler = LeadCrawler(config)
+    crawler.prepare()
+    sink = LeadSink(config.output_csv, FIELDNAMES, fsync=config.csv_fsync)
 
     try:
-        # Usamos un límite de conexiones para no saturar
-        connector = aiohttp.TCPConnector(limit=20)
-        async with aiohttp.ClientSession(connector=connector) as session:
-            for query in queries_to_run:
-                params = {
-                    "engine": "google",
-                    "q": query,
-                    "api_key": SERPAPI_KEY,
-                    "num": RESULTS_PER_QUERY,
-                }
-                await process_query(session, query, params, csv_writer)
-                csvfile.flush()
-                time.sleep(1) # Pequeña pausa entre consultas a SerpAPI
+        async for event in crawler.run():
+            if event["type"] == "log":
+                print(event["message"])
+            elif event["type"] == "lead":
+                sink.add(event["row"])
+            elif event["type"] == "query_done":
+                sink.flush(block=False)
     finally:
-        try:
-            csvfile.flush()
-            csvfile.close()
-        except Exception:
-            pass
+        sink.close()
 
-    print(f"[INFO] Proceso completado. Resultados guardados en {OUTPUT_CSV}")
+    print(f"[INFO] Proceso completado. Resultados guardados en {config.output_csv}")
 
 if __name__ == "__main__":
     try:
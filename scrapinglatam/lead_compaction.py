@@ -0,0 +1,251 @@
+import os
+import sys
+import csv
+import glob
+import math
+import heapq
+import shutil
+import zlib
+import argparse
+import tempfile
+from datetime import datetime
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+OUTPUT_CSV = os.path.join(BASE_DIR, "scrapinglatam", "latam_leads.csv")
+
+from scrapinglatam.latam_lead_crawler_serpapi import FIELDNAMES, pick_best_email
+from scrapinglatam.domains import normalize_domain
+from scrapinglatam.lead_sink import csv_lock
+
+# --- Compactación del almacén de leads ---
+# Funde el CSV vivo y los rotados (<base>_OLD_<ts>.csv) en una fila por dominio y deja
+# cada email en un solo dominio, con memoria acotada: las filas se reparten en
+# particiones en disco por hash (del dominio y luego del email), cada partición cabe
+# en memoria y la salida se ordena por last_seen con un merge externo de las
+# particiones ya ordenadas.
+#
+# Reglas:
+# - Por dominio gana la fila más reciente (last_seen); los emails de todas las
+#   versiones se unen y "email enviado" queda en Sí si alguna versión lo tenía.
+# - Un email repetido en varios dominios se queda en el dominio del propio email
+#   (contacto@uach.cl -> uach.cl) o, si no, en el dominio donde se vio primero.
+# - Una fila que se queda sin emails se descarta, salvo que ya se le haya escrito.
+
+DEFAULT_MEMORY_MB = 256
+ROW_OVERHEAD = 4 # memoria aproximada de una fila en dicts frente a su tamaño en CSV
+
+
+def rotated_files(path=OUTPUT_CSV):
+    base, ext = os.path.splitext(path)
+    return sorted(glob.glob(f"{base}_OLD_*{ext}"))
+
+
+def _bucket(key, n):
+    return zlib.crc32(key.encode("utf-8")) % n
+
+
+def _split_emails(value):
+    return [e.strip().lower() for e in (value or "").split(",") if e.strip()]
+
+
+def _is_sent(value):
+    return str(value or "").strip().lower() in ("sí", "si", "true", "1")
+
+
+class _Partitions:
+    """N archivos CSV temporales a los que se reparten filas por clave."""
+
+    def __init__(self, workdir, name, n):
+        self.paths = [os.path.join(workdir, f"{name}_{i}.csv") for i in range(n)]
+        self._files = [open(p, "w", encoding="utf-8", newline="") for p in self.paths]
+        self._writers = [csv.writer(f) for f in self._files]
+
+    def add(self, key, values):
+        self._writers[_bucket(key, len(self.paths))].writerow(values)
+
+    def close(self):
+        for f in self._files:
+            f.close()
+
+    def read(self, i):
+        with open(self.paths[i], encoding="utf-8", newline="") as fh:
+            yield from csv.reader(fh)
+
+
+def _iter_input_rows(paths):
+    for path in paths:
+        with open(path, encoding="utf-8-sig", newline="") as fh:
+            for row in csv.DictReader(fh):
+                domain = normalize_domain(row.get("domain") or row.get("homepage_url") or "") or \
+                    (row.get("domain") or "").strip().lower()
+                if not domain:
+                    continue
+                row["domain"] = domain
+                yield [row.get(k) or "" for k in FIELDNAMES]
+
+
+def _merge_versions(versions):
+    """Una fila por dominio a partir de todas sus versiones."""
+    versions.sort(key=lambda v: v[FIELDNAMES.index("last_seen")])
+    latest = dict(zip(FIELDNAMES, versions[-1]))
+    emails = []
+    for v in reversed(versions):
+        for e in _split_emails(v[FIELDNAMES.index("emails_all")]):
+            if e not in emails:
+                emails.append(e)
+    latest["emails_all"] = ", ".join(emails)
+    if any(_is_sent(v[FIELDNAMES.index("email_sent")]) for v in versions):
+        latest["email_sent"] = "Sí"
+    # la primera vez que se vio el dominio (para decidir a quién pertenece un email repetido)
+    latest["_first_seen"] = versions[0][FIELDNAMES.index("last_seen")]
+    return latest
+
+
+def compact_leads(path=OUTPUT_CSV, memory_mb=DEFAULT_MEMORY_MB, include_rotated=True, workdir=None):
+    """
+    Compacta el CSV de leads (y los rotados) en el propio `path`. Devuelve estadísticas.
+    Escribe a un temporal y lo renombra al final: si algo falla, el CSV no se toca.
+    Mientras dura, el lock del CSV retiene los lotes del crawler (se anexan después).
+    """
+    with csv_lock(path):
+        return _compact_leads(path, memory_mb, include_rotated, workdir)
+
+
+def _compact_leads(path, memory_mb, include_rotated, workdir):
+    inputs = ([path] if os.path.exists(path) else []) + (rotated_files(path) if include_rotated else [])
+    if not inputs:
+        return {"inputs": 0}
+    total_bytes = sum(os.path.getsize(p) for p in inputs)
+    n = max(1, math.ceil(total_bytes * ROW_OVERHEAD / (memory_mb << 20)))
+    stats = {"inputs": len(inputs), "partitions": n, "rows_in": 0, "domains": 0,
+             "emails_moved": 0, "rows_dropped": 0, "rows_out": 0}
+
+    tmpdir = tempfile.mkdtemp(prefix="compact_", dir=workdir or os.path.dirname(path) or None)
+    try:
+        # 1) Filas -> particiones por dominio
+        by_domain = _Partitions(tmpdir, "dom", n)
+        for values in _iter_input_rows(inputs):
+            by_domain.add(values[FIELDNAMES.index("domain")], values)
+            stats["rows_in"] += 1
+        by_domain.close()
+
+        # 2) Una fila por dominio; los emails de cada dominio -> particiones por email
+        merged_fields = FIELDNAMES + ["_first_seen"]
+        merged = _Partitions(tmpdir, "merged", n)
+        claims = _Partitions(tmpdir, "claims", n)
+        for i in range(n):
+            groups = {}
+            for values in by_domain.read(i):
+                groups.setdefault(values[FIELDNAMES.index("domain")], []).append(values)
+            for domain, versions in groups.items():
+                row = _merge_versions(versions)
+                merged.add(domain, [row[k] for k in merged_fields])
+                for e in _split_emails(row["emails_all"]):
+                    same_domain = "0" if e.endswith("@" + domain) or e.endswith("." + domain) else "1"
+                    claims.add(e, [e, same_domain, row["_first_seen"], domain])
+                stats["domains"] += 1
+            os.remove(by_domain.paths[i])
+        merged.close()
+        claims.close()
+
+        # 3) Dueño de cada email; los demás dominios lo pierden -> particiones por dominio
+        drops = _Partitions(tmpdir, "drops", n)
+        for i in range(n):
+            owners = {}
+            rows = list(claims.read(i))
+            for email, same_domain, first_seen, domain in rows:
+                rank = (same_domain, first_seen, domain)
+                if email not in owners or rank < owners[email]:
+                    owners[email] = rank
+            for email, same_domain, first_seen, domain in rows:
+                if owners[email][2] != domain:
+                    drops.add(domain, [domain, email])
+                    stats["emails_moved"] += 1
+            os.remove(claims.paths[i])
+        drops.close()
+
+        # 4) Aplicar bajas, recalcular el mejor email y ordenar cada partición por last_seen
+        runs = []
+        for i in range(n):
+            dropped = {}
+            for domain, email in drops.read(i):
+                dropped.setdefault(domain, set()).add(email)
+            out_rows = []
+            for values in merged.read(i):
+                row = dict(zip(merged_fields, values))
+                lost = dropped.get(row["domain"])
+                if lost:
+                    emails = [e for e in _split_emails(row["emails_all"]) if e not in lost]
+                    row["emails_all"] = ", ".join(emails)
+                    if row["email_best"].lower() in lost or not row["email_best"]:
+                        row["email_best"] = pick_best_email(emails, row["domain"]) if emails else ""
+                if not row["emails_all"] and not _is_sent(row["email_sent"]):
+                    stats["rows_dropped"] += 1
+                    continue
+                out_rows.append([row[k] for k in FIELDNAMES])
+            out_rows.sort(key=lambda v: v[FIELDNAMES.index("last_seen")])
+            run_path = os.path.join(tmpdir, f"run_{i}.csv")
+            with open(run_path, "w", encoding="utf-8", newline="") as fh:
+                csv.writer(fh).writerows(out_rows)
+            runs.append(run_path)
+            os.remove(merged.paths[i])
+            os.remove(drops.paths[i])
+
+        # 5) Merge externo de las particiones ordenadas -> CSV final
+        tmp_out = path + ".compact.tmp"
+        handles = [open(p, encoding="utf-8", newline="") for p in runs]
+        try:
+            with open(tmp_out, "w", encoding="utf-8-sig", newline="") as out:
+                writer = csv.writer(out)
+                writer.writerow(FIELDNAMES)
+                key = FIELDNAMES.index("last_seen")
+                for values in heapq.merge(*(csv.reader(h) for h in handles), key=lambda v: v[key]):
+                    writer.writerow(values)
+                    stats["rows_out"] += 1
+        finally:
+            for h in handles:
+                h.close()
+        os.replace(tmp_out, path)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return stats
+
+
+def archive_rotated(path=OUTPUT_CSV):
+    """Mueve los CSV rotados ya fundidos a <dir>/archive/ (no se borra nada)."""
+    archive = os.path.join(os.path.dirname(path), "archive")
+    moved = []
+    for p in rotated_files(path):
+        os.makedirs(archive, exist_ok=True)
+        dest = os.path.join(archive, os.path.basename(p))
+        shutil.move(p, dest)
+        moved.append(dest)
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compacta el CSV de leads: una fila por dominio, emails sin repetir")
+    parser.add_argument("--input", default=OUTPUT_CSV, help="CSV de leads")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_MB, help="memoria objetivo por partición")
+    parser.add_argument("--no-rotated", action="store_true", help="no fundir los *_OLD_*.csv")
+    parser.add_argument("--force", action="store_true", help="compactar aunque haya un worker activo")
+    args = parser.parse_args(argv)
+
+    if not args.force:
+        from scrapinglatam.crawler_worker import JobQueue
+        if JobQueue().worker_alive():
+            parser.error("hay un worker de rastreo activo escribiendo en el CSV; detenlo o usa --force")
+
+    started = datetime.now()
+    stats = compact_leads(args.input, args.memory_mb, include_rotated=not args.no_rotated)
+    if not args.no_rotated and stats.get("inputs"):
+        for p in archive_rotated(args.input):
+            print(f"[COMPACT] Rotado archivado: {p}")
+    print(f"[COMPACT] {stats} en {(datetime.now() - started).total_seconds():.1f}s")
+
+
+if __name__ == "__main__":
+    main()
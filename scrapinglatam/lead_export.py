@@ -0,0 +1,232 @@
+import os
+import sys
+import csv
+import json
+import hashlib
+import argparse
+from dataclasses import dataclass, asdict
+from datetime import date, datetime
+from typing import Optional
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+OUTPUT_CSV = os.path.join(BASE_DIR, "scrapinglatam", "latam_leads.csv")
+EXPORTS_DIR = os.path.join(BASE_DIR, "scrapinglatam", "exports")
+
+# --- Exportación de leads por streaming ---
+# El CSV maestro se recorre por bloques de filas (nunca entero en memoria), se aplican
+# los mismos filtros que la vista previa de la app y cada bloque se escribe en el
+# formato pedido: CSV, NDJSON o Parquet (un row group por bloque).
+
+FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "ndjson": ("application/x-ndjson", ".ndjson"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+CHUNK_ROWS = 5000
+
+COUNTRY_NAMES = {
+    "ar": "Argentina", "cl": "Chile", "co": "Colombia",
+    "pe": "Perú", "uy": "Uruguay", "bo": "Bolivia",
+    "py": "Paraguay", "ve": "Venezuela", "ec": "Ecuador"
+}
+
+
+def country_name(val) -> str:
+    """'cl', 'site:.cl' o 'Chile' -> 'Chile' (como se muestra en la app)."""
+    s = str(val or "").strip()
+    if s in COUNTRY_NAMES.values():
+        return s
+    s_lower = s.lower()
+    if s_lower.startswith("site:."):
+        tld = s_lower.split("site:.", 1)[1].strip().lstrip(".")
+        return COUNTRY_NAMES.get(tld, s)
+    if len(s) == 2:
+        return COUNTRY_NAMES.get(s_lower, s)
+    return s
+
+
+def is_email_sent(val) -> bool:
+    return str(val or "").strip().lower() in ("sí", "si", "true", "1")
+
+
+def _row_date(val):
+    try:
+        return datetime.fromisoformat(str(val).strip()).date()
+    except ValueError:
+        return None
+
+
+@dataclass
+class LeadFilter:
+    """Filtros de la vista previa. None = sin filtrar por ese campo."""
+    country: Optional[str] = None      # nombre del país ("Chile") o código ("cl")
+    category: Optional[str] = None
+    email_sent: Optional[bool] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+
+    def __post_init__(self):
+        if self.country:
+            self.country = country_name(self.country)
+
+    def matches(self, row) -> bool:
+        if self.country and country_name(row.get("country")) != self.country:
+            return False
+        if self.category and (row.get("category") or "") != self.category:
+            return False
+        if self.email_sent is not None and is_email_sent(row.get("email_sent")) != self.email_sent:
+            return False
+        if self.date_from or self.date_to:
+            d = _row_date(row.get("last_seen"))
+            if d is None:
+                return False
+            if self.date_from and d < self.date_from:
+                return False
+            if self.date_to and d > self.date_to:
+                return False
+        return True
+
+    def key(self) -> str:
+        """Huella estable del filtro (para nombrar exportaciones)."""
+        payload = json.dumps(asdict(self), default=str, sort_keys=True)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:10]
+
+
+def read_header(path):
+    with open(path, newline="", encoding="utf-8-sig") as fh:
+        header = next(csv.reader(fh), None)
+    return [h for h in (header or []) if h and not h.startswith("Unnamed")]
+
+
+def iter_lead_chunks(path=OUTPUT_CSV, lead_filter=None, chunk_rows=CHUNK_ROWS):
+    """Bloques (listas de dicts) de filas que pasan el filtro, leyendo el CSV en streaming."""
+    chunk = []
+    with open(path, newline="", encoding="utf-8-sig") as fh:
+        for row in csv.DictReader(fh):
+            if lead_filter is None or lead_filter.matches(row):
+                chunk.append(row)
+                if len(chunk) >= chunk_rows:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+# --- Escritores por formato ---
+def _write_csv(chunks, out_path, columns):
+    count = 0
+    with open(out_path, "w", encoding="utf-8-sig", newline="") as out:
+        writer = csv.DictWriter(out, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for chunk in chunks:
+            writer.writerows(chunk)
+            count += len(chunk)
+    return count
+
+
+def _write_ndjson(chunks, out_path, columns):
+    count = 0
+    with open(out_path, "w", encoding="utf-8") as out:
+        for chunk in chunks:
+            out.write("".join(
+                json.dumps({c: row.get(c) for c in columns}, ensure_ascii=False) + "\n" for row in chunk
+            ))
+            count += len(chunk)
+    return count
+
+
+def _write_parquet(chunks, out_path, columns):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("La exportación a Parquet requiere pyarrow (pip install pyarrow)") from e
+    schema = pa.schema([(c, pa.string()) for c in columns])
+    count = 0
+    with pq.ParquetWriter(out_path, schema, compression="zstd") as writer:
+        for chunk in chunks:
+            table = pa.Table.from_pydict({c: [row.get(c) for row in chunk] for c in columns}, schema=schema)
+            writer.write_table(table)
+            count += len(chunk)
+        if count == 0:
+            writer.write_table(schema.empty_table())
+    return count
+
+
+WRITERS = {"csv": _write_csv, "ndjson": _write_ndjson, "parquet": _write_parquet}
+
+
+def export_leads(out_path, fmt="csv", lead_filter=None, path=OUTPUT_CSV, chunk_rows=CHUNK_ROWS):
+    """
+    Escribe en `out_path` los leads que pasan el filtro y devuelve cuántos se exportaron.
+    Se escribe a un temporal y se renombra: un lector nunca ve una exportación a medias.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"Formato de exportación desconocido: {fmt}")
+    columns = read_header(path)
+    d = os.path.dirname(out_path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    tmp = out_path + ".tmp"
+    try:
+        count = WRITERS[fmt](iter_lead_chunks(path, lead_filter, chunk_rows), tmp, columns)
+        os.replace(tmp, out_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return count
+
+
+def cached_export(fmt="csv", lead_filter=None, path=OUTPUT_CSV, exports_dir=EXPORTS_DIR):
+    """
+    Ruta de la exportación para (formato, filtro, versión del CSV), generándola solo si
+    no existe. Las exportaciones anteriores del mismo CSV se borran.
+    """
+    info = os.stat(path)
+    version = f"{int(info.st_mtime)}_{info.st_size}"
+    fkey = lead_filter.key() if lead_filter else "all"
+    base = os.path.splitext(os.path.basename(path))[0]
+    out_path = os.path.join(exports_dir, f"{base}_{fkey}_{version}{FORMATS[fmt][1]}")
+    if not os.path.exists(out_path):
+        export_leads(out_path, fmt, lead_filter, path)
+        for name in os.listdir(exports_dir):
+            old = os.path.join(exports_dir, name)
+            if name.startswith(base + "_") and version not in name:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+    return out_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta los leads filtrados (CSV, NDJSON o Parquet)")
+    parser.add_argument("-o", "--output", required=True, help="archivo de salida")
+    parser.add_argument("-f", "--format", choices=sorted(FORMATS), help="por defecto, según la extensión de salida")
+    parser.add_argument("--input", default=OUTPUT_CSV, help="CSV de leads")
+    parser.add_argument("--country", help="país (nombre o código: 'Chile', 'cl')")
+    parser.add_argument("--category")
+    parser.add_argument("--email-sent", choices=["si", "no"])
+    parser.add_argument("--since", type=date.fromisoformat, help="fecha desde (AAAA-MM-DD)")
+    parser.add_argument("--until", type=date.fromisoformat, help="fecha hasta (AAAA-MM-DD)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip(".").lower()
+    if fmt not in FORMATS:
+        parser.error("no se puede deducir el formato de la extensión; usa --format")
+    lead_filter = LeadFilter(
+        country=args.country,
+        category=args.category,
+        email_sent=None if args.email_sent is None else args.email_sent == "si",
+        date_from=args.since,
+        date_to=args.until,
+    )
+    count = export_leads(args.output, fmt, lead_filter, args.input)
+    print(f"[EXPORT] {count} leads exportados a {args.output} ({fmt})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import io
+import os
+import sys
+import csv
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError: # Windows: sin bloqueo entre procesos (un solo escritor por convención)
+    fcntl = None
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+# --- Escritor único del CSV de leads ---
+# Todo el que modifica el CSV maestro lo hace bajo un bloqueo consultivo (flock) sobre
+# <csv>.lock: el sink del crawler al anexar y los que lo reescriben (edición de "email
+# enviado", rescore, compactación) durante toda la reescritura. El lock va en un archivo
+# aparte porque reescribir el CSV con os.replace cambia su inodo.
+#
+# El sink acumula filas y las escribe por lotes: cada lote se serializa entero y se
+# anexa con write() sobre O_APPEND, reabriendo el archivo en cada lote (si alguien lo
+# reemplazó, se escribe en el nuevo, no en el inodo huérfano). Los lectores que toman el
+# lock compartido para leer el tamaño (LeadStore.sync) solo ven lotes completos.
+#
+# fsync: "batch" tras cada lote, "interval" como mucho cada FSYNC_INTERVAL segundos,
+# "never" lo deja al sistema operativo.
+
+LOCK_SUFFIX = ".lock"
+FSYNC_POLICIES = ("batch", "interval", "never")
+DEFAULT_FSYNC = "interval"
+FSYNC_INTERVAL = 5.0
+BATCH_ROWS = 200
+FLUSH_SECONDS = 2.0
+
+_held = {} # (ruta del lock, hilo) -> [fd, profundidad]; el lock es reentrante por hilo
+_held_guard = threading.Lock()
+
+
+@contextmanager
+def csv_lock(path, shared=False, blocking=True):
+    """
+    Bloqueo consultivo del CSV `path`. Produce True si se obtuvo; con blocking=False
+    produce False si otro lo tiene. Reentrante dentro del mismo hilo.
+    """
+    if fcntl is None:
+        yield True
+        return
+    key = (os.path.abspath(path) + LOCK_SUFFIX, threading.get_ident())
+    with _held_guard:
+        entry = _held.get(key)
+        if entry:
+            entry[1] += 1
+    if entry:
+        try:
+            yield True
+        finally:
+            with _held_guard:
+                entry[1] -= 1
+        return
+
+    d = os.path.dirname(key[0])
+    if d:
+        os.makedirs(d, exist_ok=True)
+    fd = os.open(key[0], os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(fd, flags if blocking else flags | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        with _held_guard:
+            _held[key] = [fd, 1]
+        try:
+            yield True
+        finally:
+            with _held_guard:
+                _held.pop(key, None)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def _read_header(path):
+    try:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            return next(csv.reader(f), None)
+    except (OSError, csv.Error, UnicodeDecodeError):
+        return None
+
+
+class LeadSink:
+    """Escritor por lotes del CSV de leads; seguro entre procesos e hilos."""
+
+    def __init__(self, path, fieldnames, fsync=DEFAULT_FSYNC, batch_rows=BATCH_ROWS,
+                 flush_seconds=FLUSH_SECONDS, fsync_interval=FSYNC_INTERVAL):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Política de fsync desconocida: {fsync} (disponibles: {', '.join(FSYNC_POLICIES)})")
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.fsync = fsync
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.fsync_interval = fsync_interval
+        self.rows_written = 0
+        self._rows = []
+        self._buffer_lock = threading.Lock()
+        self._last_flush = time.time()
+        self._last_fsync = 0.0
+        self._last_write = 0.0
+
+    def pending(self):
+        return len(self._rows)
+
+    def add(self, row):
+        """Encola una fila; escribe el lote si está lleno o es antiguo (sin esperar al lock)."""
+        with self._buffer_lock:
+            self._rows.append(row)
+            due = len(self._rows) >= self.batch_rows or time.time() - self._last_flush >= self.flush_seconds
+        if due:
+            self.flush(block=False)
+
+    def flush(self, block=True) -> bool:
+        """Escribe las filas pendientes. False si block=False y el CSV está bloqueado por otro."""
+        with self._buffer_lock:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return True
+        written = False
+        try:
+            with csv_lock(self.path, blocking=block) as locked:
+                if locked:
+                    self._write(rows)
+                    written = True
+        finally:
+            if not written: # se devuelven a la cola, por delante de las llegadas después
+                with self._buffer_lock:
+                    self._rows[:0] = rows
+        self._last_flush = time.time()
+        return written
+
+    def close(self):
+        """Escribe lo pendiente y, salvo fsync="never", deja en disco el último lote."""
+        self.flush(block=True)
+        if self.fsync != "never" and self._last_write > self._last_fsync and os.path.exists(self.path):
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+            try:
+                os.fsync(fd)
+                self._last_fsync = time.time()
+            finally:
+                os.close(fd)
+
+    def _prepare(self):
+        """Bytes que hay que escribir antes del lote (encabezado o salto pendiente)."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return self._header_bytes()
+        header = _read_header(self.path)
+        if header and header != self.fieldnames and header == self.fieldnames[:len(header)]:
+            self._extend_header(header)
+        elif header != self.fieldnames:
+            base, ext = os.path.splitext(self.path)
+            rotated = f"{base}_OLD_{datetime.now().strftime('%Y%m%d_%H%M%S')}{ext}"
+            os.rename(self.path, rotated)
+            print(f"[CSV] Encabezado distinto. Archivo antiguo rotado a: {rotated}")
+            return self._header_bytes()
+        # Un escritor que murió a mitad de fila no debe pegar su resto a nuestra primera fila
+        with open(self.path, "rb") as fh:
+            fh.seek(-1, os.SEEK_END)
+            return b"" if fh.read(1) == b"\n" else b"\r\n"
+
+    def _extend_header(self, header):
+        """
+        El esquema solo ganó columnas al final: se reescribe el encabezado y se conservan
+        las filas (las antiguas quedan con esas columnas vacías, como lee csv.DictReader).
+        """
+        tmp = self.path + ".tmp"
+        with open(self.path, "rb") as src, open(tmp, "wb") as out:
+            src.readline() # encabezado viejo (sin saltos entre comillas: son nombres de columna)
+            out.write(self._header_bytes())
+            shutil.copyfileobj(src, out)
+        os.replace(tmp, self.path)
+        print(f"[CSV] Encabezado ampliado con: {', '.join(self.fieldnames[len(header):])}")
+
+    def _header_bytes(self):
+        buf = io.StringIO()
+        csv.writer(buf).writerow(self.fieldnames)
+        return buf.getvalue().encode("utf-8-sig")
+
+    def _write(self, rows):
+        buf = io.StringIO()
+        csv.DictWriter(buf, fieldnames=self.fieldnames).writerows(rows)
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        data = memoryview(self._prepare() + buf.getvalue().encode("utf-8"))
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+            now = self._last_write = time.time()
+            if self.fsync == "batch" or (self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval):
+                os.fsync(fd)
+                self._last_fsync = now
+        finally:
+            os.close(fd)
+        self.rows_written += len(rows)
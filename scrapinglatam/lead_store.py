@@ -0,0 +1,323 @@
+import os
+import io
+import sys
+import csv
+import sqlite3
+import hashlib
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+OUTPUT_CSV = os.path.join(BASE_DIR, "scrapinglatam", "latam_leads.csv")
+LEADS_DB_PATH = os.path.join(BASE_DIR, "scrapinglatam", "leads.sqlite")
+
+from scrapinglatam.lead_export import LeadFilter, country_name, is_email_sent
+from scrapinglatam.lead_sink import csv_lock
+
+# --- Almacén consultable de leads ---
+# Espejo en SQLite del CSV maestro para la vista previa. El CSV sigue siendo la fuente
+# de verdad; el espejo se pone al día leyendo solo los bytes añadidos desde la última
+# sincronización (el crawler solo anexa) y se reconstruye si el CSV fue reemplazado.
+# Los filtros se resuelven con índices (columna, rowid) y la paginación es por clave
+# (rowid < cursor), así el coste por página no crece con el tamaño del almacén.
+# La búsqueda libre por dominio/email usa un índice FTS5 de trigramas.
+
+PAGE_SIZE = 100
+SYNC_BLOCK_BYTES = 8 << 20 # el CSV se incorpora por bloques (memoria acotada)
+HEAD_BYTES = 4096 # huella del inicio del CSV para detectar que fue reemplazado
+MIN_FTS_CHARS = 3 # el tokenizador de trigramas no indexa búsquedas más cortas
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS leads (
+    rowid INTEGER PRIMARY KEY,      -- posición de la fila en el CSV (1 = primera)
+    query TEXT, country TEXT, category TEXT, domain TEXT, homepage_url TEXT,
+    http_status TEXT, duration_ms TEXT, emails_all TEXT, email_best TEXT, phones TEXT,
+    priority TEXT, last_seen TEXT, email_sent TEXT,
+    country_name TEXT, sent INTEGER, day TEXT
+);
+CREATE INDEX IF NOT EXISTS leads_country ON leads(country_name, rowid);
+CREATE INDEX IF NOT EXISTS leads_category ON leads(category, rowid);
+CREATE INDEX IF NOT EXISTS leads_sent ON leads(sent, rowid);
+CREATE INDEX IF NOT EXISTS leads_day ON leads(day, rowid);
+CREATE VIRTUAL TABLE IF NOT EXISTS leads_fts USING fts5(domain, emails, content='', tokenize='trigram');
+"""
+CSV_COLUMNS = [
+    "query", "country", "category", "domain", "homepage_url", "http_status", "duration_ms",
+    "emails_all", "email_best", "phones", "priority", "last_seen", "email_sent",
+]
+
+
+def _head_hash(path, n):
+    with open(path, "rb") as fh:
+        return hashlib.sha1(fh.read(n)).hexdigest()
+
+
+def _iter_csv_records(fh):
+    """Registros crudos del CSV (una o más líneas si hay saltos dentro de comillas)."""
+    record = ""
+    for line in fh:
+        record += line
+        if record.count('"') % 2 == 0:
+            yield record
+            record = ""
+    if record:
+        yield record
+
+
+def rewrite_csv_column(path, column, updates):
+    """
+    Reescribe en streaming el CSV cambiando `column` en las filas {rowid: valor}. Solo se
+    vuelven a serializar esas filas; el resto se copia byte a byte. rowid = posición de la
+    fila, con la misma numeración que LeadStore.sync() (las líneas vacías no cuentan).
+    Se hace bajo el lock del CSV: ningún lote del crawler se cuela ni se pierde.
+    """
+    tmp = path + ".tmp"
+    with csv_lock(path):
+        with open(path, newline="", encoding="utf-8-sig") as src, \
+                open(tmp, "w", newline="", encoding="utf-8-sig") as dst:
+            records = _iter_csv_records(src)
+            header_raw = next(records, "")
+            dst.write(header_raw)
+            col = next(csv.reader([header_raw])).index(column)
+            writer = csv.writer(dst)
+            rowid = 0
+            for raw in records:
+                if not raw.strip():
+                    dst.write(raw)
+                    continue
+                rowid += 1 # misma numeración que sync()
+                if rowid not in updates:
+                    dst.write(raw)
+                    continue
+                values = next(csv.reader([raw]))
+                if col < len(values):
+                    values[col] = updates[rowid]
+                writer.writerow(values)
+        os.replace(tmp, path)
+
+
+class LeadStore:
+    """Espejo SQLite del CSV de leads con filtros, búsqueda y paginación por clave."""
+
+    def __init__(self, csv_path=OUTPUT_CSV, db_path=LEADS_DB_PATH):
+        self.csv_path = csv_path
+        self.db_path = db_path
+        d = os.path.dirname(db_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        self.con.row_factory = sqlite3.Row
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.executescript(SCHEMA)
+        self._facets = None # (total de filas, facetas)
+
+    def close(self):
+        self.con.close()
+
+    # --- Metadatos de sincronización ---
+    def _meta(self, key, default=None):
+        row = self.con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else default
+
+    def _set_meta(self, **values):
+        self.con.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                             [(k, str(v)) for k, v in values.items()])
+
+    def _reset(self):
+        self.con.execute("DELETE FROM leads")
+        self.con.execute("INSERT INTO leads_fts (leads_fts) VALUES ('delete-all')")
+        self.con.execute("DELETE FROM meta")
+
+    # --- Sincronización con el CSV ---
+    def sync(self):
+        """Incorpora las filas nuevas del CSV. Devuelve cuántas filas se añadieron."""
+        if not os.path.exists(self.csv_path):
+            with self.con:
+                self._reset()
+            return 0
+        # Tamaño leído bajo el lock compartido = frontera de lotes completos del sink
+        with csv_lock(self.csv_path, shared=True):
+            info = os.stat(self.csv_path)
+        size = info.st_size
+        offset = int(self._meta("offset", 0))
+        head_len = int(self._meta("head_len", 0))
+        replaced = (
+            size < offset
+            or self._meta("csv_path") != self.csv_path
+            # reescribir el CSV (os.replace) cambia el inodo; anexar no
+            or self._meta("inode", str(info.st_ino)) != str(info.st_ino)
+            or (head_len and _head_hash(self.csv_path, head_len) != self._meta("head_hash"))
+        )
+        if replaced:
+            with self.con:
+                self._reset()
+            offset = 0
+        if size == offset:
+            return 0
+
+        added = 0
+        with open(self.csv_path, "rb") as fh:
+            fh.seek(offset)
+            while offset < size:
+                data = fh.read(min(SYNC_BLOCK_BYTES, size - offset))
+                # Solo líneas completas; una fila a medio escribir queda para la próxima vez
+                end = data.rfind(b"\n") + 1
+                if end == 0:
+                    if len(data) < size - offset:
+                        data += fh.readline() # fila más larga que el bloque
+                        end = data.rfind(b"\n") + 1
+                    if end == 0:
+                        break
+                fh.seek(offset + end)
+                added += self._ingest(data[:end], offset)
+                offset += end
+        return added
+
+    def _ingest(self, data, offset):
+        """Inserta un bloque de líneas completas que empieza en `offset` del CSV."""
+        text = data.decode("utf-8-sig" if offset == 0 else "utf-8", errors="replace")
+        reader = csv.reader(io.StringIO(text, newline=""))
+        header = next(reader, None) if offset == 0 else self._meta("header", "").split(",")
+        columns = [c for c in (header or []) if c]
+        positions = {c: i for i, c in enumerate(columns)}
+
+        next_rowid = self.total() + 1
+        rows, fts = [], []
+        for values in reader:
+            if not values:
+                continue
+            rec = {c: (values[positions[c]] if c in positions and positions[c] < len(values) else "")
+                   for c in CSV_COLUMNS}
+            rows.append((
+                next_rowid, *(rec[c] for c in CSV_COLUMNS),
+                country_name(rec["country"]), int(is_email_sent(rec["email_sent"])), rec["last_seen"][:10],
+            ))
+            fts.append((next_rowid, rec["domain"], f"{rec['email_best']} {rec['emails_all']}"))
+            next_rowid += 1
+
+        # Cada bloque se confirma con su offset: una sincronización interrumpida se retoma
+        with self.con:
+            self.con.executemany(
+                f"INSERT INTO leads (rowid, {', '.join(CSV_COLUMNS)}, country_name, sent, day) "
+                f"VALUES ({', '.join('?' * (len(CSV_COLUMNS) + 4))})", rows
+            )
+            self.con.executemany("INSERT INTO leads_fts (rowid, domain, emails) VALUES (?, ?, ?)", fts)
+            new_offset = offset + len(data)
+            head_len = min(HEAD_BYTES, new_offset)
+            self._set_meta(
+                csv_path=self.csv_path, offset=new_offset, header=",".join(columns),
+                head_len=head_len, head_hash=_head_hash(self.csv_path, head_len),
+                inode=os.stat(self.csv_path).st_ino,
+            )
+        return len(rows)
+
+    # --- Consultas ---
+    def _where(self, lead_filter: LeadFilter = None, search: str = ""):
+        clauses, params = [], []
+        f = lead_filter or LeadFilter()
+        if f.country:
+            clauses.append("country_name = ?")
+            params.append(f.country)
+        if f.category:
+            clauses.append("category = ?")
+            params.append(f.category)
+        if f.email_sent is not None:
+            clauses.append("sent = ?")
+            params.append(int(f.email_sent))
+        if f.date_from:
+            clauses.append("day >= ?")
+            params.append(f.date_from.isoformat())
+        if f.date_to:
+            clauses.append("day <= ?")
+            params.append(f.date_to.isoformat())
+        search = (search or "").strip().lower()
+        if search:
+            if len(search) >= MIN_FTS_CHARS:
+                clauses.append("rowid IN (SELECT rowid FROM leads_fts WHERE leads_fts MATCH ?)")
+                params.append('"' + search.replace('"', '""') + '"')
+            else:
+                clauses.append("(domain LIKE ? OR email_best LIKE ? OR emails_all LIKE ?)")
+                params.extend([f"%{search}%"] * 3)
+        return clauses, params
+
+    def page(self, lead_filter=None, search="", before=None, limit=PAGE_SIZE):
+        """
+        Una página de leads, de más reciente a más antiguo. `before` es el cursor devuelto
+        por la página anterior (rowid); devuelve (filas, cursor_siguiente o None).
+        """
+        clauses, params = self._where(lead_filter, search)
+        if before is not None:
+            clauses.append("rowid < ?")
+            params.append(before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.con.execute(
+            f"SELECT rowid AS _rowid, * FROM leads {where} ORDER BY rowid DESC LIMIT ?", (*params, limit + 1)
+        ).fetchall()
+        rows = [dict(r) for r in rows]
+        next_cursor = rows[limit - 1]["_rowid"] if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def count(self, lead_filter=None, search=""):
+        clauses, params = self._where(lead_filter, search)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self.con.execute(f"SELECT COUNT(*) FROM leads {where}", params).fetchone()[0]
+
+    def total(self):
+        """Filas en el almacén (los rowid son consecutivos: no hace falta contar)."""
+        return self.con.execute("SELECT MAX(rowid) FROM leads").fetchone()[0] or 0
+
+    def facets(self):
+        """Valores disponibles para los filtros; se recalculan solo si entraron filas nuevas."""
+        total = self.total()
+        if self._facets is None or self._facets[0] != total:
+            self._facets = (total, self._compute_facets())
+        return self._facets[1]
+
+    def _compute_facets(self):
+        countries = [r[0] for r in self.con.execute(
+            "SELECT DISTINCT country_name FROM leads WHERE country_name != '' ORDER BY 1")]
+        categories = [r[0] for r in self.con.execute(
+            "SELECT DISTINCT category FROM leads WHERE category != '' ORDER BY 1")]
+        min_day = self.con.execute("SELECT MIN(day) FROM leads WHERE day != ''").fetchone()[0]
+        max_day = self.con.execute("SELECT MAX(day) FROM leads WHERE day != ''").fetchone()[0]
+        return {"countries": countries, "categories": categories, "min_day": min_day, "max_day": max_day}
+
+    # --- Edición ---
+    def set_email_sent(self, updates):
+        """
+        Marca/desmarca 'email enviado' ({rowid: bool}) en el espejo y en el CSV. El CSV se
+        reescribe fila a fila (sin cargarlo entero) y el espejo queda sincronizado con él.
+        """
+        if not updates:
+            return
+        # Todo bajo el lock: sin él, un lote anexado entre sync() y la reescritura no
+        # llegaría al espejo (_mark_rewritten lo daría por incorporado)
+        with csv_lock(self.csv_path):
+            self.sync()
+            rewrite_csv_column(self.csv_path, "email_sent", {k: "Sí" if v else "No" for k, v in updates.items()})
+            with self.con:
+                self.con.executemany(
+                    "UPDATE leads SET email_sent = ?, sent = ? WHERE rowid = ?",
+                    [("Sí" if v else "No", int(bool(v)), k) for k, v in updates.items()],
+                )
+                self._mark_rewritten()
+
+    def update_email_best(self, updates):
+        """
+        Aplica al espejo ({rowid: email}) el mejor email de un CSV que otro proceso acaba
+        de reescribir con esos mismos cambios (p. ej. email_rescore), sin reconstruirlo.
+        Llamar con el lock del CSV todavía tomado desde la reescritura.
+        """
+        with self.con:
+            self.con.executemany("UPDATE leads SET email_best = ? WHERE rowid = ?",
+                                 [(v, k) for k, v in updates.items()])
+            self._mark_rewritten()
+
+    def _mark_rewritten(self):
+        """El CSV se reescribió con el mismo contenido que el espejo: solo se actualiza la huella."""
+        size = os.path.getsize(self.csv_path)
+        head_len = min(HEAD_BYTES, size)
+        self._set_meta(offset=size, head_len=head_len, head_hash=_head_hash(self.csv_path, head_len),
+                       inode=os.stat(self.csv_path).st_ino)
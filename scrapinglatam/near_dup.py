@@ -0,0 +1,139 @@
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+from scrapinglatam.contact_extract import strip_skip_blocks
+
+# --- Páginas casi idénticas (SimHash) ---
+# Franquicias, webs hechas con la misma plantilla y la misma institución en varios
+# ccTLD sirven HTML casi igual. Cada página descargada se resume en una huella SimHash
+# de 64 bits sobre tríos de palabras de su texto visible; dos páginas cuyas huellas
+# difieren en pocos bits son casi la misma. El índice guarda las huellas recientes que
+# dieron emails y, ante una casi-duplicada con los mismos emails, el crawler reutiliza la
+# extracción anterior en vez de repetirla (el lead se escribe igual, con near_dup_of).
+#
+# La huella tiene que costar menos que la extracción que ahorra, así que:
+#   - los tríos se resumen con hash() de Python (C, sin hashlib) y solo se usa 1 de
+#     cada SAMPLE_RATE (el muestreo por valor del hash es el mismo en las dos páginas,
+#     así que las huellas siguen siendo comparables);
+#   - los 64 contadores se suman de golpe: SPREAD reparte cada trozo de 16 bits en
+#     carriles de 20 bits de un entero grande, y una suma de enteros avanza 16 carriles.
+# hash() cambia entre procesos (PYTHONHASHSEED): las huellas solo valen en memoria,
+# dentro del proceso que las calculó.
+#
+# Búsqueda: con max_distance = d, se parte la huella en d + 1 bandas; dos huellas a
+# distancia <= d coinciden por fuerza en alguna banda entera, así que basta mirar las
+# huellas que comparten banda con la nueva y contar bits solo de esas.
+
+SAMPLE_RATE = 4 # se usa 1 de cada N tríos de palabras
+MIN_FEATURES = 16 # páginas con menos tríos muestreados no tienen huella (demasiado cortas)
+MAX_DISTANCE = 3 # bits distintos como máximo para considerar dos páginas casi iguales
+INDEX_SIZE = 5000 # huellas recientes que se recuerdan (LRU)
+
+_TAG_RE = re.compile(r"<[^>]*>")
+_WORD_RE = re.compile(r"\w+")
+
+_LANE = 20 # bits por contador: hasta ~1M tríos por página sin desbordar al vecino
+_MASK64 = (1 << 64) - 1
+_SPREAD = None
+
+
+def _spread_table():
+    """v (16 bits) -> entero con el bit i de v en el carril i."""
+    global _SPREAD
+    if _SPREAD is None:
+        low = [sum(((v >> i) & 1) << (_LANE * i) for i in range(8)) for v in range(256)]
+        _SPREAD = [low[v & 0xFF] | low[v >> 8] << (_LANE * 8) for v in range(1 << 16)]
+    return _SPREAD
+
+
+def fingerprint(page, sample=SAMPLE_RATE):
+    """SimHash de 64 bits del texto visible de `page`, o None si es demasiado corto."""
+    text = _TAG_RE.sub(" ", strip_skip_blocks(page)).lower()
+    words = _WORD_RE.findall(text)
+    hashes = {h & _MASK64 for h in map(hash, zip(words, words[1:], words[2:])) if h % sample == 0}
+    if len(hashes) < MIN_FEATURES:
+        return None
+    spread = _spread_table()
+    lanes = 0
+    for h in hashes:
+        lanes += (spread[h & 0xFFFF] | spread[h >> 16 & 0xFFFF] << (_LANE * 16)
+                  | spread[h >> 32 & 0xFFFF] << (_LANE * 32) | spread[h >> 48] << (_LANE * 48))
+    # Bit a 1 si más de la mitad de los tríos lo tenían a 1
+    half = len(hashes) // 2
+    mask = (1 << _LANE) - 1
+    fp = 0
+    for bit in range(64):
+        if (lanes >> (_LANE * bit)) & mask > half:
+            fp |= 1 << bit
+    return fp
+
+
+def distance(a, b):
+    return (a ^ b).bit_count()
+
+
+class NearDupIndex:
+    """
+    Huellas recientes -> dato asociado (dominio, URL, contactos), con búsqueda por
+    distancia de Hamming. Seguro entre hilos: las búsquedas se hacen desde los hilos de
+    extracción. Se puede compartir entre rastreos del mismo proceso.
+    """
+
+    def __init__(self, capacity=INDEX_SIZE, max_distance=MAX_DISTANCE):
+        self.capacity = max(1, int(capacity))
+        self.max_distance = max(0, min(int(max_distance), 31))
+        bands = self.max_distance + 1
+        width = 64 // bands
+        # (desplazamiento, máscara) de cada banda; la última se queda con los bits sobrantes
+        self._bands = [(i * width, (1 << (width if i < bands - 1 else 64 - i * width)) - 1)
+                       for i in range(bands)]
+        self._entries = OrderedDict() # huella -> dato, de más antigua a más reciente
+        self._buckets = {} # (banda, valor) -> huellas con ese valor en esa banda
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _keys(self, fp):
+        return [(i, (fp >> shift) & mask) for i, (shift, mask) in enumerate(self._bands)]
+
+    def find(self, fp):
+        """(dato, distancia) de la huella guardada más cercana a `fp`, o None."""
+        best = None
+        with self._lock:
+            candidates = set()
+            for key in self._keys(fp):
+                candidates.update(self._buckets.get(key, ()))
+            for other in candidates:
+                d = distance(fp, other)
+                if d <= self.max_distance and (best is None or d < best[1]):
+                    best = (other, d)
+            if best is None:
+                return None
+            self._entries.move_to_end(best[0])
+            return self._entries[best[0]], best[1]
+
+    def add(self, fp, data):
+        with self._lock:
+            if fp in self._entries:
+                self._entries.move_to_end(fp)
+                self._entries[fp] = data
+                return
+            self._entries[fp] = data
+            for key in self._keys(fp):
+                self._buckets.setdefault(key, set()).add(fp)
+            while len(self._entries) > self.capacity:
+                old, _ = self._entries.popitem(last=False)
+                for key in self._keys(old):
+                    bucket = self._buckets.get(key)
+                    if bucket is not None:
+                        bucket.discard(old)
+                        if not bucket:
+                            del self._buckets[key]
@@ -0,0 +1,280 @@
+import os
+import sys
+import time
+import random
+import asyncio
+from urllib.parse import urlsplit
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+from scrapinglatam.fetchers import (
+    Fetcher, FetchError, ProxyError, HEADER_PROFILES, DEFAULT_HEADER_PROFILE, header_profile,
+)
+
+# --- Pool de salidas (proxies) con perfiles de cabeceras ---
+# Con una sola IP y un solo User-Agent, los rastreos grandes acaban frenados por
+# hostings y CDN (Timeout/Error con exclusion_flag='Y'). El pool reparte las visitas
+# entre varias salidas: proxies HTTP (http://[usuario:clave@]host:puerto) y, si se
+# incluye "direct", la IP propia. Cada salida lleva un perfil de cabeceras fijo (una
+# misma "identidad" por IP, como un navegador real) y un tope de peticiones
+# simultáneas; se elige la menos cargada.
+#
+# Salud: cada fallo atribuible a la salida (el proxy no conecta o rechaza el túnel,
+# 429 del sitio, timeout o error de red) suma un strike; un éxito los pone a cero. Con
+# max_failures strikes seguidos la salida se retira con enfriamiento exponencial. Al
+# terminar el enfriamiento, si hay health_url se comprueba con una petición a esa URL
+# a través de la salida; si no, vuelve a medias: el siguiente fallo la retira otra vez.
+# Un 407 (credenciales) la retira para siempre. Si no queda ninguna salida utilizable,
+# get() falla con ProxiesExhausted.
+#
+# Para probarlo sin proxies reales: python -m scrapinglatam.fetch_benchmark --proxies 4
+# levanta proxies locales de pega (y --bad-proxies, alguno que falla).
+
+DIRECT = "direct" # la IP propia, como una salida más del pool
+PROXY_CONCURRENCY = 4 # peticiones simultáneas por salida
+MAX_FAILURES = 3 # strikes seguidos para retirar una salida
+COOLDOWN_BASE = 30.0 # segundos del primer enfriamiento; se duplica en cada retirada
+COOLDOWN_MAX = 900.0
+HEALTH_INTERVAL = 5.0 # cada cuánto se revisan las salidas retiradas
+HEALTH_TIMEOUT = 10
+RETRIES = 1 # reintentos por otra salida si falla el proxy o el sitio responde 429
+
+# Estados HTTP del sitio que apuntan a la salida (límite por IP/UA)
+BLOCKED_STATUSES = (429,)
+# Estados con los que un proxy suele decir que no llegó al sitio: cuentan como fallo de
+# la salida, pero la respuesta se entrega tal cual (también puede ser el sitio)
+GATEWAY_STATUSES = (502, 503, 504)
+
+
+class ProxiesExhausted(FetchError):
+    """No queda ninguna salida utilizable en el pool."""
+
+
+def parse_proxies(value):
+    """Lista de proxies desde una lista o una cadena separada por comas (como SERPAPI_KEYS)."""
+    if isinstance(value, str):
+        value = value.split(",")
+    return list(dict.fromkeys(str(p).strip() for p in value or [] if str(p).strip()))
+
+
+def _label(url):
+    """host:puerto del proxy, sin credenciales (para logs y resúmenes)."""
+    if url is None:
+        return DIRECT
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port}" if parts.port else parts.hostname or url
+
+
+class Proxy:
+    __slots__ = ("url", "label", "profile", "headers", "active", "ok", "failed", "strikes",
+                 "cooldown_until", "evictions", "disabled", "probing")
+
+    def __init__(self, url, profile):
+        self.url = url               # None = salida directa
+        self.label = _label(url)
+        self.profile = profile
+        self.headers = header_profile(profile)
+        self.active = 0              # peticiones en curso
+        self.ok = 0
+        self.failed = 0
+        self.strikes = 0             # fallos seguidos
+        self.cooldown_until = 0.0    # retirada hasta este instante
+        self.evictions = 0           # retiradas seguidas (sin un éxito en medio)
+        self.disabled = ""           # "" | "auth"
+        self.probing = False
+
+
+class ProxyPool:
+    """Salidas compartibles entre rastreos del mismo proceso."""
+
+    def __init__(self, proxies, profiles=None, per_proxy=PROXY_CONCURRENCY, max_failures=MAX_FAILURES,
+                 health_url="", log=print):
+        urls = [None if p == DIRECT else p for p in parse_proxies(proxies)] or [None]
+        profiles = list(profiles or [DEFAULT_HEADER_PROFILE])
+        for name in profiles:
+            if name not in HEADER_PROFILES:
+                header_profile(name) # ValueError con los disponibles
+        # Perfiles en turno sobre las salidas: cada salida conserva el suyo
+        self.proxies = [Proxy(url, profiles[i % len(profiles)]) for i, url in enumerate(urls)]
+        self.per_proxy = max(1, int(per_proxy))
+        self.max_failures = max(1, int(max_failures))
+        self.health_url = health_url
+        self.log = log
+        self._changed = asyncio.Condition()
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def usable(self):
+        return [p for p in self.proxies if not p.disabled]
+
+    def exhausted(self) -> bool:
+        return not self.usable()
+
+    def _ready(self, now):
+        # Con health_url, una salida retirada no vuelve hasta pasar la comprobación
+        return [p for p in self.usable()
+                if p.active < self.per_proxy and not p.probing
+                and (p.cooldown_until == 0 if self.health_url else p.cooldown_until <= now)]
+
+    async def acquire(self, exclude=()) -> Proxy:
+        """Salida con hueco, la menos cargada; espera si todas están ocupadas o retiradas."""
+        async with self._changed:
+            while True:
+                usable = self.usable()
+                if not usable:
+                    raise ProxiesExhausted("no queda ningún proxy utilizable")
+                now = time.time()
+                ready = [p for p in self._ready(now) if p not in exclude] or self._ready(now)
+                if ready:
+                    proxy = min(ready, key=lambda p: (p.active, p.strikes, random.random()))
+                    proxy.active += 1
+                    return proxy
+                # Todas ocupadas: espera a una liberación; retiradas: al fin del enfriamiento
+                waits = [p.cooldown_until - now for p in usable if p.cooldown_until > now]
+                try:
+                    await asyncio.wait_for(self._changed.wait(), max(0.05, min(waits)) if waits else HEALTH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _evict(self, proxy, reason):
+        cooldown = min(COOLDOWN_MAX, COOLDOWN_BASE * (2 ** proxy.evictions)) * random.uniform(0.8, 1.2)
+        proxy.cooldown_until = time.time() + cooldown
+        proxy.evictions += 1
+        proxy.strikes = 0
+        self.log(f"[PROXY] {proxy.label} retirado {cooldown:.0f}s ({reason})")
+
+    def report(self, proxy, outcome, detail=""):
+        """Anota el resultado de una petición por `proxy`: ok | blocked | error | proxy | auth."""
+        if outcome == "ok":
+            proxy.ok += 1
+            proxy.strikes = 0
+            proxy.evictions = 0
+        elif outcome == "auth":
+            proxy.failed += 1
+            if not proxy.disabled:
+                proxy.disabled = "auth"
+                self.log(f"[PROXY] {proxy.label} retirado: pide credenciales (407)")
+        elif outcome in ("blocked", "error", "proxy"):
+            proxy.failed += 1
+            proxy.strikes += 1
+            # Tras un enfriamiento sin health_url la salida vuelve a medias: un fallo basta
+            half_open = proxy.evictions > 0 and not self.health_url
+            # Las peticiones que ya iban en curso al retirarla no la retiran otra vez
+            if (proxy.strikes >= self.max_failures or half_open) and proxy.cooldown_until <= time.time():
+                self._evict(proxy, detail or outcome)
+
+    async def release(self, proxy, outcome=None, detail=""):
+        """Devuelve el hueco de `proxy` y, si se indica, anota el resultado."""
+        if outcome:
+            self.report(proxy, outcome, detail)
+        async with self._changed:
+            proxy.active -= 1
+            self._changed.notify_all()
+
+    async def _probe(self, fetcher, proxy):
+        try:
+            status = (await fetcher.get(self.health_url, timeout=HEALTH_TIMEOUT,
+                                        proxy=proxy.url, headers=proxy.headers))[0]
+            outcome = classify_result(status)
+        except Exception as e:
+            outcome, status = "error", type(e).__name__
+        if outcome == "ok":
+            proxy.strikes = 0
+            proxy.cooldown_until = 0.0
+            self.log(f"[PROXY] {proxy.label} vuelve al pool (comprobación {status})")
+        elif outcome == "auth":
+            self.report(proxy, "auth")
+        else:
+            self._evict(proxy, f"comprobación fallida: {status}")
+        proxy.probing = False
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def health_loop(self, fetcher):
+        """Comprueba las salidas retiradas cuyo enfriamiento terminó (solo con health_url)."""
+        if not self.health_url:
+            return
+        while True:
+            now = time.time()
+            for proxy in self.usable():
+                if proxy.evictions and not proxy.probing and 0 < proxy.cooldown_until <= now:
+                    proxy.probing = True
+                    asyncio.create_task(self._probe(fetcher, proxy))
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    def summary(self):
+        now = time.time()
+        return ", ".join(
+            f"{p.label} [{p.profile}]: ok={p.ok} fallos={p.failed}"
+            + (f" ({p.disabled})" if p.disabled else " (retirado)" if p.cooldown_until > now else "")
+            for p in self.proxies
+        )
+
+
+def classify_result(status):
+    """Resultado de una respuesta del sitio desde el punto de vista de la salida."""
+    if status == 407:
+        return "auth"
+    if status in BLOCKED_STATUSES:
+        return "blocked"
+    if status in GATEWAY_STATUSES:
+        return "error"
+    return "ok"
+
+
+class ProxiedFetcher(Fetcher):
+    """
+    Fetcher que manda cada petición por una salida del pool con sus cabeceras. Envuelve
+    un fetcher de cualquier backend (que es quien hace la petición) y lo cierra al salir.
+    """
+
+    def __init__(self, inner: Fetcher, pool: ProxyPool):
+        super().__init__(verify_tls=inner.verify_tls, headers=pool.proxies[0].headers,
+                         timeout=inner.timeout, limit=inner.limit)
+        self.inner = inner
+        self.pool = pool
+        self.name = inner.name
+        self._health = None
+
+    async def get(self, url, timeout=None, proxy=None, headers=None):
+        tried = []
+        for attempt in range(RETRIES + 1):
+            chosen = await self.pool.acquire(exclude=tried)
+            tried.append(chosen)
+            outcome, detail = None, ""
+            try:
+                result = await self.inner.get(url, timeout=timeout, proxy=chosen.url,
+                                              headers=headers or chosen.headers)
+                outcome = classify_result(result.status)
+                detail = f"HTTP {result.status}"
+            except ProxyError as e:
+                outcome, detail = "proxy", str(e)
+                if attempt < RETRIES and len(self.pool) > 1:
+                    continue
+                raise
+            except asyncio.TimeoutError:
+                outcome, detail = "error", "timeout"
+                raise
+            except FetchError as e:
+                outcome, detail = "error", str(e)
+                raise
+            finally:
+                await self.pool.release(chosen, outcome, detail)
+            if outcome in ("blocked", "auth") and attempt < RETRIES and len(self.pool) > 1:
+                continue
+            return result
+
+    async def __aenter__(self):
+        if self.pool.health_url and self._health is None:
+            self._health = asyncio.create_task(self.pool.health_loop(self.inner))
+        return self
+
+    async def close(self):
+        if self._health is not None:
+            self._health.cancel()
+            await asyncio.gather(self._health, return_exceptions=True)
+            self._health = None
+        await self.inner.close()
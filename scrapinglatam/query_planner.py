@@ -0,0 +1,248 @@
+import os
+import re
+import csv
+import json
+from datetime import datetime
+
+from scrapinglatam.domains import normalize_domain
+
+# --- Planificador de consultas por rendimiento histórico ---
+# Cada celda (categoría, país) se puntúa con lo que ya produjo: dominios nuevos
+# y dominios con emails por crédito gastado en SerpAPI. La fuente es el log de
+# auditoría, el CSV de leads y el registro de consultas hechas (serpapi_done.json).
+
+PRIOR_WEIGHT = 2.0        # créditos "virtuales" que aporta la media global a cada celda
+MIN_FRESHNESS = 0.15      # fracción mínima de resultados nuevos al repetir una consulta
+DEFAULT_LEAD_RATE = 1.0   # leads por crédito cuando no existe ningún historial
+
+
+def query_permutations(countries, categories):
+    """Producto país x categoría con el formato de consulta del crawler."""
+    queries = []
+    for country in countries:
+        for category in categories:
+            queries.append(f"{category} {country}")
+    return queries
+
+
+def parse_query_cell(query: str):
+    """
+    Devuelve (categoria, pais) normalizados para un query.
+    Acepta el formato actual ('universidad site:.cl') y el antiguo del registro
+    ('site:.ar "universidad" (contacto OR ...)').
+    """
+    country = ""
+    m = re.search(r"site:\.([a-z.]+)", query, re.IGNORECASE)
+    if m:
+        country = m.group(1).lower()
+    quoted = re.search(r'"([^"]+)"', query)
+    if quoted:
+        category = quoted.group(1)
+    else:
+        category = re.sub(r"site:\.\S+", "", query)
+    category = re.sub(r"\s+", " ", category).strip().lower()
+    return category, country
+
+
+def _normalize_domain(domain: str) -> str:
+    return normalize_domain(domain) or (domain or "").strip().lower()
+
+
+def load_serp_history(path):
+    """Carga el registro de consultas ya hechas (formato version 2)."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            data = json.load(fh)
+        queries = data.get("queries", {}) if isinstance(data, dict) else {}
+        return queries if isinstance(queries, dict) else {}
+    except Exception as e:
+        print(f"[PLAN] No se pudo leer {path}: {e}")
+        return {}
+
+
+def load_history(audit_path, csv_path, serp_done_path):
+    """
+    Agrega el historial por celda. Devuelve un dict serializable:
+    {"cells": {"cat|pais": {...}}, "seen": [dominios con lead]}
+    """
+    # Resultado de cada dominio en la auditoría (el último evento manda)
+    audit_has_emails = {}
+    if os.path.exists(audit_path):
+        try:
+            with open(audit_path, "r", encoding="utf-8") as fh:
+                for ln in fh:
+                    try:
+                        ev = json.loads(ln)
+                    except Exception:
+                        continue
+                    d = _normalize_domain(ev.get("domain"))
+                    if d:
+                        audit_has_emails[d] = bool(ev.get("emails_found"))
+        except Exception as e:
+            print(f"[PLAN] Error leyendo auditoría: {e}")
+
+    cells = {}
+
+    def cell_for(category, country):
+        key = f"{category}|{country}"
+        if key not in cells:
+            cells[key] = {"credits": 0, "searches": 0, "domains": set(), "leads": set(),
+                          "queries": set(), "last_domains": []}
+        return cells[key]
+
+    # Consultas registradas: cada entrada es al menos un crédito gastado
+    for query, entry in load_serp_history(serp_done_path).items():
+        if not isinstance(entry, dict):
+            continue
+        category, country = parse_query_cell(query)
+        c = cell_for(category, country)
+        c["credits"] += int(entry.get("pages", 1) or 1)
+        c["searches"] += 1
+        domains = [_normalize_domain(d) for d in entry.get("domains", []) if d]
+        c["domains"].update(domains)
+        c["leads"].update(d for d in domains if audit_has_emails.get(d))
+        c["last_domains"] = domains
+
+    # Leads guardados en el CSV
+    seen = set()
+    if os.path.exists(csv_path):
+        try:
+            with open(csv_path, newline="", encoding="utf-8-sig") as fh:
+                for row in csv.DictReader(fh):
+                    d = _normalize_domain(row.get("domain"))
+                    if not d:
+                        continue
+                    seen.add(d)
+                    query = row.get("query") or ""
+                    category = (row.get("category") or "").strip().lower()
+                    country = (row.get("country") or "").strip().lower()
+                    if not category or not country:
+                        category, country = parse_query_cell(query)
+                    c = cell_for(category, country)
+                    c["domains"].add(d)
+                    c["leads"].add(d)
+                    if query:
+                        c["queries"].add(query)
+        except Exception as e:
+            print(f"[PLAN] Error leyendo {csv_path}: {e}")
+
+    out = {}
+    for key, c in cells.items():
+        out[key] = {
+            # Un query distinto en el CSV también implica un crédito gastado
+            "credits": max(c["credits"], len(c["queries"])),
+            "domains": len(c["domains"]),
+            "leads": len(c["leads"]),
+            # Páginas medias por búsqueda (la paginación corta antes en celdas saturadas)
+            "avg_pages": c["credits"] / c["searches"] if c["searches"] else 0,
+            "last_domains": c["last_domains"],
+        }
+    return {"cells": out, "seen": sorted(seen)}
+
+
+def _rate(num, den, prior):
+    return (num + PRIOR_WEIGHT * prior) / (den + PRIOR_WEIGHT)
+
+
+def score_queries(queries, history, pages_per_query=1):
+    """
+    Estima coste y leads esperados de cada query según el historial.
+    pages_per_query es el máximo de páginas; las celdas con historial usan su media.
+    """
+    cells = history.get("cells", {})
+    seen = set(history.get("seen", []))
+
+    tot_credits = sum(c["credits"] for c in cells.values())
+    tot_leads = sum(c["leads"] for c in cells.values())
+    tot_domains = sum(c["domains"] for c in cells.values())
+    global_lead_rate = tot_leads / tot_credits if tot_credits else DEFAULT_LEAD_RATE
+    global_domain_rate = tot_domains / tot_credits if tot_credits else DEFAULT_LEAD_RATE
+
+    # Priors por categoría y por país para celdas nunca consultadas
+    by_cat, by_country = {}, {}
+    for key, c in cells.items():
+        category, country = key.split("|", 1)
+        for agg, k in ((by_cat, category), (by_country, country)):
+            a = agg.setdefault(k, [0, 0])
+            a[0] += c["leads"]
+            a[1] += c["credits"]
+
+    scored = []
+    for idx, query in enumerate(queries):
+        category, country = parse_query_cell(query)
+        c = cells.get(f"{category}|{country}")
+
+        priors = []
+        for agg, k in ((by_cat, category), (by_country, country)):
+            if k in agg and agg[k][1]:
+                priors.append(_rate(agg[k][0], agg[k][1], global_lead_rate))
+        prior = sum(priors) / len(priors) if priors else global_lead_rate
+
+        if c and c["credits"]:
+            lead_rate = _rate(c["leads"], c["credits"], prior)
+            domain_rate = _rate(c["domains"], c["credits"], global_domain_rate)
+            # Repetir la misma consulta devuelve casi los mismos dominios
+            last = c["last_domains"]
+            if last:
+                fresh = sum(1 for d in last if d not in seen) / len(last)
+            else:
+                fresh = 0.0
+            freshness = max(MIN_FRESHNESS, fresh)
+        else:
+            lead_rate = prior
+            domain_rate = global_domain_rate
+            freshness = 1.0
+
+        cost = max(1, int(pages_per_query))
+        if c and c.get("avg_pages"):
+            cost = max(1, min(cost, round(c["avg_pages"])))
+        scored.append({
+            "query": query,
+            "category": category,
+            "country": country,
+            "cost": cost,
+            "expected_leads": lead_rate * freshness * cost,
+            "expected_domains": domain_rate * freshness * cost,
+            "history_credits": c["credits"] if c else 0,
+            "history_leads": c["leads"] if c else 0,
+            "_order": idx,
+        })
+    return scored
+
+
+def plan_queries(queries, history, max_queries, credit_budget=0, pages_per_query=1):
+    """
+    Ordena las consultas por leads esperados por crédito y corta el plan
+    al presupuesto. credit_budget <= 0 significa sin límite adicional.
+    """
+    scored = score_queries(queries, history, pages_per_query)
+
+    # A igual rendimiento se intercalan países (categoría i en todos los países, luego i+1)
+    n_countries = len({s["country"] for s in scored}) or 1
+    for s in scored:
+        s["_tiebreak"] = (s["_order"] % max(1, len(scored) // n_countries), s["_order"])
+    scored.sort(key=lambda s: (-s["expected_leads"] / s["cost"], s["_tiebreak"]))
+
+    plan, credits = [], 0
+    for s in scored:
+        if len(plan) >= max_queries:
+            break
+        if credit_budget and credits + s["cost"] > credit_budget:
+            continue
+        plan.append(s)
+        credits += s["cost"]
+
+    for s in plan:
+        s.pop("_order", None)
+        s.pop("_tiebreak", None)
+
+    return {
+        "queries": plan,
+        "credits": credits,
+        "expected_leads": sum(s["expected_leads"] for s in plan),
+        "expected_domains": sum(s["expected_domains"] for s in plan),
+        "candidates": len(scored),
+        "generated_at": datetime.now().isoformat(),
+    }
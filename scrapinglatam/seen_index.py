@@ -0,0 +1,243 @@
+import os
+import mmap
+import time
+import struct
+import hashlib
+
+from scrapinglatam.lead_sink import csv_lock
+
+# --- Índice compacto de dominios vistos ---
+# Archivo binario: cabecera + registros de 12 bytes (hash de 64 bits del dominio,
+# timestamp de 32 bits). Los primeros `sorted_count` registros están ordenados por
+# hash y se consultan con búsqueda binaria sobre un mmap; lo que viene detrás es la
+# cola de altas incrementales (se carga en memoria y se funde al superar un umbral).
+# Con millones de dominios ocupa ~12 MB por millón y abre sin reconstruir nada.
+#
+# Varios procesos pueden compartir el índice (crawler de línea de comandos y worker):
+# altas y compactación van bajo un flock sobre <índice>.lock, y cada proceso comprueba
+# antes de leer o anexar si el archivo cambió. Si cambió de inodo (otro lo compactó) se
+# reabre; si solo creció, lee los registros que anexaron los demás. Las altas lo
+# comprueban siempre; las consultas (una por resultado SERP) como mucho cada
+# REFRESH_SECONDS, para no hacer un stat() por dominio.
+
+MAGIC = b"SDIX"
+VERSION = 1
+HEADER = struct.Struct("<4sIQ")   # magic, versión, registros ordenados
+RECORD = struct.Struct("<QI")     # hash del dominio, timestamp (segundos)
+MIN_TAIL_TO_COMPACT = 4096
+REFRESH_SECONDS = 1.0 # antigüedad máxima de lo que get() sabe de otros procesos
+
+
+def domain_hash(domain: str) -> int:
+    digest = hashlib.blake2b(domain.lower().encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _ts32(ts) -> int:
+    return max(0, min(0xFFFFFFFF, int(ts)))
+
+
+def write_index(path, items):
+    """Escribe un índice ordenado desde pares (dominio, timestamp); gana el más reciente."""
+    latest = {}
+    for domain, ts in items:
+        h = domain_hash(domain)
+        ts = _ts32(ts)
+        if ts >= latest.get(h, -1):
+            latest[h] = ts
+    records = sorted(latest.items())
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as out:
+        out.write(HEADER.pack(MAGIC, VERSION, len(records)))
+        out.write(b"".join(RECORD.pack(h, ts) for h, ts in records))
+    os.replace(tmp, path)
+
+
+class SeenDomainIndex:
+    """Mapa dominio -> último timestamp, persistente y de solo anexado."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = None        # archivo para anexar
+        self._mm = None        # mmap de la zona ordenada
+        self._map_fh = None
+        self.sorted_count = 0
+        self.tail = {}         # hash -> ts de los registros sin ordenar
+        self._ino = None       # inodo abierto (cambia si otro proceso compacta)
+        self._size = 0         # bytes del archivo ya leídos o escritos por este proceso
+        self._checked_at = 0.0 # última comprobación del archivo (time.monotonic)
+        with csv_lock(self.path):
+            self._open()
+
+    # --- Apertura / cierre ---
+    def _open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER.size:
+            write_index(self.path, [])
+
+        size = os.path.getsize(self.path)
+        with open(self.path, "rb") as fh:
+            magic, version, sorted_count = HEADER.unpack(fh.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"Índice de dominios con formato desconocido: {self.path}")
+            self.sorted_count = sorted_count
+            # La cola se lee entera; un registro a medias (corte durante escritura) se descarta
+            tail_start = HEADER.size + sorted_count * RECORD.size
+            n_tail = (size - tail_start) // RECORD.size
+            fh.seek(tail_start)
+            data = fh.read(n_tail * RECORD.size)
+        self.tail = {}
+        for h, ts in RECORD.iter_unpack(data):
+            self.tail[h] = ts
+
+        valid_size = HEADER.size + (self.sorted_count + n_tail) * RECORD.size
+        if valid_size != size:
+            with open(self.path, "r+b") as fh:
+                fh.truncate(valid_size)
+
+        if self.sorted_count:
+            self._map_fh = open(self.path, "rb")
+            self._mm = mmap.mmap(self._map_fh.fileno(), HEADER.size + self.sorted_count * RECORD.size,
+                                 access=mmap.ACCESS_READ)
+        self._fh = open(self.path, "ab")
+        self._ino = os.fstat(self._fh.fileno()).st_ino
+        self._size = valid_size
+        self._checked_at = time.monotonic()
+
+    def _refresh(self, max_age=0.0):
+        """
+        Se pone al día con lo que otros procesos hicieron en el archivo; con `max_age`,
+        solo si la última comprobación es más antigua.
+        """
+        now = time.monotonic()
+        if max_age and now - self._checked_at < max_age:
+            return
+        self._checked_at = now
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        if st is None or st.st_ino != self._ino:
+            with csv_lock(self.path):
+                self.close()
+                self._open()
+            return
+        n_new = (st.st_size - self._size) // RECORD.size
+        if n_new > 0:
+            with open(self.path, "rb") as fh:
+                fh.seek(self._size)
+                data = fh.read(n_new * RECORD.size)
+            for h, ts in RECORD.iter_unpack(data):
+                self.tail[h] = ts
+            self._size += len(data)
+
+    def close(self):
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._map_fh:
+            self._map_fh.close()
+            self._map_fh = None
+
+    def __len__(self):
+        # Aproximado: los hashes de la cola que ya están en la zona ordenada cuentan doble
+        return self.sorted_count + len(self.tail)
+
+    # --- Lectura ---
+    def _sorted_lookup(self, h):
+        lo, hi = 0, self.sorted_count
+        mm = self._mm
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mh, ts = RECORD.unpack_from(mm, HEADER.size + mid * RECORD.size)
+            if mh < h:
+                lo = mid + 1
+            elif mh > h:
+                hi = mid
+            else:
+                return ts
+        return None
+
+    def get(self, domain: str):
+        """Timestamp de la última vez que se procesó el dominio, o None."""
+        h = domain_hash(domain)
+        self._refresh(REFRESH_SECONDS)
+        ts = self.tail.get(h)
+        if ts is not None:
+            return ts
+        if self._mm is None:
+            return None
+        return self._sorted_lookup(h)
+
+    def __contains__(self, domain):
+        return self.get(domain) is not None
+
+    # --- Escritura ---
+    def add(self, domain: str, ts):
+        """Anexa (o actualiza) un dominio sin reescribir el índice."""
+        h = domain_hash(domain)
+        ts = _ts32(ts)
+        with csv_lock(self.path):
+            # Nunca anexar a un inodo que otro proceso ya reemplazó
+            self._refresh()
+            self.tail[h] = ts
+            self._fh.write(RECORD.pack(h, ts))
+            self._fh.flush()
+            self._size += RECORD.size
+            if len(self.tail) > max(MIN_TAIL_TO_COMPACT, self.sorted_count // 8):
+                self.compact()
+
+    def _iter_sorted(self):
+        for i in range(self.sorted_count):
+            yield RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size)
+
+    def compact(self):
+        """Funde la cola en la zona ordenada (merge lineal, sin cargar el índice en memoria)."""
+        with csv_lock(self.path):
+            # La cola del disco incluye las altas de otros procesos: se relee antes de fundir
+            self.close()
+            self._open()
+            self._compact()
+
+    def _compact(self):
+        tail = sorted(self.tail.items())
+        base = self._iter_sorted() if self._mm is not None else iter(())
+        tmp = self.path + ".tmp"
+        count = 0
+        with open(tmp, "wb") as out:
+            out.write(HEADER.pack(MAGIC, VERSION, 0))
+            buf = []
+            i = 0
+            for h, ts in base:
+                while i < len(tail) and tail[i][0] < h:
+                    buf.append(RECORD.pack(*tail[i]))
+                    i += 1
+                if i < len(tail) and tail[i][0] == h:
+                    ts = tail[i][1]
+                    i += 1
+                buf.append(RECORD.pack(h, ts))
+                if len(buf) >= 65536:
+                    out.write(b"".join(buf))
+                    count += len(buf)
+                    buf = []
+            for rec in tail[i:]:
+                buf.append(RECORD.pack(*rec))
+            out.write(b"".join(buf))
+            count += len(buf)
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, VERSION, count))
+        self.close()
+        os.replace(tmp, self.path)
+        self._open()
+
+    @classmethod
+    def build(cls, path, items):
+        """Crea el índice desde cero a partir de pares (dominio, timestamp)."""
+        with csv_lock(path):
+            write_index(path, items)
+        return cls(path)
@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import random
+import asyncio
+from collections import deque
+
+from serpapi import GoogleSearch
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+from scrapinglatam.credit_ledger import key_fingerprint, fetch_account_info
+
+# --- Pool de API keys de SerpAPI ---
+# Varias keys (SERPAPI_KEY + SERPAPI_KEYS) repartidas por "menos usada" o en turno
+# rotativo. Cada key tiene su límite de ritmo (ventana deslizante: el configurado por
+# minuto o, si no, el límite por hora que declara la cuenta), su saldo en vivo (leído
+# del endpoint de cuenta al empezar y descontado con cada búsqueda correcta) y un
+# enfriamiento exponencial tras un 429. Una key sin búsquedas o inválida se retira del
+# pool y las consultas siguen con las demás; los 5xx y errores de red se reintentan.
+
+BACKOFF_BASE = 2.0 # segundos; se duplica en cada reintento
+BACKOFF_MAX = 60.0
+PRIME_TTL_SECONDS = 600 # cada cuánto se vuelve a leer el saldo de las cuentas
+
+STRATEGIES = ("least_used", "round_robin")
+
+# Mensajes de SerpAPI que significan "esta key ya no tiene búsquedas"
+EXHAUSTED_MARKERS = ("run out of searches", "searches for the month", "plan searches left")
+INVALID_MARKERS = ("invalid api key",)
+
+
+class KeysExhausted(Exception):
+    """No queda ninguna key utilizable en el pool."""
+
+
+def serpapi_search(params, timeout=60):
+    """Búsqueda síncrona: (estado HTTP, dict). El cliente oficial no expone el estado en get_dict()."""
+    client = GoogleSearch(params)
+    client.timeout = timeout
+    resp = client.get_response()
+    try:
+        data = resp.json()
+    except ValueError:
+        data = {"error": resp.text[:200] or f"HTTP {resp.status_code}"}
+    return resp.status_code, data
+
+
+def is_cached(data):
+    """True si SerpAPI sirvió la respuesta desde su caché (gratis: no gasta búsqueda)."""
+    meta = (data or {}).get("search_metadata") or {}
+    return bool(meta.get("cached")) or str(meta.get("status", "")).lower() == "cached"
+
+
+def classify_response(status, error):
+    """ok | empty | exhausted | invalid | rate_limited | retry | error"""
+    low = (error or "").lower()
+    if status == 200 and not error:
+        return "ok"
+    if status == 401 or any(m in low for m in INVALID_MARKERS):
+        return "invalid"
+    if any(m in low for m in EXHAUSTED_MARKERS):
+        return "exhausted"
+    if status == 429:
+        return "rate_limited"
+    if status is None or status >= 500:
+        return "retry"
+    if status == 200:
+        return "empty" # p. ej. "Google hasn't returned any results for this query."
+    return "error"
+
+
+def backoff_seconds(attempt):
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.8, 1.2)
+
+
+class SerpKey:
+    __slots__ = ("api_key", "fingerprint", "used", "remaining", "window", "calls",
+                 "cooldown_until", "strikes", "disabled")
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.fingerprint = key_fingerprint(api_key)
+        self.used = 0              # búsquedas correctas en este proceso
+        self.remaining = None      # saldo en vivo (None = desconocido)
+        self.window = None         # (máx. llamadas, segundos) o None = sin límite
+        self.calls = deque()       # instantes de las últimas llamadas dentro de la ventana
+        self.cooldown_until = 0.0
+        self.strikes = 0           # 429 seguidos
+        self.disabled = ""         # "" | "exhausted" | "invalid"
+
+    def available_at(self, now):
+        """Instante a partir del cual la key puede usarse (respetando ritmo y enfriamiento)."""
+        at = self.cooldown_until
+        if self.window:
+            limit, seconds = self.window
+            while self.calls and self.calls[0] <= now - seconds:
+                self.calls.popleft()
+            if len(self.calls) >= limit:
+                at = max(at, self.calls[0] + seconds)
+        return at
+
+
+class SerpKeyPool:
+    """Keys de SerpAPI compartibles entre rastreos del mismo proceso."""
+
+    def __init__(self, api_keys, rate_per_minute=0, strategy="least_used"):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Estrategia de keys desconocida: {strategy} (disponibles: {', '.join(STRATEGIES)})")
+        self.keys = [SerpKey(k) for k in dict.fromkeys(k.strip() for k in api_keys if k and k.strip())]
+        self.rate_per_minute = rate_per_minute
+        self.strategy = strategy
+        self._turn = 0
+        self._primed_at = 0.0
+        for key in self.keys:
+            if rate_per_minute and rate_per_minute > 0:
+                key.window = (max(1, int(rate_per_minute)), 60.0)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def usable(self):
+        return [k for k in self.keys if not k.disabled]
+
+    def exhausted(self) -> bool:
+        return not self.usable()
+
+    async def prime(self, log=print):
+        """Lee saldo y límite por hora de cada cuenta (endpoint gratuito); tolera fallos."""
+        if time.time() - self._primed_at < PRIME_TTL_SECONDS:
+            return
+        self._primed_at = time.time()
+        for key in self.usable():
+            try:
+                info = await asyncio.to_thread(fetch_account_info, key.api_key)
+            except Exception as e:
+                log(f"[KEYS] {key.fingerprint}: no se pudo leer el saldo ({e})")
+                continue
+            if info.get("error"):
+                if any(m in info["error"].lower() for m in INVALID_MARKERS):
+                    key.disabled = "invalid"
+                log(f"[KEYS] {key.fingerprint}: {info['error']}")
+                continue
+            left = info.get("plan_searches_left", info.get("total_searches_left"))
+            if left is not None:
+                key.remaining = int(left)
+                if key.remaining <= 0:
+                    key.disabled = "exhausted"
+            per_hour = info.get("account_rate_limit_per_hour")
+            if key.window is None and per_hour:
+                key.window = (int(per_hour), 3600.0)
+            log(f"[KEYS] {key.fingerprint}: {key.remaining if key.remaining is not None else '?'} búsquedas disponibles"
+                + (f", {per_hour}/h" if per_hour else ""))
+
+    def _pick(self, ready):
+        if self.strategy == "round_robin":
+            for i in range(len(self.keys)):
+                key = self.keys[(self._turn + i) % len(self.keys)]
+                if key in ready:
+                    self._turn = (self.keys.index(key) + 1) % len(self.keys)
+                    return key
+        # least_used: la que menos ha gastado aquí; a igualdad, la de más saldo
+        return min(ready, key=lambda k: (k.used, -(k.remaining if k.remaining is not None else 1 << 30)))
+
+    async def acquire(self) -> SerpKey:
+        """Key lista para una búsqueda; espera si todas están en su límite de ritmo."""
+        while True:
+            usable = self.usable()
+            if not usable:
+                raise KeysExhausted()
+            now = time.time()
+            ready = [k for k in usable if k.available_at(now) <= now]
+            if ready:
+                key = self._pick(ready)
+                if key.window:
+                    key.calls.append(now)
+                return key
+            await asyncio.sleep(max(0.05, min(k.available_at(now) for k in usable) - now))
+
+    def report(self, key, status, error=None, cached=False) -> str:
+        """Anota el resultado de una llamada con `key` y devuelve su clasificación."""
+        outcome = classify_response(status, error)
+        if outcome in ("ok", "empty"):
+            key.strikes = 0
+        if outcome == "ok" and not cached: # las respuestas de caché no descuentan saldo
+            key.used += 1
+            if key.remaining is not None:
+                key.remaining -= 1
+                if key.remaining <= 0:
+                    key.disabled = "exhausted"
+        elif outcome in ("exhausted", "invalid"):
+            key.disabled = outcome
+        elif outcome == "rate_limited":
+            key.cooldown_until = time.time() + backoff_seconds(key.strikes)
+            key.strikes += 1
+        return outcome
+
+    def summary(self):
+        return ", ".join(
+            f"{k.fingerprint}: usadas={k.used} restantes={k.remaining if k.remaining is not None else '?'}"
+            + (f" ({k.disabled})" if k.disabled else "")
+            for k in self.keys
+        )
@@ -0,0 +1,316 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+
+# --- Directorio base del proyecto ---
+BASE_DIR = os.getcwd()
+sys.path.append(BASE_DIR)
+
+from scrapinglatam.domains import normalize_domain
+
+# --- Cola de trabajo distribuida (varios nodos, un archivo compartido) ---
+# Una campaña se reparte en elementos de dos clases: "query" (una búsqueda SerpAPI con
+# su paginación) y "url" (una web a visitar). Los nodos los toman en préstamo (lease)
+# con caducidad: mientras trabajan renuevan el préstamo con un latido, y si un nodo
+# muere sus elementos caducan y vuelven a "pending" para otro (hasta MAX_ATTEMPTS).
+# Las URLs se deduplican por dominio dentro de la campaña y contra los leads ya
+# guardados; los leads van a una tabla compartida con el dominio como clave, así que
+# dos nodos nunca guardan el mismo dominio.
+#
+# Es un SQLite en un volumen compartido. El modo WAL necesita memoria compartida entre
+# procesos de la misma máquina, así que por defecto se usa el diario clásico (DELETE),
+# que solo depende del bloqueo de archivos del sistema de ficheros (NFS con bloqueo,
+# SMB, discos compartidos). Con todos los nodos en la misma máquina puede usarse WAL.
+
+DEFAULT_LEASE_SECONDS = 120
+MAX_ATTEMPTS = 3 # préstamos caducados o fallos antes de marcar un elemento "failed"
+KINDS = ("query", "url")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    config_json TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    campaign_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,             -- query | url
+    key TEXT NOT NULL,              -- la query o el dominio de la URL (clave de deduplicación)
+    payload_json TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending', -- pending | leased | done | failed
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result_json TEXT,
+    updated_at REAL NOT NULL,
+    UNIQUE (campaign_id, kind, key)
+);
+CREATE INDEX IF NOT EXISTS items_pending ON items(campaign_id, status, kind, priority, id);
+CREATE INDEX IF NOT EXISTS items_lease ON items(status, lease_expires);
+CREATE TABLE IF NOT EXISTS leads (
+    domain TEXT PRIMARY KEY,
+    campaign_id INTEGER NOT NULL,
+    node TEXT NOT NULL,
+    row_json TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leads_campaign ON leads(campaign_id, created_at);
+CREATE TABLE IF NOT EXISTS nodes (
+    node TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    started_at REAL,
+    heartbeat REAL
+);
+"""
+
+
+def default_node_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """Acceso a la cola compartida. Cada llamada abre su conexión (como JobQueue)."""
+
+    def __init__(self, path, journal_mode="DELETE", max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.journal_mode = journal_mode
+        self.max_attempts = max_attempts
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with self._connect() as con:
+            con.executescript(SCHEMA)
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        con.execute("PRAGMA busy_timeout=30000")
+        return con
+
+    def _write(self, fn):
+        """Ejecuta fn(con) en una transacción de escritura (BEGIN IMMEDIATE)."""
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            result = fn(con)
+            con.execute("COMMIT")
+            return result
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+    # --- Campañas ---
+    def create_campaign(self, name, config: dict, queries) -> int:
+        """Crea la campaña con sus queries en orden de plan (la primera, la más prioritaria)."""
+        now = time.time()
+
+        def create(con):
+            cur = con.execute("INSERT INTO campaigns (name, config_json, created_at) VALUES (?, ?, ?)",
+                              (name, json.dumps(config, ensure_ascii=False), now))
+            campaign_id = cur.lastrowid
+            con.executemany(
+                "INSERT OR IGNORE INTO items (campaign_id, kind, key, payload_json, priority, updated_at) "
+                "VALUES (?, 'query', ?, ?, ?, ?)",
+                [(campaign_id, q, json.dumps({"query": q}, ensure_ascii=False), i, now) for i, q in enumerate(queries)],
+            )
+            return campaign_id
+        return self._write(create)
+
+    def campaign(self, campaign_id):
+        with self._connect() as con:
+            row = con.execute("SELECT * FROM campaigns WHERE id = ?", (campaign_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(row, config=json.loads(row["config_json"]))
+
+    def list_campaigns(self):
+        with self._connect() as con:
+            rows = con.execute("SELECT id, name, created_at FROM campaigns ORDER BY id DESC").fetchall()
+        return [dict(r) for r in rows]
+
+    # --- Elementos ---
+    def _add_urls(self, con, campaign_id, query, results) -> int:
+        """
+        Encola las URLs de una query (dicts con link/position). Un dominio ya encolado en
+        la campaña o ya guardado como lead no se vuelve a encolar. Devuelve las nuevas.
+        """
+        now = time.time()
+        rows = []
+        for r in results:
+            domain = normalize_domain(r.get("link"))
+            if domain:
+                payload = {"query": query, "url": r["link"], "priority": r.get("position")}
+                rows.append((campaign_id, domain, json.dumps(payload, ensure_ascii=False),
+                             int(r.get("position") or 0), now, domain))
+        before = con.total_changes
+        con.executemany(
+            "INSERT OR IGNORE INTO items (campaign_id, kind, key, payload_json, priority, updated_at) "
+            "SELECT ?, 'url', ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM leads WHERE domain = ?)",
+            rows,
+        )
+        return con.total_changes - before
+
+    def lease(self, campaign_id, node, n=1, lease_seconds=DEFAULT_LEASE_SECONDS, kinds=KINDS):
+        """
+        Presta hasta `n` elementos pendientes de las clases `kinds` a `node` (primero URLs,
+        para vaciar lo ya descubierto antes de gastar créditos en más queries). Antes
+        devuelve a la cola los préstamos caducados.
+        """
+        now = time.time()
+        kinds = [k for k in kinds if k in KINDS]
+
+        def take(con):
+            self._expire(con, now)
+            rows = con.execute(
+                "SELECT id, campaign_id, kind, key, payload_json, attempts FROM items "
+                f"WHERE campaign_id = ? AND status = 'pending' AND kind IN ({','.join('?' * len(kinds))}) "
+                "ORDER BY CASE kind WHEN 'url' THEN 0 ELSE 1 END, priority, id LIMIT ?",
+                (campaign_id, *kinds, n),
+            ).fetchall()
+            con.executemany(
+                "UPDATE items SET status = 'leased', lease_owner = ?, lease_expires = ?, updated_at = ? WHERE id = ?",
+                [(node, now + lease_seconds, now, r["id"]) for r in rows],
+            )
+            return [dict(id=r["id"], campaign_id=r["campaign_id"], kind=r["kind"], key=r["key"],
+                         attempts=r["attempts"], **json.loads(r["payload_json"])) for r in rows]
+        return self._write(take) if kinds else []
+
+    def _expire(self, con, now):
+        """Préstamos caducados (nodo muerto o colgado): otra vez a la cola, o 'failed'."""
+        con.execute(
+            "UPDATE items SET status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END, "
+            "attempts = attempts + 1, error = 'lease expired (' || lease_owner || ')', "
+            "lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE status = 'leased' AND lease_expires < ?",
+            (self.max_attempts, now, now),
+        )
+
+    def renew(self, node, item_ids, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Alarga los préstamos de `node`; devuelve los ids que ya no son suyos."""
+        if not item_ids:
+            return set()
+        now = time.time()
+        ids = list(item_ids)
+
+        def renew(con):
+            marks = ",".join("?" * len(ids))
+            con.execute(
+                f"UPDATE items SET lease_expires = ? WHERE lease_owner = ? AND status = 'leased' AND id IN ({marks})",
+                (now + lease_seconds, node, *ids),
+            )
+            held = {r["id"] for r in con.execute(
+                f"SELECT id FROM items WHERE lease_owner = ? AND status = 'leased' AND id IN ({marks})", (node, *ids)
+            )}
+            return set(ids) - held
+        return self._write(renew)
+
+    def complete(self, node, item, result=None, urls=None):
+        """
+        Cierra un elemento prestado a `node` y, en la misma transacción, encola las `urls`
+        que descubrió (una query no se repite por morir entre ambas cosas). Devuelve las
+        URLs nuevas, o None si el préstamo ya había caducado (otro nodo lo tiene).
+        """
+        def done(con):
+            cur = con.execute(
+                "UPDATE items SET status = 'done', lease_owner = NULL, lease_expires = NULL, error = NULL, "
+                "result_json = ?, updated_at = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                (json.dumps(result, ensure_ascii=False) if result is not None else None, time.time(), item["id"], node),
+            )
+            if cur.rowcount != 1:
+                return None
+            return self._add_urls(con, item["campaign_id"], item.get("query", ""), urls) if urls else 0
+        return self._write(done)
+
+    def release(self, node, item_id, error=None, retry=True, charge=True) -> bool:
+        """
+        Devuelve un elemento a la cola (o lo marca 'failed' si no hay que reintentar o
+        agotó sus intentos). charge=False no cuenta el intento (parada ordenada del nodo).
+        """
+        step = 1 if charge else 0
+
+        def rel(con):
+            cur = con.execute(
+                "UPDATE items SET status = CASE WHEN ? AND attempts + ? < ? THEN 'pending' ELSE 'failed' END, "
+                "attempts = attempts + ?, error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                (int(bool(retry)), step, self.max_attempts, step, error, time.time(), item_id, node),
+            )
+            return cur.rowcount == 1
+        return self._write(rel)
+
+    def drained(self, campaign_id) -> bool:
+        """Nada pendiente ni prestado: la campaña terminó (salvo que alguien encole más)."""
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT COUNT(*) AS n FROM items WHERE campaign_id = ? AND status IN ('pending', 'leased')",
+                (campaign_id,),
+            ).fetchone()
+        return row["n"] == 0
+
+    # --- Leads ---
+    def add_lead(self, campaign_id, node, row) -> bool:
+        """Guarda el lead si su dominio no estaba ya en el almacén compartido."""
+        domain = normalize_domain(row.get("domain") or row.get("homepage_url"))
+        if not domain:
+            return False
+
+        def add(con):
+            cur = con.execute(
+                "INSERT OR IGNORE INTO leads (domain, campaign_id, node, row_json, created_at) VALUES (?, ?, ?, ?, ?)",
+                (domain, campaign_id, node, json.dumps(row, ensure_ascii=False), time.time()),
+            )
+            return cur.rowcount == 1
+        return self._write(add)
+
+    def iter_leads(self, campaign_id=None, batch=1000):
+        """Filas de leads (dicts), por orden de alta; todas las campañas si campaign_id es None."""
+        last = 0
+        where = "" if campaign_id is None else "AND campaign_id = ?"
+        args = () if campaign_id is None else (campaign_id,)
+        while True:
+            with self._connect() as con:
+                rows = con.execute(
+                    f"SELECT rowid, row_json FROM leads WHERE rowid > ? {where} ORDER BY rowid LIMIT ?",
+                    (last, *args, batch),
+                ).fetchall()
+            if not rows:
+                return
+            for r in rows:
+                yield json.loads(r["row_json"])
+            last = rows[-1]["rowid"]
+
+    # --- Nodos y estado ---
+    def node_heartbeat(self, node, started_at):
+        def beat(con):
+            con.execute(
+                "INSERT INTO nodes (node, host, pid, started_at, heartbeat) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(node) DO UPDATE SET host = excluded.host, pid = excluded.pid, "
+                "started_at = excluded.started_at, heartbeat = excluded.heartbeat",
+                (node, socket.gethostname(), os.getpid(), started_at, time.time()),
+            )
+        self._write(beat)
+
+    def stats(self, campaign_id):
+        """Elementos por clase y estado, leads guardados y nodos con latido reciente."""
+        with self._connect() as con:
+            counts = {f"{r['kind']}_{r['status']}": r["n"] for r in con.execute(
+                "SELECT kind, status, COUNT(*) AS n FROM items WHERE campaign_id = ? GROUP BY kind, status",
+                (campaign_id,),
+            )}
+            leads = con.execute("SELECT COUNT(*) AS n FROM leads WHERE campaign_id = ?", (campaign_id,)).fetchone()["n"]
+            nodes = [dict(r) for r in con.execute(
+                "SELECT node, host, pid, heartbeat FROM nodes WHERE heartbeat > ? ORDER BY node",
+                (time.time() - 3 * DEFAULT_LEASE_SECONDS,),
+            )]
+        return {"items": counts, "leads": leads, "nodes": nodes}
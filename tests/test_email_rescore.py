@@ -0,0 +1,98 @@
+import csv
+import random
+
+import pandas as pd
+import pytest
+
+from scrapinglatam.email_rescore import best_emails, rescore_leads
+from scrapinglatam.latam_lead_crawler_serpapi import EMAIL_PREFER, FIELDNAMES, pick_best_email
+
+CASES = [
+    # (emails_all, domain)
+    ("", "club.com.ar"),                                             # sin emails
+    ("   ", "club.com.ar"),
+    ("noreply@club.com.ar", "club.com.ar"),                          # todos vetados: el primero
+    ("noreply@club.com.ar, webmaster@club.com.ar", "club.com.ar"),
+    ("juan@club.com.ar, info@club.com.ar", "club.com.ar"),           # preferencia
+    ("info@club.com.ar, contacto@club.com.ar", "club.com.ar"),       # gana la primera palabra de EMAIL_PREFER
+    ("info@gmail.com, info@club.com.ar", "club.com.ar"),             # empate de preferencia: su dominio
+    ("info@club.com.ar, info@gmail.com", "club.com.ar"),
+    ("ana@gmail.com, pedro@gmail.com", "club.com.ar"),               # empate total: parte local más corta
+    ("ana@gmail.com, eva@gmail.com", "club.com.ar"),                 # y luego el orden en emails_all
+    ("eva@club.com.ar, ana@club.com.ar", "club.com.ar"),
+    ("noreply@club.com.ar, ventas@otro.com", "club.com.ar"),         # vetado + válido
+    ("juan@club.com.ar,,  ,pedro@x.com", "club.com.ar"),             # huecos en la lista
+    ("Info@Club.com.ar, a@gmail.com", "club.com.ar"),                # mayúsculas
+    ("contacto@uach.cl, info@otro.cl", ""),                          # fila sin dominio
+]
+
+
+def reference(emails_all, domain):
+    emails = [e.strip() for e in emails_all.split(",") if e.strip()]
+    return pick_best_email(emails, domain)
+
+
+def random_case(rng):
+    locals_ = ["juan", "ana", "x", "secretaria", "no-reply", "abuse", *EMAIL_PREFER[:6]]
+    domains = ["club.com.ar", "gmail.com", "uach.cl"]
+    emails = [f"{rng.choice(locals_)}{rng.choice(['', '2'])}@{rng.choice(domains)}" for _ in range(rng.randint(0, 5))]
+    return ", ".join(emails), rng.choice(domains + [""])
+
+
+def test_best_emails_matches_pick_best_email():
+    rng = random.Random(7)
+    cases = CASES + [random_case(rng) for _ in range(500)]
+    emails_all = pd.Series([c[0] for c in cases])
+    domains = pd.Series([c[1] for c in cases])
+    got = best_emails(emails_all, domains).tolist()
+    assert got == [reference(*c) for c in cases]
+
+
+@pytest.mark.parametrize("emails_all,domain", CASES)
+def test_best_emails_single_row(emails_all, domain):
+    got = best_emails(pd.Series([emails_all]), pd.Series([domain])).tolist()
+    assert got == [reference(emails_all, domain)]
+
+
+def write_leads(path, rows, blank_after=()):
+    with open(path, "w", encoding="utf-8-sig", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for i, row in enumerate(rows):
+            writer.writerow({k: row.get(k, "") for k in FIELDNAMES})
+            if i in blank_after:
+                fh.write("\r\n") # las líneas vacías no cuentan como fila
+
+
+def test_rescore_leads_rewrites_by_rowid_across_chunks(tmp_path):
+    path = str(tmp_path / "leads.csv")
+    rows = [
+        {"domain": "a.com.ar", "emails_all": "juan@a.com.ar, info@a.com.ar", "email_best": "juan@a.com.ar"},
+        {"domain": "b.com.ar", "emails_all": "info@b.com.ar", "email_best": "info@b.com.ar"},
+        {"domain": "c.com.ar", "emails_all": "", "email_best": ""},
+        {"domain": "d.com.ar", "emails_all": "noreply@d.com.ar, ventas@d.com.ar", "email_best": "noreply@d.com.ar"},
+        {"domain": "e.com.ar", "emails_all": "pedro@e.com.ar, contacto@e.com.ar", "email_best": "pedro@e.com.ar"},
+    ]
+    write_leads(path, rows, blank_after={0, 2})
+
+    total, changes = rescore_leads(path, chunk_rows=2)
+
+    assert total == 5
+    assert changes == {1: "info@a.com.ar", 4: "ventas@d.com.ar", 5: "contacto@e.com.ar"}
+    with open(path, encoding="utf-8-sig", newline="") as fh:
+        after = [r for r in csv.DictReader(fh)]
+    assert [r["domain"] for r in after] == ["a.com.ar", "b.com.ar", "c.com.ar", "d.com.ar", "e.com.ar"]
+    assert [r["email_best"] for r in after] == [
+        "info@a.com.ar", "info@b.com.ar", "", "ventas@d.com.ar", "contacto@e.com.ar"]
+
+    # Ya está al día: no hay nada más que cambiar
+    assert rescore_leads(path, chunk_rows=2) == (5, {})
+
+
+def test_rescore_leads_dry_run_leaves_csv_untouched(tmp_path):
+    path = str(tmp_path / "leads.csv")
+    write_leads(path, [{"domain": "a.com.ar", "emails_all": "juan@a.com.ar, info@a.com.ar",
+                        "email_best": "juan@a.com.ar"}])
+    before = open(path, "rb").read()
+    assert rescore_leads(path, dry_run=True) == (1, {1: "info@a.com.ar"})
+    assert open(path, "rb").read() == before
@@ -0,0 +1,85 @@
+import csv
+
+from scrapinglatam.latam_lead_crawler_serpapi import FIELDNAMES
+from scrapinglatam.lead_compaction import compact_leads, rotated_files
+
+FILLER_ROWS = 1500 # ~3 MB de filas de relleno: con memory_mb=1 salen varias particiones
+
+
+def lead(domain, emails, last_seen, email_sent="No", category="club"):
+    emails = emails.split(", ") if emails else []
+    return {"query": f"{category} site:.ar", "country": "ar", "category": category, "domain": domain,
+            "homepage_url": f"https://{domain}/", "http_status": "200", "duration_ms": "10",
+            "emails_all": ", ".join(emails), "email_best": emails[0] if emails else "", "phones": "",
+            "priority": "1", "last_seen": last_seen, "email_sent": email_sent}
+
+
+def filler(start, n, last_seen):
+    pad = "x" * 2000 # filas gordas: el tamaño de entrada decide el número de particiones
+    return [dict(lead(f"relleno{i}.com.ar", f"info@relleno{i}.com.ar", f"{last_seen}{i:05d}"), phones=pad)
+            for i in range(start, start + n)]
+
+
+def write_csv(path, rows):
+    with open(path, "w", encoding="utf-8-sig", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_csv(path):
+    with open(path, encoding="utf-8-sig", newline="") as fh:
+        return list(csv.DictReader(fh))
+
+
+def test_compaction_merges_live_and_rotated_csvs(tmp_path):
+    live = tmp_path / "latam_leads.csv"
+    write_csv(tmp_path / "latam_leads_OLD_20250101_000000.csv", [
+        lead("club.com.ar", "socios@club.com.ar", "2025-01-01T10:00:00", email_sent="Sí", category="viejo"),
+        lead("otro.cl", "contacto@uach.cl", "2025-01-01T11:00:00"), # se vio antes, pero no es suyo
+        lead("enviado.cl", "contacto@uach.cl", "2025-01-01T12:00:00", email_sent="Sí"),
+        *filler(0, FILLER_ROWS // 2, "2024-06-01T"),
+    ])
+    write_csv(tmp_path / "latam_leads_OLD_20250201_000000.csv", [
+        lead("club.com.ar", "info@club.com.ar", "2025-02-01T10:00:00", category="medio"),
+        lead("uach.cl", "contacto@uach.cl", "2025-02-01T11:00:00"),
+        *filler(FILLER_ROWS // 2, FILLER_ROWS // 2, "2024-07-01T"),
+    ])
+    write_csv(live, [
+        lead("club.com.ar", "info@club.com.ar", "2025-03-01T10:00:00", category="nuevo"),
+    ])
+    assert len(rotated_files(str(live))) == 2
+
+    stats = compact_leads(str(live), memory_mb=1)
+
+    assert stats["inputs"] == 3
+    assert stats["partitions"] > 1 # reparto en disco y merge externo de varias particiones
+    rows = read_csv(live)
+    assert list(rows[0]) == FIELDNAMES
+    by_domain = {r["domain"]: r for r in rows}
+    assert len(rows) == len(by_domain) == stats["rows_out"]
+    # Salida ordenada por last_seen tras el merge de las particiones
+    assert [r["last_seen"] for r in rows] == sorted(r["last_seen"] for r in rows)
+
+    # Una fila por dominio: la más reciente, con los emails de todas las versiones
+    club = by_domain["club.com.ar"]
+    assert club["category"] == "nuevo"
+    assert club["last_seen"] == "2025-03-01T10:00:00"
+    assert set(club["emails_all"].split(", ")) == {"info@club.com.ar", "socios@club.com.ar"}
+    # Enviado en alguna versión -> sigue enviado
+    assert club["email_sent"] == "Sí"
+
+    # El email repetido se queda en su propio dominio aunque otro lo viera antes
+    assert by_domain["uach.cl"]["emails_all"] == "contacto@uach.cl"
+    assert stats["emails_moved"] == 2
+    # Sin emails: fuera, salvo que ya se le hubiera escrito
+    assert "otro.cl" not in by_domain
+    assert by_domain["enviado.cl"]["emails_all"] == ""
+    assert by_domain["enviado.cl"]["email_best"] == ""
+    assert stats["rows_dropped"] == 1
+
+    assert sum(d.startswith("relleno") for d in by_domain) == FILLER_ROWS
+    assert stats["rows_in"] == FILLER_ROWS + 6
+    assert stats["domains"] == FILLER_ROWS + 4
+    # Sin restos de las particiones temporales
+    assert sorted(p.name for p in tmp_path.iterdir() if not p.name.endswith(".csv")) == ["latam_leads.csv.lock"]
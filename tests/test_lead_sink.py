@@ -0,0 +1,39 @@
+import csv
+
+from scrapinglatam.lead_sink import LeadSink
+
+
+def read_rows(path):
+    with open(path, encoding="utf-8-sig", newline="") as fh:
+        return list(csv.DictReader(fh))
+
+
+def test_new_trailing_column_extends_header_in_place(tmp_path):
+    path = str(tmp_path / "leads.csv")
+    old = LeadSink(path, ["domain", "email_best"])
+    old.add({"domain": "club.com.ar", "email_best": "info@club.com.ar"})
+    old.close()
+
+    new = LeadSink(path, ["domain", "email_best", "near_dup_of"])
+    new.add({"domain": "club.com.uy", "email_best": "info@club.com.ar", "near_dup_of": "club.com.ar"})
+    new.close()
+
+    assert [p.name for p in tmp_path.iterdir() if "_OLD_" in p.name] == []
+    rows = read_rows(path)
+    assert [r["domain"] for r in rows] == ["club.com.ar", "club.com.uy"]
+    assert rows[0]["near_dup_of"] is None # fila antigua: sin la columna nueva
+    assert rows[1]["near_dup_of"] == "club.com.ar"
+
+
+def test_incompatible_header_rotates_the_csv(tmp_path):
+    path = str(tmp_path / "leads.csv")
+    old = LeadSink(path, ["domain", "phones"])
+    old.add({"domain": "club.com.ar", "phones": "+54 11 4444 5555"})
+    old.close()
+
+    new = LeadSink(path, ["domain", "email_best"])
+    new.add({"domain": "club.com.uy", "email_best": "info@club.com.uy"})
+    new.close()
+
+    assert len([p for p in tmp_path.iterdir() if "_OLD_" in p.name]) == 1
+    assert read_rows(path) == [{"domain": "club.com.uy", "email_best": "info@club.com.uy"}]
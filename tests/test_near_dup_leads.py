@@ -0,0 +1,48 @@
+import asyncio
+import random
+
+from scrapinglatam.latam_lead_crawler_serpapi import CrawlerConfig, LeadCrawler
+
+rng = random.Random(1)
+BODY = " ".join(rng.choice([f"w{i}" for i in range(3000)]) for _ in range(4000))
+
+
+def page(*emails):
+    links = " ".join(f"<a href='mailto:{e}'>{e}</a>" for e in emails)
+    return f"<html><body><p>{BODY}</p><footer>{links}</footer></body></html>"
+
+
+def item(domain, content):
+    url = f"https://{domain}/"
+    return {"query": "club site:.ar", "domain": domain, "url": url, "final_url": url, "serp_domain": domain,
+            "http_status": 200, "content": content, "priority": 1, "duration_ms": 1, "timings": None,
+            "exclusion_flag": "N"}
+
+
+def extract(tmp_path, *items):
+    crawler = LeadCrawler(CrawlerConfig(output_csv=str(tmp_path / "leads.csv"),
+                                        audit_path=str(tmp_path / "audit.ndjson")))
+
+    async def run():
+        return [await crawler.extract_page(i) for i in items]
+    return crawler, asyncio.run(run())
+
+
+def test_near_duplicate_with_same_emails_reuses_contacts_and_keeps_its_lead(tmp_path):
+    crawler, (first, dup) = extract(tmp_path, item("club.com.ar", page("info@club.com")),
+                                    item("club.com.uy", page("info@club.com")))
+    assert crawler.metrics["near_duplicates"] == 1
+    assert dup["audit"]["near_dup_of"]["domain"] == "club.com.ar"
+    assert dup["row"]["domain"] == "club.com.uy"
+    assert dup["row"]["emails_all"] == "info@club.com"
+    assert dup["row"]["near_dup_of"] == "club.com.ar"
+    assert first["row"]["near_dup_of"] == ""
+
+
+def test_near_duplicate_with_extra_emails_is_extracted_again(tmp_path):
+    crawler, (_, other) = extract(tmp_path, item("club.com.ar", page("info@club.com")),
+                                  item("club.com.uy", page("info@club.com", "uruguay@club.com.uy")))
+    assert crawler.metrics["near_duplicates"] == 0
+    assert other["audit"]["near_dup_of"] is None
+    assert set(other["row"]["emails_all"].split(", ")) == {"info@club.com", "uruguay@club.com.uy"}
+    assert other["row"]["near_dup_of"] == ""
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from scrapinglatam.fetchers import FetchResult
+from scrapinglatam.latam_lead_crawler_serpapi import CrawlerConfig, LeadCrawler
+from scrapinglatam.serpapi_keys import SerpKeyPool
+
+
+class SlowFrontier:
+    """Frontera de pega: cada visita tarda, así las queries se solapan en el pipeline."""
+
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.urls = []
+
+    async def fetch(self, fetcher, url):
+        self.urls.append(url)
+        await asyncio.sleep(self.delay)
+        return FetchResult(200, "<html><a href='mailto:info@club.com.ar'>info@club.com.ar</a></html>",
+                           int(self.delay * 1000), final_url=url)
+
+
+class DummyFetcher:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class StubCrawler(LeadCrawler):
+    """SERP fijo: todas las queries devuelven el mismo sitio (con URLs distintas)."""
+
+    def __init__(self, config, serp):
+        key_pool = SerpKeyPool(["test-key"])
+        key_pool._primed_at = time.time() # sin consultar el saldo de la cuenta
+        super().__init__(config, key_pool=key_pool)
+        self.serp = serp
+        self.frontier_stub = SlowFrontier()
+
+    async def fetch_serpapi(self, query, params):
+        return self.serp.get(query, []) if params.get("start", 0) == 0 else []
+
+    def build_frontier(self):
+        return self.frontier_stub
+
+    def build_fetcher(self, session=None):
+        return DummyFetcher()
+
+
+def make_config(tmp_path, categories):
+    return CrawlerConfig(
+        countries=["site:.ar"], categories=categories, max_queries=len(categories),
+        results_per_query=10, output_csv=str(tmp_path / "leads.csv"), audit_path=str(tmp_path / "audit.ndjson"),
+        serp_done_path=str(tmp_path / "serp_done.json"), ledger_path=str(tmp_path / "ledger.ndjson"),
+        query_pause=0, fetch_workers=4, respect_robots=False, serpapi_key="test-key",
+    )
+
+
+async def collect(crawler):
+    return [event async for event in crawler.run()]
+
+
+def test_overlapping_queries_write_one_lead_per_domain(tmp_path):
+    config = make_config(tmp_path, ["club", "futbol"])
+    serp = {
+        "club site:.ar": [{"link": "https://club.com.ar/", "position": 1}],
+        "futbol site:.ar": [{"link": "https://club.com.ar/contacto", "position": 1}],
+    }
+    crawler = StubCrawler(config, serp)
+    events = asyncio.run(collect(crawler))
+
+    leads = [e["row"] for e in events if e["type"] == "lead"]
+    assert [row["domain"] for row in leads] == ["club.com.ar"]
+    # La segunda query ni siquiera lo visita: el dominio se reservó al encolarlo
+    assert crawler.frontier_stub.urls == ["https://club.com.ar/"]
+    assert crawler.metrics["filtered_seen"] == 1
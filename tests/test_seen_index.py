@@ -0,0 +1,119 @@
+import os
+import multiprocessing
+
+import pytest
+
+from scrapinglatam import seen_index
+from scrapinglatam.seen_index import HEADER, RECORD, SeenDomainIndex
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return str(tmp_path / "leads_seen.idx")
+
+
+def test_add_get_round_trip(index_path):
+    idx = SeenDomainIndex(index_path)
+    assert idx.get("club.com.ar") is None
+    idx.add("club.com.ar", 1_700_000_000)
+    idx.add("UACH.cl", 1_700_000_500.9)
+    idx.add("club.com.ar", 1_700_000_900) # actualiza: gana el último
+    assert idx.get("club.com.ar") == 1_700_000_900
+    assert idx.get("uach.cl") == 1_700_000_500 # sin distinguir mayúsculas, en segundos
+    assert "uach.cl" in idx and "otro.cl" not in idx
+    idx.add("negativo.cl", -5) # fuera de rango de 32 bits: se recorta
+    idx.add("futuro.cl", 1 << 40)
+    assert (idx.get("negativo.cl"), idx.get("futuro.cl")) == (0, 0xFFFFFFFF)
+    # Solo se anexa: cabecera + un registro de 12 bytes por alta
+    assert RECORD.size == 12
+    assert os.path.getsize(index_path) == HEADER.size + 5 * RECORD.size
+    idx.close()
+
+    again = SeenDomainIndex(index_path)
+    assert again.get("club.com.ar") == 1_700_000_900
+    assert again.sorted_count == 0 and len(again.tail) == 4
+    again.close()
+
+
+def test_reopen_after_compaction(index_path):
+    idx = SeenDomainIndex(index_path)
+    for i in range(100):
+        idx.add(f"d{i}.com.ar", 1_000 + i)
+    idx.compact()
+    assert (idx.sorted_count, idx.tail) == (100, {})
+    # Altas tras la compactación: cola sobre la zona ordenada, y una que pisa un registro ordenado
+    idx.add("d5.com.ar", 9_999)
+    idx.add("nuevo.cl", 5_000)
+    idx.close()
+
+    again = SeenDomainIndex(index_path)
+    assert again.sorted_count == 100
+    assert again.get("d5.com.ar") == 9_999 # la cola manda sobre la zona ordenada
+    assert again.get("d99.com.ar") == 1_099
+    assert again.get("nuevo.cl") == 5_000
+    assert again.get("d100.com.ar") is None
+    again.compact()
+    assert os.path.getsize(index_path) == HEADER.size + 101 * RECORD.size
+    assert again.get("d5.com.ar") == 9_999
+    again.close()
+
+
+def test_build_keeps_latest_timestamp(index_path):
+    idx = SeenDomainIndex.build(index_path, [("a.cl", 10), ("b.cl", 20), ("a.cl", 30), ("a.cl", 5)])
+    assert (idx.sorted_count, idx.get("a.cl"), idx.get("b.cl")) == (2, 30, 20)
+    idx.close()
+
+
+def test_second_instance_sees_appends_and_compaction(index_path, monkeypatch):
+    monkeypatch.setattr(seen_index, "REFRESH_SECONDS", 0.0)
+    writer = SeenDomainIndex(index_path)
+    reader = SeenDomainIndex(index_path)
+    writer.add("club.com.ar", 100)
+    assert reader.get("club.com.ar") == 100 # el archivo creció: lee solo lo nuevo
+    writer.compact() # otro inodo: el lector reabre
+    writer.add("uach.cl", 200)
+    assert reader.get("club.com.ar") == 100
+    assert reader.get("uach.cl") == 200
+    assert reader.sorted_count == 1
+    # Y al revés: el lector anexa sobre el archivo ya compactado, no sobre el viejo
+    reader.add("otro.cl", 300)
+    assert writer.get("otro.cl") == 300
+    writer.close()
+    reader.close()
+
+
+def test_get_checks_the_file_at_most_once_per_interval(index_path, monkeypatch):
+    idx = SeenDomainIndex(index_path)
+    calls = []
+    real_stat = os.stat
+    monkeypatch.setattr(seen_index.os, "stat", lambda p, *a, **k: calls.append(p) or real_stat(p, *a, **k))
+    for i in range(1000):
+        idx.get(f"d{i}.com.ar")
+    assert len(calls) <= 1
+    monkeypatch.setattr(seen_index, "REFRESH_SECONDS", 0.0)
+    idx.get("club.com.ar")
+    assert len(calls) >= 1
+    idx.close()
+
+
+def _add_many(path, prefix, n):
+    seen_index.MIN_TAIL_TO_COMPACT = 64 # compactaciones frecuentes mientras el otro anexa
+    idx = SeenDomainIndex(path)
+    for i in range(n):
+        idx.add(f"{prefix}{i}.com.ar", 1_000 + i)
+    idx.close()
+
+
+@pytest.mark.skipif(os.name == "nt", reason="sin flock ni fork en Windows")
+def test_concurrent_processes_lose_no_appends(index_path):
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_add_many, args=(index_path, prefix, 1500)) for prefix in ("a", "b", "c")]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+    idx = SeenDomainIndex(index_path)
+    missing = [f"{prefix}{i}" for prefix in "abc" for i in range(1500) if idx.get(f"{prefix}{i}.com.ar") is None]
+    assert missing == []
+    idx.close()
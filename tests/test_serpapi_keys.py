@@ -0,0 +1,157 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from scrapinglatam import serpapi_keys
+from scrapinglatam.serpapi_keys import (
+    BACKOFF_BASE, KeysExhausted, SerpKeyPool, classify_response, is_cached,
+)
+
+
+class FakeClock:
+    """time.time() y asyncio.sleep() de serpapi_keys sobre un reloj que solo avanza al dormir."""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(serpapi_keys, "time", SimpleNamespace(time=clock.time))
+    monkeypatch.setattr(serpapi_keys, "asyncio", SimpleNamespace(sleep=clock.sleep, to_thread=asyncio.to_thread))
+    monkeypatch.setattr(serpapi_keys, "random", SimpleNamespace(uniform=lambda a, b: 1.0)) # backoff sin jitter
+    return clock
+
+
+def acquire(pool):
+    return asyncio.run(pool.acquire())
+
+
+@pytest.mark.parametrize("status,error,outcome", [
+    (200, None, "ok"),
+    (200, "Google hasn't returned any results for this query.", "empty"),
+    (401, "Invalid API key. Your API key should be here: ...", "invalid"),
+    (200, "Invalid API key.", "invalid"),
+    (429, "Your account has run out of searches.", "exhausted"),
+    (200, "You have reached the plan searches left limit", "exhausted"),
+    (429, "Too many requests", "rate_limited"),
+    (None, "Connection reset", "retry"),
+    (503, "Service Unavailable", "retry"),
+    (400, "Missing query `q` parameter.", "error"),
+])
+def test_classify_response(status, error, outcome):
+    assert classify_response(status, error) == outcome
+
+
+@pytest.mark.parametrize("data,cached", [
+    ({"search_metadata": {"status": "Success", "cached": True}}, True),
+    ({"search_metadata": {"status": "Cached"}}, True),
+    ({"search_metadata": {"status": "Success"}}, False),
+    ({"search_metadata": {"status": "Success", "cached": False}}, False),
+    ({"organic_results": []}, False),
+    ({"search_metadata": None}, False),
+    (None, False),
+])
+def test_is_cached(data, cached):
+    assert is_cached(data) is cached
+
+
+def test_duplicate_and_blank_keys_are_ignored():
+    pool = SerpKeyPool(["a", " a ", "", None, "b"])
+    assert [k.api_key for k in pool.keys] == ["a", "b"]
+    with pytest.raises(ValueError):
+        SerpKeyPool(["a"], strategy="random")
+
+
+def test_least_used_prefers_fewest_searches_then_most_balance(clock):
+    pool = SerpKeyPool(["a", "b", "c"])
+    a, b, c = pool.keys
+    a.remaining, b.remaining, c.remaining = 10, 50, 30
+    assert acquire(pool) is b # a igualdad de uso, la de más saldo
+    pool.report(b, 200)
+    assert acquire(pool) is c
+    pool.report(c, 200)
+    assert acquire(pool) is a
+    pool.report(a, 200)
+    assert (a.used, b.used, c.used) == (1, 1, 1)
+    assert (a.remaining, b.remaining, c.remaining) == (9, 49, 29)
+
+
+def test_round_robin_takes_turns_and_skips_retired_keys(clock):
+    pool = SerpKeyPool(["a", "b", "c"], strategy="round_robin")
+    a, b, c = pool.keys
+    assert [acquire(pool) for _ in range(4)] == [a, b, c, a]
+    pool.report(b, 401, "Invalid API key.")
+    assert [acquire(pool) for _ in range(3)] == [c, a, c]
+
+
+def test_exhausted_and_invalid_keys_are_retired(clock):
+    pool = SerpKeyPool(["a", "b"])
+    a, b = pool.keys
+    assert pool.report(a, 200, "Your account has run out of searches.") == "exhausted"
+    assert a.disabled == "exhausted" and pool.usable() == [b]
+    assert pool.report(b, 401, "Invalid API key.") == "invalid"
+    assert pool.exhausted()
+    with pytest.raises(KeysExhausted):
+        acquire(pool)
+
+
+def test_key_retires_when_its_balance_runs_out(clock):
+    pool = SerpKeyPool(["a"])
+    [a] = pool.keys
+    a.remaining = 2
+    pool.report(a, 200, cached=True) # de la caché: gratis
+    assert (a.used, a.remaining) == (0, 2)
+    pool.report(a, 200, "Google hasn't returned any results for this query.") # vacío: no gasta
+    pool.report(a, 200)
+    assert not a.disabled
+    pool.report(a, 200)
+    assert (a.used, a.remaining, a.disabled) == (2, 0, "exhausted")
+
+
+def test_rate_limited_key_cools_down_with_exponential_backoff(clock):
+    pool = SerpKeyPool(["a", "b"])
+    a, b = pool.keys
+    assert pool.report(a, 429, "Too many requests") == "rate_limited"
+    assert a.cooldown_until == clock.now + BACKOFF_BASE
+    assert pool.report(a, 429, "Too many requests") == "rate_limited"
+    assert a.cooldown_until == clock.now + BACKOFF_BASE * 2 # segundo 429 seguido: el doble
+    assert a.strikes == 2
+    assert acquire(pool) is b # la que se enfría no se elige
+    b.disabled = "invalid"
+    assert acquire(pool) is a # sola: se espera al fin del enfriamiento
+    assert clock.now == pytest.approx(1_000_000.0 + BACKOFF_BASE * 2)
+    pool.report(a, 200)
+    assert a.strikes == 0
+
+
+def test_rate_per_minute_window_makes_acquire_wait(clock):
+    pool = SerpKeyPool(["a"], rate_per_minute=2)
+    start = clock.now
+    [acquire(pool) for _ in range(3)]
+    assert clock.now - start == pytest.approx(60.0) # la tercera espera a que salga la primera
+    assert clock.slept
+
+
+def test_prime_reads_balance_and_retires_dead_keys(clock, monkeypatch):
+    accounts = {
+        "a": {"plan_searches_left": 120, "account_rate_limit_per_hour": 1000},
+        "b": {"plan_searches_left": 0},
+        "c": {"error": "Invalid API key. Your API key should be here: ..."},
+    }
+    monkeypatch.setattr(serpapi_keys, "fetch_account_info", lambda key: accounts[key])
+    pool = SerpKeyPool(["a", "b", "c"])
+    asyncio.run(pool.prime(log=lambda message: None))
+    a, b, c = pool.keys
+    assert (a.remaining, a.window, a.disabled) == (120, (1000, 3600.0), "")
+    assert (b.disabled, c.disabled) == ("exhausted", "invalid")
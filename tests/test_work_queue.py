@@ -0,0 +1,71 @@
+import time
+
+from scrapinglatam.work_queue import WorkQueue
+
+SHORT_LEASE = 0.05
+
+
+def make_queue(tmp_path, queries=("club site:.ar",), **kwargs):
+    queue = WorkQueue(str(tmp_path / "campaign.sqlite"), **kwargs)
+    campaign_id = queue.create_campaign("test", {}, list(queries))
+    return queue, campaign_id
+
+
+def item_row(queue, item_id):
+    with queue._connect() as con:
+        return dict(con.execute("SELECT * FROM items WHERE id = ?", (item_id,)).fetchone())
+
+
+def test_expired_lease_goes_back_to_the_queue(tmp_path):
+    queue, campaign_id = make_queue(tmp_path)
+    [item] = queue.lease(campaign_id, "node-a", lease_seconds=SHORT_LEASE)
+    assert queue.lease(campaign_id, "node-b") == [] # prestado y aún vigente
+    time.sleep(SHORT_LEASE * 2)
+
+    [again] = queue.lease(campaign_id, "node-b")
+    assert again["id"] == item["id"]
+    assert again["attempts"] == 1
+    row = item_row(queue, item["id"])
+    assert row["lease_owner"] == "node-b"
+    assert row["error"] == "lease expired (node-a)"
+
+
+def test_complete_after_lost_lease_is_rejected(tmp_path):
+    queue, campaign_id = make_queue(tmp_path)
+    [item] = queue.lease(campaign_id, "node-a", lease_seconds=SHORT_LEASE)
+    time.sleep(SHORT_LEASE * 2)
+    [again] = queue.lease(campaign_id, "node-b")
+
+    urls = [{"link": "https://club.com.ar/", "position": 1}]
+    # node-a terminó tarde: ni cierra el elemento ni encola sus URLs
+    assert queue.complete("node-a", item, result={"status": "ok"}, urls=urls) is None
+    assert queue.renew("node-a", {item["id"]}) == {item["id"]}
+    assert item_row(queue, item["id"])["status"] == "leased"
+    assert queue.lease(campaign_id, "node-c", kinds=("url",)) == []
+
+    assert queue.complete("node-b", again, result={"status": "ok"}, urls=urls) == 1
+    assert item_row(queue, item["id"])["status"] == "done"
+    [url_item] = queue.lease(campaign_id, "node-c", kinds=("url",))
+    assert url_item["url"] == "https://club.com.ar/"
+
+
+def test_renew_keeps_a_live_lease(tmp_path):
+    queue, campaign_id = make_queue(tmp_path)
+    [item] = queue.lease(campaign_id, "node-a", lease_seconds=SHORT_LEASE)
+    assert queue.renew("node-a", {item["id"]}, lease_seconds=60) == set()
+    time.sleep(SHORT_LEASE * 2)
+    assert queue.lease(campaign_id, "node-b") == []
+    assert queue.complete("node-a", item, result={}) == 0
+
+
+def test_item_fails_after_max_attempts_of_expired_leases(tmp_path):
+    queue, campaign_id = make_queue(tmp_path, max_attempts=2)
+    [item] = queue.lease(campaign_id, "node-a", lease_seconds=SHORT_LEASE)
+    time.sleep(SHORT_LEASE * 2)
+    queue.lease(campaign_id, "node-b", lease_seconds=SHORT_LEASE)
+    time.sleep(SHORT_LEASE * 2)
+
+    assert queue.lease(campaign_id, "node-c") == []
+    row = item_row(queue, item["id"])
+    assert (row["status"], row["attempts"]) == ("failed", 2)
+    assert queue.drained(campaign_id)